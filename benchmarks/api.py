@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Measure throughput of the /api/roll batch endpoint, streaming the
+# NDJSON response back through the Flask test client.
+#
+# Usage: python -m benchmarks.api [--rolls 100000] [--batch 10000]
+
+import os
+import argparse
+from time import perf_counter
+
+from cryptography.fernet import Fernet
+
+
+# Mix of rolls to send
+ROLLS = ['d20', '4d10', '1d6+3', '10d6 hit5', '2d6+1d8-2', '4d6kh3', '3d6!']
+
+
+def main():
+    """Send batches of rolls and report rolls per second."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rolls', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--ndjson', action='store_true',
+                        help='send batches as NDJSON instead of JSON')
+    args = parser.parse_args()
+
+    os.environ['API_TOKENS'] = 'benchmark'
+    os.environ['API_MAX_BATCH'] = str(args.batch)
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    os.environ.setdefault('TOKEN_KEY', Fernet.generate_key().decode())
+    os.environ.setdefault('SECURE_KEY_STR', 'benchmark')
+    os.environ.setdefault('SLACK_CLIENT_SECRET', 'benchmark')
+    os.environ.setdefault('EVENT_SINK', 'file')
+    os.environ.setdefault('EVENT_LOG_PATH', os.devnull)
+
+    # pylint: disable=import-outside-toplevel
+    from slack_roll.app import app
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer benchmark'}
+    batch = [ROLLS[index % len(ROLLS)] for index in range(args.batch)]
+    ndjson = ''.join(f'"{text}"\n' for text in batch)
+
+    results = 0
+    start = perf_counter()
+
+    while results < args.rolls:
+        if args.ndjson:
+            response = client.post('/api/roll', data=ndjson, headers=headers,
+                                   content_type='application/x-ndjson')
+        else:
+            response = client.post('/api/roll', json={'rolls': batch},
+                                   headers=headers)
+
+        # Consume the stream line by line
+        for _ in response.response:
+            results += 1
+
+    elapsed = perf_counter() - start
+    print(f'{results} rolls in {elapsed:.2f}s, '
+          f'{results / elapsed:.0f} rolls/s')
+
+
+if __name__ == '__main__':
+    main()
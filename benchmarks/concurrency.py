@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Time thousands of mixed valid and invalid rolls through the parser and
+# roll engine from many threads at once. tests/test_concurrency.py checks
+# that each request gets its own correct reply back.
+#
+# Usage: python -m benchmarks.concurrency [--requests 5000] [--threads 32]
+
+import os
+import random
+import argparse
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import Fernet
+
+
+# Rolls that should succeed, with the expression they normalize to
+VALID_ROLLS = {
+    '': '1d6',
+    'd20': '1d20',
+    '4d10': '4d10',
+    '1d6+3': '1d6+3',
+    '10d6 hit5': '10d6 hit5',
+    '2d6+1d8-2': '2d6+1d8-2',
+    '4d6kh3': '4d6kh3',
+    '3d6!': '3d6!',
+    '4d6r1': '4d6r1'
+}
+
+# Rolls that should be rejected, or answered with a message
+INVALID_ROLLS = ['bogus', '1d6+', '3d4 hit7', '2d6 x', 'd6!!']
+MESSAGES = ['help', 'version']
+
+
+def main():
+    """Run the requests concurrently and report the timings."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=32)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+    os.environ.setdefault('TOKEN_KEY', Fernet.generate_key().decode())
+    for name in ('SECURE_KEY_STR', 'SLACK_CLIENT_ID', 'SLACK_CLIENT_SECRET'):
+        os.environ.setdefault(name, 'benchmark')
+
+    # pylint: disable=import-outside-toplevel
+    from slack_roll import allowed_commands, roll
+
+    def run_request(request):
+        """Parse and roll one request."""
+        request_id, text, command = request
+
+        try:
+            result = roll.parse_roll({'text': text, 'command': command})
+        except roll.RollMessage:
+            return
+        roll.do_roll(result, f'user{request_id}')
+
+    texts = list(VALID_ROLLS) + INVALID_ROLLS + MESSAGES
+    requests = [
+        (request_id, random.choice(texts), random.choice(allowed_commands))
+        for request_id in range(args.requests)
+    ]
+
+    for threads in (1, args.threads):
+        start = perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(run_request, requests))
+        elapsed = perf_counter() - start
+
+        print(f'{len(requests)} requests on {threads} threads '
+              f'in {elapsed:.2f}s, '
+              f'{elapsed / len(requests) * 1e6:.1f}us/request')
+
+
+if __name__ == '__main__':
+    main()
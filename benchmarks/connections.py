@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Check that Slack API calls from many threads share pooled keep-alive
+# connections instead of opening one per call.
+#
+# Usage: python -m benchmarks.connections [--calls 1000] [--threads 8]
+
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_slack import FakeSlack
+
+
+def main():
+    """Make many auth.test and chat.postMessage calls and count sockets."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    with FakeSlack() as fake:
+        os.environ['SLACK_API_URL'] = fake.api_url
+        os.environ['SLACK_POOL_SIZE'] = str(args.threads)
+
+        # pylint: disable=import-outside-toplevel
+        from slacker import Auth, Chat
+        from slack_roll import slack
+
+        def call(index):
+            if index % 2:
+                slack.get_api(Auth, 'xoxp-fake').test()
+            else:
+                slack.get_api(Chat, 'xoxb-fake').post_message('C1', 'hi')
+
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(call, range(args.calls)))
+
+        print(f'{len(fake.calls)} calls over {fake.connections} connections')
+
+    # Every call on its own connection means nothing was reused
+    sys.exit(0 if fake.connections <= args.threads else 1)
+
+
+if __name__ == '__main__':
+    main()
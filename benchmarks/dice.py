@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Compare the batched dice engine against the original per-die loop.
+#
+# Usage: python -m benchmarks.dice [--sides 6] [--hit 5] [--repeat 5]
+
+import random
+import argparse
+from timeit import repeat
+
+from slack_roll import rng
+from slack_roll.expression import compile_roll
+
+
+def loop_roll(count, sides, hit):
+    """Roll a pool one die at a time, the way do_roll used to."""
+    roll_data = {
+        'sum': 0,
+        'result': [],
+        'hits': 0,
+        'hits_crit': 0,
+        'misses': 0,
+        'misses_crit': 0
+    }
+
+    for _ in range(count):
+        die_roll = random.randint(1, sides)
+        roll_data['sum'] += die_roll
+        roll_data['result'].append(die_roll)
+
+        if die_roll >= hit:
+            if die_roll == sides:
+                roll_data['hits_crit'] += 1
+            roll_data['hits'] += 1
+        else:
+            if die_roll == 1:
+                roll_data['misses_crit'] += 1
+            roll_data['misses'] += 1
+
+    return roll_data
+
+
+def best_time(func, number, times):
+    """Return the best time per call in microseconds."""
+    return min(repeat(func, number=number, repeat=times)) / number * 1e6
+
+
+def main():
+    """Time each engine across a range of pool sizes."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sides', type=int, default=6)
+    parser.add_argument('--hit', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = 'numpy' if rng.get_numpy() is not None else 'stdlib'
+    print(f'engine: {engine}')
+    print(f"{'dice':>10} {'loop (us)':>14} {'batched (us)':>14} "
+          f"{'histogram (us)':>16} {'speedup':>8}")
+
+    for count in (10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6):
+        number = max(1, 10 ** 5 // count)
+        expression = compile_roll(
+            f'{count}d{args.sides} hit{args.hit}', max_dice=count)
+
+        loop = best_time(
+            lambda: loop_roll(count, args.sides, args.hit),
+            number, args.repeat)
+        batched = best_time(
+            lambda: expression.evaluate(max_listed=count),
+            number, args.repeat)
+        histogram = best_time(
+            lambda: expression.evaluate(max_listed=0),
+            number, args.repeat)
+
+        print(f'{count:>10} {loop:>14.1f} {batched:>14.1f} '
+              f'{histogram:>16.1f} {loop / histogram:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
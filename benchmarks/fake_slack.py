@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# In-process fake of the Slack Web API for benchmarks and stress runs.
+#
+# Point the app at it by setting SLACK_API_URL to FakeSlack().api_url.
+
+import json
+from time import sleep
+from threading import Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+# Default successful responses for the methods the app calls
+DEFAULT_RESPONSES = {
+    'auth.test': {'ok': True, 'team_id': 'T00000000', 'user_id': 'U0000'},
+    'chat.postMessage': {'ok': True, 'ts': '1500000000.000100'},
+    'oauth.access': {
+        'ok': True,
+        'access_token': 'xoxp-fake',
+        'team_id': 'T00000000',
+        'bot': {'bot_user_id': 'B0000', 'bot_access_token': 'xoxb-fake'}
+    }
+}
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    """Answer Slack API calls with canned responses over keep-alive."""
+
+    protocol_version = 'HTTP/1.1'
+
+    # Send small responses straight away instead of waiting on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        """Count every new connection made to the server."""
+        super().setup()
+        self.server.fake.count_connection()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keep request logs quiet."""
+
+    def _read_params(self):
+        """Read form or JSON parameters from the request."""
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(body or '{}')
+
+        query = self.path.partition('?')[2]
+        params = parse_qs(query)
+        params.update(parse_qs(body))
+        return {key: values[-1] for key, values in params.items()}
+
+    def _respond(self):
+        """Record the call and send back the configured response."""
+        path = self.path.partition('?')[0]
+        method = path.rsplit('/', 1)[-1]
+        params = self._read_params()
+
+        status, headers, body = self.server.fake.handle(method, params)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+
+class FakeSlackServer(ThreadingHTTPServer):
+    """Threaded server with room for many pending connections."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeSlack:
+    """A threaded fake Slack server with optional latency and overrides."""
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0):
+        """Bind the server; call start() to begin answering requests."""
+        self.latency = latency
+        self.calls = []
+        self.connections = 0
+        self.overrides = {}
+        self._lock = Lock()
+        self._server = FakeSlackServer((host, port), FakeSlackHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """Return the base URL of the server."""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    @property
+    def api_url(self):
+        """Return the URL to use as SLACK_API_URL."""
+        return f'{self.url}api/'
+
+    def count_connection(self):
+        """Record a newly opened connection."""
+        with self._lock:
+            self.connections += 1
+
+    def handle(self, method, params):
+        """Return (status, headers, body) for an API call."""
+        with self._lock:
+            self.calls.append((method, params))
+
+        if self.latency:
+            sleep(self.latency)
+
+        # Let callers replace the response for a method
+        override = self.overrides.get(method)
+        if override is not None:
+            status, headers, body = override(params)
+        else:
+            status, headers, body = 200, {}, DEFAULT_RESPONSES.get(
+                method, {'ok': True})
+
+        return status, headers, json.dumps(body).encode('utf-8')
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Shut down the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        """Start the server for a with block."""
+        return self.start()
+
+    def __exit__(self, *args):
+        """Stop the server at the end of a with block."""
+        self.stop()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+
+# Compare serving the homepage and its assets the old way (render on every
+# request, uncompressed static files) with the cached, fingerprinted and
+# precompressed versions, including revalidation with If-None-Match.
+#
+# Usage: python -m benchmarks.homepage [--requests 2000]
+
+import re
+import argparse
+import tempfile
+from time import perf_counter
+
+from benchmarks.fake_slack import FakeSlack
+from benchmarks.load import configure
+
+
+def timed(client, url, count, headers=None):
+    """Request url count times, returning requests/s and bytes per request."""
+    size = 0
+    start = perf_counter()
+    for _ in range(count):
+        size = len(client.get(url, headers=headers).data)
+    return count / (perf_counter() - start), size
+
+
+def main():
+    """Build the assets and print throughput and transfer sizes."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='slack-roll-homepage-')
+
+    with FakeSlack() as fake:
+        configure(workdir, fake)
+
+        # pylint: disable=import-outside-toplevel
+        from flask import render_template, url_for
+        from slack_roll import allowed_commands, project_info
+        from slack_roll.app import app
+        from slack_roll.assets import build_assets
+
+        build_assets(target=app.config['ASSET_DIR'])
+        client = app.test_client()
+
+        @app.route('/uncached')
+        def uncached():
+            return render_template('index.html', project=project_info,
+                                   allowed_commands=allowed_commands)
+
+        etag = client.get('/').headers['ETag']
+        print(f"{'homepage':>28} {'req/s':>10} {'bytes':>8}")
+        for name, url, headers in (
+                ('render every request', '/uncached', None),
+                ('cached render', '/', None),
+                ('cached, revalidated', '/', {'If-None-Match': etag})
+        ):
+            rate, size = timed(client, url, args.requests, headers)
+            print(f'{name:>28} {rate:>10.0f} {size:>8}')
+
+        # Compare each asset served plainly and from the build
+        page = client.get('/').data.decode()
+        print(f"\n{'asset':>28} {'static':>8} {'gzip':>8} {'br':>8}")
+        for built in re.findall(r'/assets/([^"\']+)', page):
+            path = re.sub(r'\.[0-9a-f]{12}(\.\w+)$', r'\1', built)
+            with app.test_request_context():
+                static = url_for('static', filename=path)
+            sizes = [len(client.get(static).data)]
+            for encoding in ('gzip', 'br'):
+                response = client.get(f'/assets/{built}',
+                                      headers={'Accept-Encoding': encoding})
+                sizes.append(len(response.data))
+            print(f'{path:>28} ' + ' '.join(f'{s:>8}' for s in sizes))
+
+
+if __name__ == '__main__':
+    main()
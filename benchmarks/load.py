@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# End-to-end load test: runs the Flask app against a seeded SQLite
+# database and a fake Slack API, drives slash-command traffic at it and
+# reports latency percentiles and throughput.
+#
+# Usage: python -m benchmarks.load [--requests 2000] [--concurrency 16]
+#            [--teams 100] [--latency 0.05] [--output load.json]
+#
+# Any app setting, such as DELIVERY_MODE or TOKEN_CACHE_TTL, can be set in
+# the environment as usual.
+
+import os
+import sys
+import hmac
+import json
+import random
+import logging
+import argparse
+import tempfile
+from threading import Thread, local
+from time import perf_counter, time
+from hashlib import sha256
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from cryptography.fernet import Fernet
+from werkzeug.serving import make_server
+
+from benchmarks.fake_slack import FakeSlack
+
+
+# Slack's slash command response budget, in seconds
+SLACK_BUDGET = 3.0
+
+# Mix of rolls to send
+ROLLS = ['', 'd20', '4d10', '1d6+3', '10d6 hit5', '2d6+1d8-2', '4d6kh3']
+
+
+def configure(workdir, fake):
+    """Point the app at a local database, the fake Slack and a file sink."""
+    os.environ['SLACK_API_URL'] = fake.api_url
+    os.environ['SLACK_RESPONSE_URL_PREFIX'] = fake.url
+    os.environ.setdefault(
+        'DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'roll.db')}")
+    os.environ.setdefault('TOKEN_KEY', Fernet.generate_key().decode())
+    os.environ.setdefault('SECURE_KEY_STR', 'benchmark')
+    os.environ.setdefault('SLACK_CLIENT_SECRET', 'benchmark')
+    os.environ.setdefault('EVENT_SINK', 'file')
+    os.environ.setdefault(
+        'EVENT_LOG_PATH', os.path.join(workdir, 'events.jsonl'))
+
+
+def seed_teams(count):
+    """Create the tables and add count teams, returning their ids."""
+    # pylint: disable=import-outside-toplevel
+    from slack_roll import app
+    from slack_roll.storage import Team, db
+
+    team_ids = [f'T{index:08d}' for index in range(count)]
+
+    with app.app_context():
+        db.create_all()
+        for team_id in team_ids:
+            if Team.query.get(team_id) is None:
+                db.session.add(Team(team_id, 'xoxp-fake', 'B0', 'xoxb-fake'))
+        db.session.commit()
+
+    return team_ids
+
+
+def start_app():
+    """Serve the Flask app from a background thread."""
+    # pylint: disable=import-outside-toplevel
+    from slack_roll.app import app
+
+    # Keep per-request logging out of the timings
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server, f'http://127.0.0.1:{server.server_port}/'
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def sign(body):
+    """Return Slack signature headers, if a signing secret is set."""
+    secret = os.environ.get('SLACK_SIGNING_SECRET')
+    if not secret:
+        return {}
+
+    timestamp = str(int(time()))
+    signature = hmac.new(
+        secret.encode('utf-8'),
+        f'v0:{timestamp}:'.encode('utf-8') + body,
+        sha256
+    ).hexdigest()
+
+    return {
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': f'v0={signature}'
+    }
+
+
+def run_load(url, team_ids, total, concurrency, response_url):
+    """Send total slash commands and return per-request results."""
+    sessions = local()
+
+    def send(index):
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+
+        form = {
+            'command': '/roll',
+            'team_id': random.choice(team_ids),
+            'channel_id': 'C00000000',
+            'user_name': f'user{index}',
+            'text': random.choice(ROLLS),
+            'response_url': response_url
+        }
+
+        body = urlencode(form).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            **sign(body)
+        }
+
+        start = perf_counter()
+        try:
+            status = sessions.session.post(
+                url, data=body, headers=headers, timeout=30).status_code
+        except requests.RequestException:
+            status = None
+
+        return perf_counter() - start, status
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(send, range(total)))
+
+
+def summarize(results, elapsed, args, fake):
+    """Build the machine-readable summary of a run."""
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status not in (200, 204))
+
+    return {
+        'timestamp': time(),
+        'settings': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'teams': args.teams,
+            'slack_latency': args.latency,
+            'delivery_mode': os.environ.get('DELIVERY_MODE', 'sync'),
+            'post_mode': os.environ.get('POST_MODE', 'bot')
+        },
+        'requests_per_second': len(results) / elapsed,
+        'latency': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None
+        },
+        'over_budget': sum(
+            1 for latency in latencies if latency > SLACK_BUDGET
+        ) / max(1, len(latencies)),
+        'errors': errors,
+        'slack_calls': len(fake.calls),
+        'slack_connections': fake.connections
+    }
+
+
+def main():
+    """Run the load test and save the results."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--teams', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the fake Slack waits per call')
+    parser.add_argument('--output', default='load.json')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='slack-roll-load-')
+
+    with FakeSlack(latency=args.latency) as fake:
+        configure(workdir, fake)
+        team_ids = seed_teams(args.teams)
+        server, url = start_app()
+
+        try:
+            start = perf_counter()
+            results = run_load(
+                url, team_ids, args.requests, args.concurrency,
+                f'{fake.url}response'
+            )
+            elapsed = perf_counter() - start
+        finally:
+            server.shutdown()
+
+        summary = summarize(results, elapsed, args, fake)
+
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(summary, output, indent=2)
+
+    latency = summary['latency']
+    print(f"{summary['requests_per_second']:.1f} req/s, "
+          f"p50 {latency['p50'] * 1000:.1f} ms, "
+          f"p95 {latency['p95'] * 1000:.1f} ms, "
+          f"p99 {latency['p99'] * 1000:.1f} ms, "
+          f"{summary['over_budget']:.2%} over {SLACK_BUDGET:.0f}s, "
+          f"{summary['errors']} errors")
+    print(f'Results saved to {args.output}')
+
+    sys.exit(1 if summary['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
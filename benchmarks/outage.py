@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+
+# Stress the app while the fake Slack API hangs: check that slash commands
+# still answer within Slack's budget, that the circuit breaker starts
+# failing fast, that load over the concurrency limit is shed, and that
+# everything recovers once Slack comes back.
+#
+# Usage: python -m benchmarks.outage [--requests 200] [--concurrency 32]
+#            [--hang 30]
+
+import os
+import sys
+import argparse
+import tempfile
+from collections import Counter
+from time import perf_counter, sleep
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fake_slack import FakeSlack
+from benchmarks.load import (
+    SLACK_BUDGET, configure, percentile, seed_teams, sign, start_app
+)
+
+
+def classify(response):
+    """Sort a slash command reply into the kind of answer it was."""
+    if response is None:
+        return 'failed'
+    if response.status_code == 204:
+        return 'posted'
+    if response.status_code != 200:
+        return str(response.status_code)
+    if "can't reach Slack" in response.text:
+        return 'unavailable'
+    if 'very busy' in response.text:
+        return 'shed'
+    return 'message'
+
+
+def run_phase(url, team_ids, texts, total, concurrency):
+    """Send total slash commands and return the latencies and answers."""
+    def send(index):
+        body = urlencode({
+            'command': '/roll',
+            'team_id': team_ids[index % len(team_ids)],
+            'channel_id': 'C00000000',
+            'user_name': f'user{index}',
+            'text': texts[index % len(texts)]
+        }).encode('utf-8')
+
+        start = perf_counter()
+        try:
+            response = requests.post(url, data=body, timeout=30, headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                **sign(body)
+            })
+        except requests.RequestException:
+            response = None
+
+        return perf_counter() - start, classify(response)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(send, range(total)))
+
+
+def report(name, results):
+    """Print latency percentiles and answer counts for a phase."""
+    latencies = sorted(latency for latency, _ in results)
+    answers = Counter(answer for _, answer in results)
+    over = sum(1 for latency in latencies if latency > SLACK_BUDGET)
+
+    print(f'{name:>10}: p50 {percentile(latencies, 50) * 1000:7.1f} ms, '
+          f'p95 {percentile(latencies, 95) * 1000:7.1f} ms, '
+          f'max {latencies[-1] * 1000:7.1f} ms, {over} over budget, '
+          + ', '.join(f'{count} {answer}'
+                      for answer, count in sorted(answers.items())))
+
+    return over
+
+
+def main():
+    """Run healthy, hanging and recovered phases against the app."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--hang', type=float, default=30.0,
+                        help='seconds the fake Slack hangs for each call')
+    args = parser.parse_args()
+
+    # Small limits so every mechanism kicks in during a short run
+    os.environ.setdefault('MAX_CONCURRENT_ROLLS', '8')
+    os.environ.setdefault('SLACK_BREAKER_RESET', '2')
+    os.environ.setdefault('TOKEN_CACHE_FAILURE_TTL', '0')
+
+    workdir = tempfile.mkdtemp(prefix='slack-roll-outage-')
+
+    with FakeSlack() as fake:
+        configure(workdir, fake)
+        team_ids = seed_teams(20)
+        server, url = start_app()
+
+        def hang(params):  # pylint: disable=unused-argument
+            sleep(args.hang)
+            return 200, {}, {'ok': True}
+
+        try:
+            # Warm up the token cache for half of the teams
+            over = report('healthy', run_phase(
+                url, team_ids[:10], ['2d6'], args.requests,
+                args.concurrency))
+
+            # Hang every Slack call, with both warm and cold teams
+            fake.overrides['auth.test'] = hang
+            fake.overrides['chat.postMessage'] = hang
+            over += report('hanging', run_phase(
+                url, team_ids, ['2d6', 'help', 'version', '4d6kh3'],
+                args.requests, args.concurrency))
+
+            # Let the breaker try Slack again
+            fake.overrides.clear()
+            sleep(float(os.environ['SLACK_BREAKER_RESET']))
+            over += report('recovered', run_phase(
+                url, team_ids, ['2d6'], args.requests, args.concurrency))
+
+        finally:
+            server.shutdown()
+
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Stress the outbound scheduler against a fake Slack that enforces its
+# own per-channel rate limit and answers 429 with Retry-After, and check
+# that every roll is posted exactly once and in order.
+#
+# Usage: python -m benchmarks.ratelimit [--rolls 300] [--channels 3]
+#            [--teams 2] [--slack-rate 5] [--rate 10] [--burst 3]
+#            [--random-429 0.05]
+
+import os
+import re
+import sys
+import random
+import argparse
+import tempfile
+from time import monotonic, perf_counter
+from threading import Lock
+
+from benchmarks.fake_slack import FakeSlack
+from benchmarks.load import configure, seed_teams
+
+
+class RateLimitedChannel:  # pylint: disable=too-few-public-methods
+    """Answer chat.postMessage with 429s above a per-channel rate."""
+
+    def __init__(self, rate, random_429):
+        """Allow rate posts per second in each channel."""
+        self.rate = rate
+        self.random_429 = random_429
+        self.last = {}
+        self.posted = {}
+        self.rejected = 0
+        self._lock = Lock()
+
+    def __call__(self, params):
+        """Accept or rate limit a post."""
+        channel = params['channel']
+        now = monotonic()
+
+        with self._lock:
+            since = now - self.last.get(channel, 0)
+
+            if since < 1 / self.rate or random.random() < self.random_429:
+                self.rejected += 1
+                return 429, {'Retry-After': '1'}, {
+                    'ok': False, 'error': 'ratelimited'}
+
+            self.last[channel] = now
+            self.posted.setdefault(channel, []).append(params['text'])
+
+        return 200, {}, {'ok': True, 'ts': f'{now:.6f}'}
+
+
+def check_posts(posted, sent):
+    """Return (missing, duplicated, out of order) roll counts."""
+    missing = duplicated = out_of_order = 0
+
+    for channel, expected in sent.items():
+        numbers = [
+            int(number)
+            for text in posted.get(channel, [])
+            for number in re.findall(r'_user(\d+) rolled', text)
+        ]
+
+        missing += len(set(expected) - set(numbers))
+        duplicated += len(numbers) - len(set(numbers))
+        out_of_order += sum(
+            1 for before, after in zip(numbers, numbers[1:])
+            if after < before
+        )
+
+    return missing, duplicated, out_of_order
+
+
+def main():
+    """Send a burst of rolls and check what the fake Slack received."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rolls', type=int, default=300)
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--teams', type=int, default=2)
+    parser.add_argument('--slack-rate', type=float, default=5,
+                        help='posts per second the fake allows a channel')
+    parser.add_argument('--rate', type=float, default=10,
+                        help='posts per second the scheduler allows')
+    parser.add_argument('--burst', type=int, default=3)
+    parser.add_argument('--random-429', type=float, default=0.05,
+                        help='chance of a 429 on any post')
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='slack-roll-ratelimit-')
+    limiter = RateLimitedChannel(args.slack_rate, args.random_429)
+
+    os.environ['DELIVERY_MODE'] = 'schedule'
+    os.environ['SCHEDULER_CHANNEL_RATE'] = str(args.rate)
+    os.environ['SCHEDULER_CHANNEL_BURST'] = str(args.burst)
+
+    with FakeSlack() as fake:
+        fake.overrides['chat.postMessage'] = limiter
+        configure(workdir, fake)
+        team_ids = seed_teams(args.teams)
+
+        # pylint: disable=import-outside-toplevel
+        from slack_roll.app import app
+        from slack_roll.roll import post_scheduler
+
+        client = app.test_client()
+        sent = {}
+        start = perf_counter()
+
+        for index in range(args.rolls):
+            team_id = team_ids[index % len(team_ids)]
+            channel = f'C{index % args.channels}{team_id}'
+            sent.setdefault(channel, []).append(index)
+
+            response = client.post('/', data={
+                'command': '/roll',
+                'team_id': team_id,
+                'channel_id': channel,
+                'user_name': f'user{index}',
+                'text': '2d6'
+            })
+            if response.status_code != 204:
+                print(f'Roll {index} failed: {response.data!r}')
+
+        accepted = perf_counter() - start
+        finished = post_scheduler.join(args.timeout)
+        elapsed = perf_counter() - start
+
+    missing, duplicated, out_of_order = check_posts(limiter.posted, sent)
+    stats = post_scheduler.stats()
+
+    print(f'Accepted {args.rolls} rolls in {accepted:.2f}s, '
+          f'posted them in {elapsed:.1f}s')
+    print(f"{stats['sent']} messages, {stats['coalesced']} rolls coalesced, "
+          f"{limiter.rejected} 429s from Slack, "
+          f"{stats['rate_limited']} rate limited, {stats['failed']} failed")
+    print(f'{missing} missing, {duplicated} duplicated, '
+          f'{out_of_order} out of order')
+
+    ok = finished and not (missing or duplicated or out_of_order)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
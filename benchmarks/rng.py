@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Compare the per-die cost of each RNG backend and check that each one
+# rolls every face equally often with a chi-square test.
+#
+# Usage: python -m benchmarks.rng [--samples 600000]
+
+import sys
+import math
+import argparse
+from timeit import repeat
+
+from slack_roll import rng
+
+
+# Dice to test for uniformity, including sizes that need rejection
+SIDES = (2, 6, 7, 20, 100)
+
+# z-score for a 0.1% false failure rate
+Z_CRITICAL = 3.09
+
+
+def backends():
+    """Create one instance of each backend."""
+    return {
+        'fast': rng.FastRandom(),
+        'seeded': rng.SeededRandom(1234),
+        'secure': rng.SecureRandom()
+    }
+
+
+def chi_square(backend, sides, samples):
+    """Return the chi-square statistic and critical value for a die."""
+    faces = backend.roll(samples, sides)
+    counts = [0] * sides
+    for face in faces:
+        counts[face - 1] += 1
+
+    expected = samples / sides
+    statistic = sum((count - expected) ** 2 / expected for count in counts)
+
+    # Wilson-Hilferty approximation of the critical value
+    freedom = sides - 1
+    critical = freedom * (
+        1 - 2 / (9 * freedom) +
+        Z_CRITICAL * math.sqrt(2 / (9 * freedom))
+    ) ** 3
+
+    return statistic, critical
+
+
+def per_die_cost(backend, count, sides=6, times=5):
+    """Return the best cost per die in nanoseconds."""
+    number = max(1, 100000 // count)
+    best = min(repeat(
+        lambda: backend.roll(count, sides),
+        number=number,
+        repeat=times
+    ))
+    return best / number / count * 1e9
+
+
+def main():
+    """Time each backend and test each for uniformity."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=600000)
+    args = parser.parse_args()
+
+    print('Cost per die (ns):')
+    print(f"{'backend':>8} {'1 die':>10} {'10 dice':>10} "
+          f"{'100 dice':>10} {'10^4 dice':>10}")
+    for name, backend in backends().items():
+        costs = [per_die_cost(backend, count) for count in (1, 10, 100, 10000)]
+        print(f'{name:>8} ' + ' '.join(f'{cost:>10.1f}' for cost in costs))
+
+    print()
+    print('Chi-square uniformity:')
+    failures = 0
+    for name, backend in backends().items():
+        for sides in SIDES:
+            statistic, critical = chi_square(backend, sides, args.samples)
+            passed = statistic <= critical
+            failures += not passed
+            print(f"{name:>8} d{sides:<4} chi2 {statistic:>8.2f} "
+                  f"(limit {critical:>7.2f}) {'ok' if passed else 'FAIL'}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Rotate token keys over a large synthetic SQLite table, interrupting
+# the run part way to check that it resumes from its checkpoint, and
+# verify every token ends up encrypted with the new key.
+#
+# Usage: python -m benchmarks.rotation [--teams 300000] [--batch-size 1000]
+#            [--workers 4] [--interrupt 50] [--memory]
+
+import os
+import sys
+import argparse
+import tracemalloc
+import tempfile
+from itertools import cycle
+from time import perf_counter
+
+from cryptography.fernet import Fernet
+
+
+def seed(db, table, count, old_key):
+    """Insert count teams with tokens encrypted by the old key."""
+    cipher = Fernet(old_key)
+
+    # Reuse a pool of ciphertexts, rotation costs the same either way
+    tokens = cycle([
+        (cipher.encrypt(f'xoxp-{index}'.encode()),
+         cipher.encrypt(f'xoxb-{index}'.encode()))
+        for index in range(1000)
+    ])
+
+    for start in range(0, count, 10000):
+        rows = []
+        for index in range(start, min(count, start + 10000)):
+            token, bot_token = next(tokens)
+            rows.append({
+                'id': f'T{index:09d}',
+                'bot_id': 'B0',
+                'encrypted_token': token,
+                'encrypted_bot_token': bot_token
+            })
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+
+
+def verify(db, table, new_key):
+    """Return the number of tokens that the new key alone can't read."""
+    cipher = Fernet(new_key)
+    failures = 0
+
+    for rows in db.session.execute(
+            table.select().execution_options(yield_per=10000)
+    ).partitions():
+        for row in rows:
+            for token in (row.encrypted_token, row.encrypted_bot_token):
+                try:
+                    cipher.decrypt(token)
+                except Exception:  # pylint: disable=broad-except
+                    failures += 1
+
+    return failures
+
+
+def main():
+    """Seed, rotate with an interruption, resume and verify."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--teams', type=int, default=300000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--interrupt', type=int, default=50,
+                        help='batches to rotate before stopping once')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace peak memory use, which slows it down')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='slack-roll-rotation-')
+    old_key, new_key = Fernet.generate_key(), Fernet.generate_key()
+
+    # Newest key first
+    os.environ['TOKEN_KEYS'] = f'{new_key.decode()},{old_key.decode()}'
+    os.environ['DATABASE_URL'] = \
+        f"sqlite:///{os.path.join(workdir, 'roll.db')}"
+    for name in ('SECURE_KEY_STR', 'SLACK_CLIENT_ID', 'SLACK_CLIENT_SECRET'):
+        os.environ.setdefault(name, 'benchmark')
+
+    # pylint: disable=import-outside-toplevel
+    from slack_roll import app
+    from slack_roll.rotation import rotate_tokens
+    from slack_roll.storage import create_tables, db, Team
+
+    create_tables()
+    checkpoint = os.path.join(workdir, 'rotate.checkpoint')
+
+    with app.app_context():
+        start = perf_counter()
+        seed(db, Team.__table__, args.teams, old_key)
+        print(f'Seeded {args.teams} teams in {perf_counter() - start:.1f}s')
+
+    if args.memory:
+        tracemalloc.start()
+    start = perf_counter()
+
+    # Stop part way, as if the process had been killed
+    first, _ = rotate_tokens(
+        checkpoint, args.batch_size, args.workers, args.interrupt)
+
+    # The checkpoint is removed if every team fit before the interrupt
+    if os.path.exists(checkpoint):
+        with open(checkpoint, encoding='utf-8') as saved:
+            print(f'Interrupted after {first} teams at {saved.read()}')
+        rest, _ = rotate_tokens(checkpoint, args.batch_size, args.workers)
+    else:
+        print(f'Finished all {first} teams before the interrupt')
+        rest = 0
+
+    elapsed = perf_counter() - start
+
+    print(f'Rotated {first + rest} teams in {elapsed:.1f}s '
+          f'({(first + rest) / elapsed:.0f} teams/s)')
+
+    if args.memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'Peak memory while rotating: {peak / 2 ** 20:.1f} MB')
+
+    with app.app_context():
+        failures = verify(db, Team.__table__, new_key)
+
+    print(f'{failures} tokens not readable with the new key')
+    sys.exit(1 if failures or first + rest != args.teams else 0)
+
+
+if __name__ == '__main__':
+    main()
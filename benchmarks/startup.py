@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Measure cold start: how long importing the app takes and how long the
+# first slash command takes compared to a warm one, in fresh processes.
+#
+# Usage: python -m benchmarks.startup [--runs 10] [--top 15]
+
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+from statistics import median
+from time import perf_counter
+
+from benchmarks.fake_slack import FakeSlack
+from benchmarks.load import configure, seed_teams
+
+
+# Slash command sent by each child process
+FORM = {
+    'command': '/roll',
+    'team_id': 'T00000000',
+    'channel_id': 'C00000000',
+    'user_name': 'user',
+    'text': '2d6+3'
+}
+
+
+def child():
+    """Time the import and two requests, printing the results as JSON."""
+    start = perf_counter()
+    from slack_roll.app import app  # pylint: disable=import-outside-toplevel
+    imported = perf_counter() - start
+
+    client = app.test_client()
+    timings = {'import': imported}
+
+    for name in ('first_request', 'second_request'):
+        start = perf_counter()
+        client.post('/', data=FORM)
+        timings[name] = perf_counter() - start
+
+    print(json.dumps(timings))
+
+
+def run_child():
+    """Run one fresh child process and return its timings."""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', '--child'],
+        check=True, capture_output=True, text=True
+    ).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top):
+    """Return the modules with the largest cumulative import times."""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import slack_roll.app'],
+        check=True, capture_output=True, text=True
+    ).stderr
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.rstrip()))
+
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    """Run the children and print median and best timings."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15,
+                        help='number of slowest imports to list')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    workdir = tempfile.mkdtemp(prefix='slack-roll-startup-')
+
+    with FakeSlack() as fake:
+        configure(workdir, fake)
+        seed_teams(1)
+
+        runs = [run_child() for _ in range(args.runs)]
+
+    print(f"{'stage':>16} {'median (ms)':>12} {'best (ms)':>10}")
+    for name in ('import', 'first_request', 'second_request'):
+        values = [run[name] * 1000 for run in runs]
+        print(f'{name:>16} {median(values):>12.1f} {min(values):>10.1f}')
+
+    if args.top:
+        print('\nSlowest imports (cumulative ms):')
+        for cumulative, module in slowest_imports(args.top):
+            print(f'{cumulative / 1000:>10.1f}  {module}')
+
+
+if __name__ == '__main__':
+    main()
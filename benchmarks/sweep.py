@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+
+# Sweep the tokens of many teams against a fake Slack with some latency,
+# some revoked tokens and occasional rate limiting. Check every team ends
+# up with the right status, that calls stay within the configured rate,
+# and that slash commands for swept teams skip the live auth.test.
+#
+# Usage: python -m benchmarks.sweep [--teams 2000] [--workers 8]
+#            [--rate 200] [--latency 0.02]
+
+import os
+import sys
+import argparse
+import tempfile
+from threading import Lock
+from time import perf_counter
+
+from benchmarks.fake_slack import FakeSlack
+from benchmarks.load import configure
+
+
+# Every this many teams has a revoked bot token
+REVOKED_EVERY = 10
+
+# Every this many auth.test calls is rate limited
+RATE_LIMITED_EVERY = 50
+
+
+def seed(count):
+    """Insert count teams, some of them with revoked bot tokens."""
+    # pylint: disable=import-outside-toplevel
+    from slack_roll import app
+    from slack_roll.storage import create_tables, db, Team
+
+    create_tables()
+
+    with app.app_context():
+        for index in range(count):
+            bot_token = 'xoxb-revoked' if index % REVOKED_EVERY == 0 \
+                else 'xoxb-fake'
+            db.session.add(Team(f'T{index:08d}', 'xoxp-fake', 'B0',
+                                bot_token))
+        db.session.commit()
+
+
+def fake_auth_test():
+    """Return an auth.test handler that revokes and rate limits some calls."""
+    calls = [0]
+    lock = Lock()
+
+    def auth_test(params):
+        with lock:
+            calls[0] += 1
+            limited = calls[0] % RATE_LIMITED_EVERY == 0
+
+        if limited:
+            return 429, {'Retry-After': '0.2'}, {'ok': False}
+        if params.get('token') == 'xoxb-revoked':
+            return 200, {}, {'ok': False, 'error': 'token_revoked'}
+        return 200, {}, {'ok': True}
+
+    return auth_test
+
+
+def main():
+    """Seed teams, sweep them and check the results."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--teams', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=200,
+                        help='most auth.test calls per second')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds the fake Slack waits per call')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='slack-roll-sweep-')
+    os.environ.setdefault('SLACK_POOL_SIZE', str(args.workers))
+
+    with FakeSlack(latency=args.latency) as fake:
+        configure(workdir, fake)
+        seed(args.teams)
+        fake.overrides['auth.test'] = fake_auth_test()
+
+        # pylint: disable=import-outside-toplevel
+        from slack_roll.app import app
+        from slack_roll.storage import db, Team
+        from slack_roll.sweeper import sweep_tokens
+
+        start = perf_counter()
+        counts = sweep_tokens(args.batch_size, args.workers, args.rate)
+        elapsed = perf_counter() - start
+
+        calls = len(fake.calls)
+        print(f'Swept {args.teams} teams in {elapsed:.1f}s '
+              f'({args.teams / elapsed:.0f} teams/s, '
+              f'{calls / elapsed:.0f} calls/s for a limit of {args.rate:.0f})')
+        print(', '.join(f'{count} {status}'
+                        for status, count in sorted(counts.items())))
+
+        # Check the saved statuses
+        with app.app_context():
+            wrong = sum(
+                1 for team in Team.query.all()
+                if team.token_status != (
+                    'token_revoked'
+                    if int(team.id[1:]) % REVOKED_EVERY == 0 else 'ok'
+                )
+            )
+            db.session.commit()
+        print(f'{wrong} teams with the wrong status')
+
+        # Slash commands for healthy teams shouldn't call auth.test
+        fake.calls.clear()
+        client = app.test_client()
+        for index in range(1, 101):
+            client.post('/', data={
+                'command': '/roll',
+                'team_id': f'T{index:08d}',
+                'channel_id': 'C00000000',
+                'user_name': 'user',
+                'text': '2d6'
+            })
+        live = sum(1 for method, _ in fake.calls if method == 'auth.test')
+        print(f'{live} live auth.test calls for 100 slash commands')
+
+    sys.exit(1 if wrong or calls / elapsed > args.rate * 1.1 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+
+# Compare team lookups through the ORM (Team.query.get) with the Core
+# fast path in storage, on an in-memory SQLite database by default. The
+# team cache is bypassed so every lookup hits the database.
+#
+# Usage: python -m benchmarks.team_lookup [--teams 10000] [--lookups 20000]
+#            [--database sqlite:///:memory:]
+
+import os
+import random
+import argparse
+from time import perf_counter
+
+from cryptography.fernet import Fernet
+
+
+def timed(func, team_ids):
+    """Run func for each team id and return microseconds per call."""
+    start = perf_counter()
+    for team_id in team_ids:
+        func(team_id)
+    return (perf_counter() - start) / len(team_ids) * 1e6
+
+
+def main():
+    """Seed teams and time each way of looking them up."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--teams', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--database', default='sqlite:///:memory:')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('TOKEN_KEY', Fernet.generate_key().decode())
+    for name in ('SECURE_KEY_STR', 'SLACK_CLIENT_ID', 'SLACK_CLIENT_SECRET'):
+        os.environ.setdefault(name, 'benchmark')
+
+    # pylint: disable=import-outside-toplevel
+    from slack_roll import app
+    from slack_roll.storage import (
+        CachedTeam, Team, create_tables, db, load_team, team_query
+    )
+
+    create_tables()
+
+    with app.app_context():
+        # Encrypting is slow, so share one pair of tokens between teams
+        template = Team('T', 'xoxp-fake', 'B0', 'xoxb-fake')
+        for start in range(0, args.teams, 10000):
+            db.session.execute(Team.__table__.insert(), [
+                {
+                    'id': f'T{index:08d}',
+                    'bot_id': 'B0',
+                    'encrypted_token': template.encrypted_token,
+                    'encrypted_bot_token': template.encrypted_bot_token
+                }
+                for index in range(start, min(args.teams, start + 10000))
+            ])
+        db.session.commit()
+
+        team_ids = [
+            f'T{random.randrange(args.teams):08d}'
+            for _ in range(args.lookups)
+        ]
+
+        # End the session after each ORM lookup, as a request would
+        def orm_row(team_id):
+            team = Team.query.get(team_id)
+            db.session.remove()
+            return team
+
+        def core_row(team_id):
+            with db.engine.connect() as connection:
+                return connection.execute(
+                    team_query, {'team_id': team_id}).first()
+
+        def orm_team(team_id):
+            team = CachedTeam(Team.query.get(team_id))
+            db.session.remove()
+            return team
+
+        print(f"{'lookup':>28} {'us/call':>10}")
+        for name, func in (
+                ('Team.query.get', orm_row),
+                ('Core team_query', core_row),
+                ('Team.query.get + decrypt', orm_team),
+                ('load_team', load_team)
+        ):
+            # Warm up the pool and statement caches first
+            timed(func, team_ids[:100])
+            print(f'{name:>28} {timed(func, team_ids):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
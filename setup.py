@@ -41,6 +41,12 @@ setup(
         'newrelic',
         'pkginfo',
         'psycopg2-binary',
+        'requests',
         'slacker'
-    ]
+    ],
+    extras_require={
+        'asgi': ['httpx', 'uvicorn'],
+        'brotli': ['brotli'],
+        'numpy': ['numpy']
+    }
 )
@@ -17,15 +17,58 @@ included in all copies or substantial portions of the Software.
 
 import os
 from datetime import date
-from threading import Thread
 
-import keen
 from flask import Flask
-from pkg_resources import get_provider
+
+from .events import EventReporter, FileSink, keen_sink
+
+
+def get_version():
+    """Read the version from the source tree or the installed package."""
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'VERSION')
+
+    try:
+        with open(path, encoding='utf-8') as version_file:
+            return version_file.read().strip()
+    except OSError:
+        # pylint: disable=import-outside-toplevel
+        from importlib.metadata import version
+        return version('em-slack-roll')
+
+
+def get_database_url():
+    """Return the database URL, accepting Heroku's postgres:// scheme."""
+    url = os.environ.get('DATABASE_URL')
+
+    # Use the psycopg2 driver we depend on
+    if url and url.startswith('postgres://'):
+        url = 'postgresql+psycopg2://' + url[len('postgres://'):]
+
+    return url
+
+
+def get_engine_options(url):
+    """Return connection pool settings for the database engine.
+
+    Connections are checked before use and recycled before the server
+    drops them, so idle periods don't surface as errors. SQLite has no
+    server, and keeps the pool Flask-SQLAlchemy picks for it.
+    """
+    options = {
+        'pool_pre_ping': os.environ.get(
+            'DB_POOL_PRE_PING', 'true').lower() == 'true',
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 300))
+    }
+
+    if url and not url.startswith('sqlite'):
+        options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+
+    return options
 
 
 # Common project metadata
-__version__ = open('VERSION').read()
+__version__ = get_version()
 __app_name__ = 'EM Slack Roll'
 __copyright__ = f'2015-{str(date.today().year)}'
 
@@ -54,7 +97,7 @@ project_info = {
 }
 
 # Set the template directory
-template_dir = os.path.join(get_provider(__name__).module_path, 'templates')
+template_dir = os.path.join(os.path.dirname(__file__), 'templates')
 
 # Allowed slash commands
 allowed_commands = [
@@ -65,6 +108,10 @@ allowed_commands = [
     '/dice_roll'
 ]
 
+# Request threads per gunicorn worker, set in the Procfile; a few are kept
+# free of rolls so requests over the roll limit can still be turned away
+web_threads = int(os.environ.get('WEB_THREADS', 20))
+
 # Initialize flask app
 app = Flask(
     'em-slack-roll',
@@ -75,20 +122,113 @@ app = Flask(
 # Set up flask config
 app.config.update({
     'SECRET_KEY': os.environ.get('SECURE_KEY_STR'),
-    'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL'),
-    'SQLALCHEMY_TRACK_MODIFICATIONS': True
+    'SQLALCHEMY_DATABASE_URI': get_database_url(),
+    'SQLALCHEMY_ENGINE_OPTIONS': get_engine_options(get_database_url()),
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'TOKEN_KEYS': [
+        key for key in os.environ.get(
+            'TOKEN_KEYS', os.environ.get('TOKEN_KEY', '')).split(',')
+        if key
+    ],
+    'ROTATION_BATCH_SIZE': int(os.environ.get('ROTATION_BATCH_SIZE', 1000)),
+    'ROTATION_WORKERS': int(os.environ.get('ROTATION_WORKERS', 4)),
+    'SLACK_SIGNING_SECRET': os.environ.get('SLACK_SIGNING_SECRET'),
+    'SIGNATURE_MAX_AGE': int(os.environ.get('SIGNATURE_MAX_AGE', 300)),
+    'POST_MODE': os.environ.get('POST_MODE', 'bot'),
+    'BOT_CHANNELS': [
+        channel
+        for channel in os.environ.get('BOT_CHANNELS', '').split(',')
+        if channel
+    ],
+    'ASSET_DIR': os.environ.get(
+        'ASSET_DIR', os.path.join(template_dir, 'build')),
+    'HOME_CACHE_TTL': int(os.environ.get('HOME_CACHE_TTL', 300)),
+    'REROLL_BUTTON': os.environ.get(
+        'REROLL_BUTTON', 'false').lower() == 'true',
+    'SLACK_RESPONSE_URL_PREFIX': os.environ.get(
+        'SLACK_RESPONSE_URL_PREFIX', 'https://hooks.slack.com/'),
+    'MAX_DICE': int(os.environ.get('MAX_DICE', 100)),
+    'RNG_BACKEND': os.environ.get('RNG_BACKEND', 'fast'),
+    'RNG_SEED': int(os.environ.get('RNG_SEED', 0)),
+    'RNG_BUFFER_SIZE': int(os.environ.get('RNG_BUFFER_SIZE', 65536)),
+    'ODDS_MAX_DICE': int(os.environ.get('ODDS_MAX_DICE', 100)),
+    'MAX_LISTED_DICE': int(os.environ.get('MAX_LISTED_DICE', 100)),
+    'SLACK_API_URL': os.environ.get(
+        'SLACK_API_URL', 'https://slack.com/api/'),
+    'SLACK_POOL_SIZE': int(os.environ.get('SLACK_POOL_SIZE', 10)),
+    'SLACK_ASYNC_POOL_SIZE': int(
+        os.environ.get('SLACK_ASYNC_POOL_SIZE', 100)),
+    'SLACK_CONNECT_TIMEOUT': float(
+        os.environ.get('SLACK_CONNECT_TIMEOUT', 3.05)),
+    'SLACK_READ_TIMEOUT': float(os.environ.get('SLACK_READ_TIMEOUT', 10)),
+    'SLACK_DEADLINE': float(os.environ.get('SLACK_DEADLINE', 2.5)),
+    'SLACK_BREAKER_THRESHOLD': int(
+        os.environ.get('SLACK_BREAKER_THRESHOLD', 5)),
+    'SLACK_BREAKER_RESET': float(os.environ.get('SLACK_BREAKER_RESET', 30)),
+    'MAX_CONCURRENT_ROLLS': int(
+        os.environ.get('MAX_CONCURRENT_ROLLS', max(web_threads - 4, 1))),
+    'ADMISSION_WAIT': float(os.environ.get('ADMISSION_WAIT', 0.25)),
+    'ASYNC_MAX_CONCURRENT_ROLLS': int(
+        os.environ.get('ASYNC_MAX_CONCURRENT_ROLLS', 500)),
+    'TOKEN_CACHE_TTL': int(os.environ.get('TOKEN_CACHE_TTL', 300)),
+    'TOKEN_CACHE_FAILURE_TTL': int(
+        os.environ.get('TOKEN_CACHE_FAILURE_TTL', 30)),
+    'TOKEN_STATUS_MAX_AGE': int(os.environ.get('TOKEN_STATUS_MAX_AGE', 7200)),
+    'SWEEP_BATCH_SIZE': int(os.environ.get('SWEEP_BATCH_SIZE', 200)),
+    'SWEEP_WORKERS': int(os.environ.get('SWEEP_WORKERS', 8)),
+    'SWEEP_RATE': float(os.environ.get('SWEEP_RATE', 20)),
+    'TEAM_CACHE_TTL': int(os.environ.get('TEAM_CACHE_TTL', 300)),
+    'TEAM_CACHE_SIZE': int(os.environ.get('TEAM_CACHE_SIZE', 1000)),
+    'DELIVERY_MODE': os.environ.get('DELIVERY_MODE', 'sync'),
+    'DELIVERY_WORKERS': int(os.environ.get('DELIVERY_WORKERS', 4)),
+    'DELIVERY_QUEUE_SIZE': int(os.environ.get('DELIVERY_QUEUE_SIZE', 100)),
+    'DELIVERY_RETRIES': int(os.environ.get('DELIVERY_RETRIES', 3)),
+    'DELIVERY_BACKOFF': float(os.environ.get('DELIVERY_BACKOFF', 0.5)),
+    'DELIVERY_OVERFLOW': os.environ.get('DELIVERY_OVERFLOW', 'inline'),
+    'HISTORY_BUFFER_SIZE': int(os.environ.get('HISTORY_BUFFER_SIZE', 10000)),
+    'HISTORY_BATCH_SIZE': int(os.environ.get('HISTORY_BATCH_SIZE', 500)),
+    'HISTORY_FLUSH_INTERVAL': float(
+        os.environ.get('HISTORY_FLUSH_INTERVAL', 2)),
+    'HISTORY_PAGE_SIZE': int(os.environ.get('HISTORY_PAGE_SIZE', 10)),
+    'HISTORY_MAX_PAGE_SIZE': int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 50)),
+    'STATS_FLUSH_INTERVAL': float(os.environ.get('STATS_FLUSH_INTERVAL', 10)),
+    'STATS_MIN_ROLLS': int(os.environ.get('STATS_MIN_ROLLS', 10)),
+    'SCHEDULER_WORKERS': int(os.environ.get('SCHEDULER_WORKERS', 4)),
+    'SCHEDULER_QUEUE_SIZE': int(os.environ.get('SCHEDULER_QUEUE_SIZE', 1000)),
+    'SCHEDULER_TEAM_RATE': float(os.environ.get('SCHEDULER_TEAM_RATE', 5)),
+    'SCHEDULER_TEAM_BURST': int(os.environ.get('SCHEDULER_TEAM_BURST', 20)),
+    'SCHEDULER_CHANNEL_RATE': float(
+        os.environ.get('SCHEDULER_CHANNEL_RATE', 1)),
+    'SCHEDULER_CHANNEL_BURST': int(
+        os.environ.get('SCHEDULER_CHANNEL_BURST', 3)),
+    'SCHEDULER_COALESCE': os.environ.get(
+        'SCHEDULER_COALESCE', 'true').lower() == 'true',
+    'SCHEDULER_MAX_LENGTH': int(os.environ.get('SCHEDULER_MAX_LENGTH', 3000)),
+    'API_TOKENS': [
+        token for token in os.environ.get('API_TOKENS', '').split(',')
+        if token
+    ],
+    'API_MAX_BATCH': int(os.environ.get('API_MAX_BATCH', 10000)),
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),
+    'PROFILE_SAMPLE_RATE': float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    'PROFILE_DIR': os.environ.get('PROFILE_DIR', 'profiles'),
+    'EVENT_SINK': os.environ.get('EVENT_SINK', 'keen'),
+    'EVENT_LOG_PATH': os.environ.get('EVENT_LOG_PATH', 'events.jsonl'),
+    'EVENT_BUFFER_SIZE': int(os.environ.get('EVENT_BUFFER_SIZE', 1000)),
+    'EVENT_BATCH_SIZE': int(os.environ.get('EVENT_BATCH_SIZE', 100)),
+    'EVENT_FLUSH_INTERVAL': float(os.environ.get('EVENT_FLUSH_INTERVAL', 5))
 })
 
+# Set up batched event reporting
+event_reporter = EventReporter(
+    FileSink(app.config['EVENT_LOG_PATH'])
+    if app.config['EVENT_SINK'] == 'file' else keen_sink,
+    max_size=app.config['EVENT_BUFFER_SIZE'],
+    batch_size=app.config['EVENT_BATCH_SIZE'],
+    interval=app.config['EVENT_FLUSH_INTERVAL']
+)
+
 
 def report_event(name, event):
     """Asynchronously report an event."""
-    event_report = Thread(
-        target=keen.add_event,
-        args=(name, event)
-    )
-
-    # Set up as asynchronous daemon
-    event_report.daemon = True
-
-    # Start event report
-    event_report.start()
+    event_reporter.report(name, event)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import hmac
+import json
+
+from flask import abort
+
+from . import app, report_event
+from .roll import RollMessage, roll_expression
+
+
+def check_token(request):
+    """Abort unless the request has a valid API bearer token."""
+    tokens = app.config['API_TOKENS']
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+
+    if scheme.lower() != 'bearer' or not token or not any(
+            hmac.compare_digest(token, valid) for valid in tokens
+    ):
+        report_event('api_not_authorized', {})
+        abort(401)
+
+
+def read_lines(stream):
+    """Yield one roll expression per line of an NDJSON body."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def read_rolls(request):
+    """Return the roll expressions from a JSON or NDJSON request body.
+
+    A JSON body is checked here, so a bad one is rejected before any
+    results are streamed; an NDJSON body is read lazily, line by line.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        # Read one expression per line without loading the whole body
+        return read_lines(request.stream)
+
+    body = request.get_json(silent=True)
+    rolls = body.get('rolls') if isinstance(body, dict) else body
+
+    if not isinstance(rolls, list):
+        abort(400)
+
+    return rolls
+
+
+def serialize_roll(index, text, expression, roll_data):
+    """Convert roll data into a JSON-friendly result."""
+    result = {
+        'index': index,
+        'roll': text,
+        'expression': str(expression),
+        'total': roll_data['sum'],
+        'modifier': roll_data['modifier'],
+        'dice': [
+            {
+                'term': str(term_data['term']),
+                'sign': term_data['sign'],
+                'total': term_data['sum'],
+                'results': term_data['result'],
+                'dropped': term_data['dropped'],
+                'faces': term_data['faces']
+            }
+            for term_data in roll_data['dice']
+        ]
+    }
+
+    # Add hit results
+    if expression.hit is not None:
+        for key in ('hits', 'hits_crit', 'misses', 'misses_crit'):
+            result[key] = roll_data[key]
+
+    return result
+
+
+def to_line(data):
+    """Encode a result as a single line of compact JSON."""
+    return json.dumps(data, separators=(',', ':')) + '\n'
+
+
+def roll_batch(rolls):
+    """Roll each expression and yield one NDJSON line per result."""
+    max_batch = app.config['API_MAX_BATCH']
+    count = 0
+    errors = 0
+
+    for index, text in enumerate(rolls):
+        if index >= max_batch:
+            yield to_line({
+                'index': index,
+                'error': f'Batches are limited to {max_batch} rolls'
+            })
+            break
+
+        count += 1
+
+        if not isinstance(text, str):
+            errors += 1
+            yield to_line({'index': index, 'error': 'Roll must be text'})
+            continue
+
+        try:
+            expression, roll_data = roll_expression(text)
+        except RollMessage as msg:
+            errors += 1
+            yield to_line({'index': index, 'roll': text, 'error': str(msg)})
+            continue
+
+        yield to_line(serialize_roll(index, text, expression, roll_data))
+
+    report_event('api_roll', {'count': count, 'errors': errors})
@@ -15,23 +15,195 @@ The above copyright notice and this permission notice shall be
 included in all copies or substantial portions of the Software.
 """
 
-from flask import redirect, render_template, request
+import hashlib
+import hmac
+import json
+
+from flask import Response, abort, redirect, render_template, request, \
+    stream_with_context
 
 from . import app, project_info, allowed_commands, report_event, auth, roll
+from . import api, assets, cli, event_reporter, history, interact, metrics
+from . import slack, stats, storage
+from .cache import TTLCache
+
+
+# Rendered homepage variants, keyed by whether to show the success banner
+home_cache = TTLCache(app.config['HOME_CACHE_TTL'])
+
+
+# Expose cache, event and delivery stats alongside the request metrics
+metrics.register(metrics.Gauge(
+    'slack_roll_cache_hits_total',
+    'Cache lookups that found a fresh entry.',
+    lambda: {
+        (('cache', 'team'),): storage.team_cache.hits,
+        (('cache', 'token'),): roll.token_cache.hits
+    },
+    kind='counter'
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_cache_misses_total',
+    'Cache lookups that found nothing or an expired entry.',
+    lambda: {
+        (('cache', 'team'),): storage.team_cache.misses,
+        (('cache', 'token'),): roll.token_cache.misses
+    },
+    kind='counter'
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_events',
+    'Reported events by state.',
+    lambda: {
+        (('state', state),): count
+        for state, count in event_reporter.stats().items()
+    }
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_history_rows',
+    'Roll history rows by write state.',
+    lambda: {
+        (('state', state),): count
+        for state, count in history.history_writer.stats().items()
+    }
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_stats_pending',
+    'Running stats rows waiting to be saved.',
+    lambda: len(stats.stats_aggregator)
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_delivery_queue_length',
+    'Roll posts waiting for a delivery worker.',
+    lambda: len(roll.delivery_queue)
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_scheduler_posts',
+    'Scheduled Slack posts by outcome, and rolls still queued.',
+    lambda: {
+        (('state', state),): count
+        for state, count in roll.post_scheduler.stats().items()
+    }
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_slack_breaker_open',
+    'Whether calls to Slack are currently being refused.',
+    lambda: int(slack.breaker.state == 'open')
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_slack_breaker',
+    'Slack call failures in a row, breaker trips and refused calls.',
+    lambda: {
+        (('state', state),): count
+        for state, count in slack.breaker.stats().items()
+    }
+))
+metrics.register(metrics.Gauge(
+    'slack_roll_slash_commands',
+    'Slash commands in progress, and those shed for being over the limit.',
+    lambda: {
+        (('state', state),): count
+        for state, count in roll.roll_limiter.stats().items()
+    }
+))
+
+
+@app.before_request
+def start_request():
+    """Start timing the request."""
+    metrics.start_request(app.config['PROFILE_SAMPLE_RATE'])
+
+
+@app.after_request
+def finish_request(response):
+    """Record request timings and add the Server-Timing header."""
+    return metrics.finish_request(
+        response,
+        request.endpoint or 'unknown',
+        app.config['PROFILE_DIR']
+    )
+
+
+def check_signature():
+    """Check the request came from Slack, if we have a signing secret."""
+    if app.config['SLACK_SIGNING_SECRET'] and not auth.is_signed_request(
+            request.headers.get('X-Slack-Request-Timestamp'),
+            request.headers.get('X-Slack-Signature'),
+            request.get_data()
+    ):
+        report_event('signature_invalid', {})
+        abort(401)
 
 
 @app.route('/', methods=['GET', 'POST'])
 def home():
     """Render app homepage template."""
     if request.method == 'POST':
+        check_signature()
         report_event('post_request', request.form.to_dict())
-        return roll.make_roll(request.form.to_dict())
 
-    return render_template(
-        'index.html',
-        project=project_info,
-        allowed_commands=allowed_commands
-    )
+        # Slack gives up on slash commands after 3 seconds
+        slack.set_deadline(app.config['SLACK_DEADLINE'])
+
+        # Turn away requests over the limit instead of queueing them
+        if not roll.roll_limiter.acquire():
+            report_event('request_shed', {
+                'team_id': request.form.get('team_id')
+            })
+            return roll.busy_error
+
+        try:
+            return roll.make_roll(request.form.to_dict())
+        finally:
+            roll.roll_limiter.release()
+
+    # Render each variant of the page once
+    def render_home():
+        page = render_template(
+            'index.html',
+            project=project_info,
+            allowed_commands=allowed_commands
+        )
+        return page, hashlib.sha256(page.encode('utf-8')).hexdigest()[:16]
+
+    page, etag = home_cache.get_or_set(
+        request.args.get('success') == '1', render_home)
+
+    response = Response(page, mimetype='text/html')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = \
+        f"public, max-age={app.config['HOME_CACHE_TTL']}"
+
+    return response.make_conditional(request)
+
+
+@app.route('/interact', methods=['POST'])
+def interact_action():
+    """Handle clicks on the Reroll button."""
+    # Button clicks are only accepted with a signature to check
+    if not interact.is_enabled():
+        abort(403)
+
+    check_signature()
+
+    try:
+        payload = json.loads(request.form.get('payload', ''))
+    except ValueError:
+        abort(400)
+
+    # Slack gives up on interactions after 3 seconds too
+    slack.set_deadline(app.config['SLACK_DEADLINE'])
+
+    if not isinstance(payload, dict) or not interact.handle_payload(payload):
+        abort(400)
+
+    return '', 200
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted, precompressed static asset."""
+    return assets.serve_asset(filename)
 
 
 @app.route('/authenticate')
@@ -44,3 +216,32 @@ def authenticate():
 def validate():
     """Validate the returned values from authentication."""
     return redirect(auth.validate_return(request.args.to_dict()))
+
+
+@app.route('/api/roll', methods=['POST'])
+def api_roll():
+    """Roll a batch of expressions, streaming results back as NDJSON."""
+    api.check_token(request)
+
+    # Reject a bad body before the response starts streaming
+    rolls = api.read_rolls(request)
+
+    return Response(
+        stream_with_context(api.roll_batch(rolls)),
+        mimetype='application/x-ndjson'
+    )
+
+
+@app.route('/metrics')
+def show_metrics():
+    """Render metrics in the Prometheus text format."""
+    token = app.config['METRICS_TOKEN']
+
+    # Require the metrics token, if one is set
+    if token and not hmac.compare_digest(
+            request.headers.get('Authorization', ''),
+            f'Bearer {token}'
+    ):
+        abort(401)
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
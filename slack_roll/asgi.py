@@ -0,0 +1,610 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import io
+import sys
+import json
+import asyncio
+import contextvars
+from urllib.parse import parse_qsl
+
+import httpx
+from slacker import Error
+
+from slack_roll import allowed_commands, interact, report_event, roll
+from slack_roll.app import app as flask_app
+from slack_roll.auth import is_signed_request
+from slack_roll.slack import CircuitOpen, breaker, get_timeout
+from slack_roll.resilience import ConcurrencyLimiter
+
+
+# Background deliveries, kept referenced until they finish
+_deliveries = set()
+
+# In-flight token checks, keyed by (team_id, is_bot)
+_token_checks = {}
+
+# Slash commands being handled at once on the event loop
+roll_limiter = ConcurrencyLimiter(
+    flask_app.config['ASYNC_MAX_CONCURRENT_ROLLS'])
+
+
+class AsyncSlackClient:
+    """Minimal asyncio Slack Web API client built on a shared httpx pool."""
+
+    def __init__(self, base_url, timeout, pool_size=100):
+        """Set up the client; the connection pool is opened on first use."""
+        self.base_url = base_url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._client = None
+
+    @property
+    def client(self):
+        """Return the shared httpx client, creating it if needed."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(
+                    self.timeout[1],
+                    connect=self.timeout[0]
+                ),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                )
+            )
+        return self._client
+
+    async def post(self, url, **kwargs):
+        """Send a POST request through the shared Slack circuit breaker."""
+        # Fail fast while Slack is known to be down
+        if not breaker.allow():
+            raise CircuitOpen('Slack is not responding')
+
+        try:
+            response = await self.client.post(url, **kwargs)
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+
+        # Rate limits and API errors still mean Slack is up
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        return response
+
+    async def call(self, method, token, **data):
+        """Call a Slack API method, raising slacker.Error on API errors."""
+        response = await self.post(
+            method,
+            data={key: value for key, value in data.items()
+                  if value is not None},
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        response.raise_for_status()
+
+        # Check for API errors
+        body = response.json()
+        if not body.get('ok'):
+            raise Error(body.get('error'))
+
+        return body
+
+    async def close(self):
+        """Close the connection pool."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Shared Slack client
+slack = AsyncSlackClient(
+    flask_app.config['SLACK_API_URL'],
+    get_timeout(),
+    flask_app.config['SLACK_ASYNC_POOL_SIZE']
+)
+
+
+async def is_valid_token(token):
+    """Check that the team has a valid token."""
+    try:
+        await slack.call('auth.test', token)
+
+    except Error as err:
+        # Check for auth errors
+        report_event(str(err), {})
+        return False
+
+    # Return successful
+    return True
+
+
+async def _check_team_token(team, is_bot):
+    """Check a team token and cache the result."""
+    # Don't cache a result for a team forgotten during the check
+    generation = roll.token_cache.generation
+    valid = await is_valid_token(team.get_token(is_bot))
+
+    roll.token_cache.set(
+        (team.id, is_bot),
+        valid,
+        flask_app.config[
+            'TOKEN_CACHE_TTL' if valid else 'TOKEN_CACHE_FAILURE_TTL'
+        ],
+        generation
+    )
+
+    return valid
+
+
+async def is_valid_team_token(team, is_bot=False):
+    """Check a team token, sharing cached and in-flight results."""
+    # Trust the sweeper, and only check live when its status is stale or bad
+    if roll.is_recently_validated(team):
+        return True
+
+    key = (team.id, is_bot)
+
+    valid = roll.token_cache.get(key)
+    if valid is not None:
+        return valid
+
+    # Wait on any check already running for this token
+    check = _token_checks.get(key)
+    if check is None:
+        check = asyncio.ensure_future(_check_team_token(team, is_bot))
+        _token_checks[key] = check
+        check.add_done_callback(lambda _: _token_checks.pop(key, None))
+
+    return await asyncio.shield(check)
+
+
+def is_retryable(err):
+    """Check whether a failed roll post is worth trying again."""
+    if isinstance(err, Error):
+        return str(err) not in roll.permanent_errors
+
+    # Retry network errors and Slack server errors
+    if isinstance(err, httpx.HTTPStatusError):
+        return err.response.status_code >= 429
+
+    return isinstance(err, httpx.HTTPError)
+
+
+def is_unavailable(err):
+    """Check whether an error means Slack is down or too slow to answer."""
+    if isinstance(err, httpx.HTTPStatusError):
+        return err.response.status_code >= 500
+
+    return isinstance(err, (CircuitOpen, httpx.TransportError))
+
+
+def get_retry_after(err):
+    """Return the seconds Slack asked us to wait, if we were rate limited."""
+    if isinstance(err, httpx.HTTPStatusError) and \
+            err.response.status_code == 429:
+        try:
+            return float(err.response.headers.get('Retry-After', 1))
+        except ValueError:
+            return 1.0
+
+    if isinstance(err, Error) and str(err) == 'ratelimited':
+        return 1.0
+
+    return None
+
+
+async def post_roll(team, text, args):
+    """Post the roll to Slack, raising any errors.
+
+    Without a team the roll is posted through the response_url instead
+    of as the bot.
+    """
+    if team is None:
+        if not roll.check_response_url(args):
+            return
+
+        response = await slack.post(
+            args['response_url'],
+            json=interact.get_message(
+                text,
+                args.get('reroll'),
+                response_type='in_channel'
+            )
+        )
+        response.raise_for_status()
+        return
+
+    blocks = interact.get_blocks(text, args.get('reroll'))
+
+    await slack.call(
+        'chat.postMessage',
+        team.get_token(True),
+        channel=args['channel_id'],
+        text=text,
+        username='Roll Bot',
+        icon_emoji=':game_die:',
+        blocks=json.dumps(blocks) if blocks else None
+    )
+
+
+async def send_response(args, text):
+    """Send a private reply to the user through the command's response_url."""
+    if not roll.check_response_url(args):
+        return
+
+    try:
+        response = await slack.post(
+            args['response_url'],
+            json={'response_type': 'ephemeral', 'text': text}
+        )
+        response.raise_for_status()
+
+    except (CircuitOpen, httpx.HTTPError) as err:
+        report_event('response_url_error', {
+            'error': str(err),
+            'team_id': args.get('team_id')
+        })
+
+
+async def deliver_roll(team, text, args):
+    """Post a roll in the background, retrying with exponential backoff."""
+    attempt = 0
+
+    while True:
+        try:
+            await post_roll(team, text, args)
+            return
+
+        except (Error, CircuitOpen, httpx.HTTPError) as err:
+            # Ask the team to authorize again once its tokens stop working
+            if roll.is_auth_failure(err):
+                await send_response(args, await asyncio.to_thread(
+                    roll.report_auth_failure, err, args))
+                return
+
+            # Give up on permanent errors or when out of retries, counting
+            # rate limited attempts too
+            if (
+                    attempt >= flask_app.config['DELIVERY_RETRIES'] or
+                    not is_retryable(err)
+            ):
+                report_event('delivery_failed', {
+                    'error': str(err),
+                    'team_id': args.get('team_id'),
+                    'roll': text,
+                    'args': args
+                })
+                await send_response(args, roll.get_send_error(err))
+                return
+
+            # Wait as long as Slack asks when rate limited
+            wait = get_retry_after(err)
+
+        if wait is None:
+            wait = flask_app.config['DELIVERY_BACKOFF'] * 2 ** attempt
+
+        await asyncio.sleep(wait)
+        attempt += 1
+
+
+async def send_roll(team, text, args):
+    """Post the roll to Slack using the configured delivery mode."""
+    if flask_app.config['DELIVERY_MODE'] == 'queue':
+        delivery = asyncio.ensure_future(deliver_roll(team, text, args))
+        _deliveries.add(delivery)
+        delivery.add_done_callback(_deliveries.discard)
+        return None
+
+    try:
+        # Attempt to post message
+        await post_roll(team, text, args)
+
+    except (Error, CircuitOpen, httpx.HTTPError) as err:
+        # Ask the team to authorize again once its tokens stop working
+        if roll.is_auth_failure(err):
+            return await asyncio.to_thread(
+                roll.report_auth_failure, err, args)
+
+        # Fail fast when Slack is down instead of showing the raw error
+        if is_unavailable(err):
+            return roll.report_unavailable(err, args)
+
+        if team is not None and not isinstance(err, Error):
+            raise
+
+        report_event(str(err), {
+            'team_id': args.get('team_id'),
+            'roll': text,
+            'args': args
+        })
+        return roll.get_send_error(err)
+
+    # Return no errors
+    return None
+
+
+def get_team(args):
+    """Look up the team from a worker thread."""
+    with flask_app.app_context():
+        return roll.get_team(args)
+
+
+def parse_roll(args):
+    """Parse and roll the command from a worker thread.
+
+    The history subcommand reads from the database while parsing, and
+    the stats subcommand flushes the pending stats and loads them back,
+    so none of it can run on the event loop. Returns the parsed roll
+    and its message.
+    """
+    with flask_app.app_context():
+        result = roll.parse_roll(args)
+
+        # Count the roll in the channel's history and stats
+        return result, roll.do_roll(result, args['user_name'], args)
+
+
+async def make_roll(args):
+    """Run dice roll functions without blocking the event loop."""
+    # Make sure this is a valid slash command
+    if args['command'] not in allowed_commands:
+        report_event('command_not_allowed', args)
+        return f'"{args["command"]}" is not an allowed command'
+
+    # Reply through the response_url without using the team's tokens
+    team = None
+
+    if not roll.uses_response_url(args):
+        # Check to see if team has authenticated with the app
+        team = await asyncio.to_thread(get_team, args)
+
+        # If the user, team token, and bot token are not valid, let them know
+        try:
+            valid = team and all(await asyncio.gather(
+                is_valid_team_token(team),
+                is_valid_team_token(team, True)
+            ))
+        except (CircuitOpen, httpx.HTTPError) as err:
+            return roll.report_unavailable(err, args)
+
+        if not valid:
+            report_event('auth_error', {
+                'args': args,
+                'team_id': args['team_id']
+            })
+            return roll.auth_error
+
+    # Parse args and get requested flip
+    try:
+        result, text = await asyncio.to_thread(parse_roll, args)
+    except roll.RollMessage as msg:
+        return str(msg)
+
+    # Let the channel roll again without typing the command
+    if interact.is_enabled():
+        args['reroll'] = interact.dump_roll(result.expression)
+
+    # Post flip as user
+    err = await send_roll(team, text, args)
+
+    # If there were problems posting, report it
+    if err is not None:
+        return err
+
+    # Return successful
+    return '', 204
+
+
+def get_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP request."""
+    server = scope.get('server') or ('localhost', 80)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+    # Copy request headers
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ and name != 'CONTENT_LENGTH':
+            value = f'{environ[name]},{value}'
+
+        environ[name] = value
+
+    return environ
+
+
+def start_wsgi(environ):
+    """Run a request through the Flask app up to the start of its body."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        # pylint: disable=unused-argument
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    response['result'] = flask_app.wsgi_app(environ, start_response)
+    response['body'] = iter(response['result'])
+
+    return response
+
+
+def close_wsgi(response):
+    """Let the Flask app clean up after its body has been sent."""
+    if hasattr(response['result'], 'close'):
+        response['result'].close()
+
+
+async def call_wsgi(send, environ):
+    """Run a request through the Flask app, streaming its body.
+
+    Every step runs on a worker thread in one shared context, so Flask's
+    request context stays pushed while a streamed body is generated.
+    """
+    context = contextvars.copy_context()
+    response = await asyncio.to_thread(context.run, start_wsgi, environ)
+
+    try:
+        await send_start(send, response['status'], response['headers'])
+
+        # Send each chunk as it's produced, instead of buffering them all
+        while True:
+            chunk = await asyncio.to_thread(
+                context.run, next, response['body'], None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True
+                })
+
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        await asyncio.to_thread(context.run, close_wsgi, response)
+
+
+async def read_body(receive):
+    """Read the full request body."""
+    body = b''
+
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+
+        if not message.get('more_body'):
+            return body
+
+
+async def send_start(send, status, headers):
+    """Send the status and headers of an HTTP response."""
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+    })
+
+
+async def send_http(send, status, headers, body):
+    """Send a complete HTTP response."""
+    await send_start(send, status, headers)
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    """Handle server startup and shutdown."""
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif message['type'] == 'lifespan.shutdown':
+            await slack.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point, serving the same routes as slack_roll.app:app.
+
+    Slash commands run natively on the event loop; every other request
+    is handed to the Flask app on a worker thread.
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    body = await read_body(receive)
+
+    # Run slash commands on the event loop
+    if scope['method'] == 'POST' and scope['path'] == '/':
+        # Check the request came from Slack, if we have a signing secret
+        if flask_app.config['SLACK_SIGNING_SECRET']:
+            headers = dict(scope['headers'])
+            timestamp = headers.get(b'x-slack-request-timestamp', b'')
+            signature = headers.get(b'x-slack-signature', b'')
+
+            if not is_signed_request(
+                    timestamp.decode('latin-1'),
+                    signature.decode('latin-1'),
+                    body
+            ):
+                report_event('signature_invalid', {})
+                await send_http(send, 401, [], b'')
+                return
+
+        args = dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+        report_event('post_request', args)
+
+        # Turn away requests over the limit instead of queueing them
+        if not roll_limiter.acquire(wait=0):
+            report_event('request_shed', {'team_id': args.get('team_id')})
+            result = roll.busy_error
+
+        else:
+            # Slack gives up on slash commands after 3 seconds
+            try:
+                result = await asyncio.wait_for(
+                    make_roll(args),
+                    flask_app.config['SLACK_DEADLINE']
+                )
+            except asyncio.TimeoutError as err:
+                result = roll.report_unavailable(err, args)
+            finally:
+                roll_limiter.release()
+
+        if isinstance(result, tuple):
+            await send_http(send, result[1], [], result[0].encode('utf-8'))
+            return
+
+        await send_http(
+            send, 200,
+            [('Content-Type', 'text/html; charset=utf-8')],
+            result.encode('utf-8')
+        )
+        return
+
+    # Hand everything else to Flask
+    await call_wsgi(send, get_environ(scope, body))
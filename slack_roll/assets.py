@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import mimetypes
+from threading import Lock
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+from flask import abort, request, url_for, Response
+
+from . import app, template_dir
+
+
+# Static asset folders, relative to the template directory
+ASSET_DIRS = ('css', 'js', 'img')
+
+# File types worth compressing
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json')
+
+# Content encodings we can serve, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Far-future caching for fingerprinted files
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Name of the file mapping asset paths to fingerprinted names
+MANIFEST = 'manifest.json'
+
+
+def fingerprint(path, data):
+    """Return the path with a short hash of its contents in the name."""
+    root, ext = os.path.splitext(path)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def build_assets(source=template_dir, target=None):
+    """Write fingerprinted and precompressed copies of the static assets.
+
+    Returns the manifest mapping each asset path to its fingerprinted
+    path, which is also saved alongside the files.
+    """
+    target = target or app.config['ASSET_DIR']
+
+    # Start from a clean build
+    shutil.rmtree(target, ignore_errors=True)
+    manifest = {}
+
+    for folder in ASSET_DIRS:
+        for root, _, files in os.walk(os.path.join(source, folder)):
+            for name in sorted(files):
+                path = os.path.relpath(os.path.join(root, name), source)
+                path = path.replace(os.sep, '/')
+
+                with open(os.path.join(source, path), 'rb') as asset:
+                    data = asset.read()
+
+                built = fingerprint(path, data)
+                manifest[path] = built
+
+                # Write the file and any smaller compressed copies
+                variants = {'': data}
+                if built.endswith(COMPRESSIBLE):
+                    variants['.gz'] = gzip.compress(data, 9, mtime=0)
+                    if brotli is not None:
+                        variants['.br'] = brotli.compress(data)
+
+                for suffix, content in variants.items():
+                    if suffix and len(content) >= len(data):
+                        continue
+
+                    out_path = os.path.join(target, built + suffix)
+                    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                    with open(out_path, 'wb') as output:
+                        output.write(content)
+
+    with open(os.path.join(target, MANIFEST), 'w',
+              encoding='utf-8') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class AssetStore:
+    """Built assets, read from disk once and then served from memory."""
+
+    def __init__(self, directory):
+        """Set the build directory; nothing is read until first use."""
+        self.directory = directory
+        self._manifest = None
+        self._files = {}
+        self._lock = Lock()
+
+    @property
+    def manifest(self):
+        """Return the asset manifest, or {} if assets haven't been built."""
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.directory, MANIFEST),
+                          encoding='utf-8') as manifest:
+                    self._manifest = json.load(manifest)
+            except FileNotFoundError:
+                self._manifest = {}
+
+        return self._manifest
+
+    def read(self, path):
+        """Return the contents of a built file, or None if it's missing."""
+        with self._lock:
+            if path not in self._files:
+                try:
+                    with open(os.path.join(self.directory, path),
+                              'rb') as built:
+                        self._files[path] = built.read()
+                except (FileNotFoundError, IsADirectoryError):
+                    self._files[path] = None
+
+            return self._files[path]
+
+
+# Built assets for this app
+asset_store = AssetStore(app.config['ASSET_DIR'])
+
+
+def asset_url(path):
+    """Return the URL of a static asset, fingerprinted if it was built."""
+    built = asset_store.manifest.get(path)
+    if built is None:
+        return url_for('static', filename=path)
+
+    return url_for('asset', filename=built)
+
+
+def serve_asset(filename):
+    """Serve a built asset, compressed if the client accepts it."""
+    # Only fingerprinted files are served from here
+    if filename not in asset_store.manifest.values():
+        abort(404)
+
+    accepted = request.accept_encodings
+    content, encoding = None, None
+
+    for name, suffix in ENCODINGS:
+        if accepted[name]:
+            content = asset_store.read(filename + suffix)
+            if content is not None:
+                encoding = name
+                break
+
+    if content is None:
+        content = asset_store.read(filename)
+        if content is None:
+            abort(404)
+
+    # The fingerprint already identifies the contents
+    etag = filename.rsplit('.', 2)[-2]
+    if encoding:
+        etag = f'{etag}-{encoding}'
+
+    response = Response(
+        content,
+        mimetype=mimetypes.guess_type(filename)[0] or
+        'application/octet-stream'
+    )
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+
+    return response.make_conditional(request)
+
+
+# Let templates link to built assets
+app.jinja_env.globals['asset_url'] = asset_url
@@ -15,6 +15,9 @@ The above copyright notice and this permission notice shall be
 included in all copies or substantial portions of the Software.
 """
 
+import hmac
+from time import time
+from hashlib import sha256
 from datetime import timedelta
 from urllib.parse import urlencode
 
@@ -22,7 +25,9 @@ from flask import abort
 from slacker import OAuth, Error
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
-from slack_roll import project_info, report_event
+from slack_roll import app, project_info, report_event, slack
+from slack_roll.metrics import stage
+from slack_roll.roll import forget_team
 from slack_roll.storage import Team, db
 
 
@@ -81,7 +86,7 @@ def validate_state(state):
 
 def get_token(code):
     """Request a token from the Slack API."""
-    oauth = OAuth()
+    oauth = slack.get_api(OAuth)
     result = None
 
     try:
@@ -142,7 +147,7 @@ def store_data(info):
         # Update team info
         team.bot_id = info['bot_id']
         team.set_token(info['token'])
-        team.set_bot_token(info['bot_token'])
+        team.set_token(info['bot_token'], True)
         report_event('team_updated', {
             'team_id': info['team_id'],
             'bot_id': info['bot_id']
@@ -151,6 +156,9 @@ def store_data(info):
     # Update DB
     db.session.commit()
 
+    # Discard validation results for the old tokens
+    forget_team(info['team_id'])
+
 
 def validate_return(args):
     """Run data validation functions."""
@@ -159,13 +167,39 @@ def validate_return(args):
         abort(400)
 
     # Validate state
-    validate_state(args['state'])
+    with stage('oauth_state'):
+        validate_state(args['state'])
 
     # Get access token and info
-    token_info = get_token(args['code'])
+    with stage('oauth_access'):
+        token_info = get_token(args['code'])
 
     # Set up storage methods
-    store_data(token_info)
+    with stage('oauth_store'):
+        store_data(token_info)
 
     # Return successful
     return f"{project_info['base_url']}?success=1"
+
+
+def is_signed_request(timestamp, signature, body):
+    """Check a request's Slack signature against the signing secret.
+
+    Requests older than SIGNATURE_MAX_AGE seconds are rejected so that
+    captured requests can't be replayed.
+    """
+    try:
+        age = abs(time() - int(timestamp))
+    except (TypeError, ValueError):
+        return False
+
+    if age > app.config['SIGNATURE_MAX_AGE']:
+        return False
+
+    expected = 'v0=' + hmac.new(
+        app.config['SLACK_SIGNING_SECRET'].encode('utf-8'),
+        f'v0:{timestamp}:'.encode('utf-8') + body,
+        sha256
+    ).hexdigest()
+
+    return hmac.compare_digest(expected, signature or '')
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+from time import monotonic
+from collections import OrderedDict
+from threading import Event, Lock
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache with per-entry expiration."""
+
+    def __init__(self, ttl, max_size=None):
+        """Initialize an empty cache with a default time-to-live."""
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    @property
+    def generation(self):
+        """Return a counter that changes whenever entries are invalidated.
+
+        Read it before computing a value and pass it to set, so a value
+        computed from data invalidated in the meantime isn't cached.
+        """
+        with self._lock:
+            return self._generation
+
+    def _lookup(self, key, count=True):
+        """Return a fresh entry, counting the hit or miss. Requires lock."""
+        entry = self._entries.get(key)
+
+        # Drop expired entries on access
+        if entry is not None and entry[1] <= monotonic():
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+
+        # Mark as most recently used
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+
+        return entry
+
+    def _store(self, key, value, ttl, generation):
+        """Store a value unless invalidated since generation. Requires lock."""
+        if generation is not None and generation != self._generation:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (value, monotonic() + ttl)
+        self._entries.move_to_end(key)
+
+        # Evict least recently used entries
+        while self.max_size and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _invalidate(self):
+        """Stop in-flight computations from being cached. Requires lock."""
+        self._generation += 1
+
+        # Wake any waiters, so they compute the value again themselves
+        for pending in self._pending.values():
+            pending.set()
+        self._pending.clear()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing/expired."""
+        with self._lock:
+            entry = self._lookup(key)
+            return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Store a value, optionally overriding the default time-to-live.
+
+        With the generation read before the value was computed, the value
+        is dropped if anything was invalidated since.
+        """
+        with self._lock:
+            self._store(key, value, ttl, generation)
+
+    def get_or_set(self, key, func, ttl=None):
+        """Return the cached value or compute it once for all callers.
+
+        Concurrent callers asking for the same missing key wait on a single
+        in-flight call to func instead of each computing it themselves.
+        The ttl argument may be a callable taking the computed value. A
+        value whose key is invalidated while it's being computed is
+        returned to its caller but not cached.
+        """
+        waited = False
+
+        while True:
+            with self._lock:
+                # Only count the first lookup, not those after waiting
+                entry = self._lookup(key, count=not waited)
+
+                # Return a fresh hit
+                if entry is not None:
+                    return entry[0]
+
+                # Wait on another caller's in-flight computation
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = Event()
+                    generation = self._generation
+                    break
+
+            pending.wait()
+            waited = True
+
+        try:
+            value = func()
+
+            if callable(ttl):
+                ttl = ttl(value)
+
+            with self._lock:
+                self._store(key, value, ttl, generation)
+
+        finally:
+            # Release any waiting callers, unless already invalidated
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+            pending.set()
+
+        return value
+
+    def delete(self, key):
+        """Remove a single key from the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._invalidate()
+
+    def delete_matching(self, func):
+        """Remove every key for which func(key) is true."""
+        with self._lock:
+            for key in [key for key in self._entries if func(key)]:
+                del self._entries[key]
+            self._invalidate()
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._invalidate()
+
+    def stats(self):
+        """Return cache size and hit/miss counters."""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def __len__(self):
+        """Return the number of cached entries, including expired ones."""
+        return len(self._entries)
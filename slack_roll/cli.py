@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import click
+
+from . import app
+from . import assets, rotation, storage, sweeper
+
+
+@app.cli.command('migrate')
+def migrate():
+    """Create any missing database tables."""
+    for column in storage.create_tables():
+        click.echo(f'Added column {column}')
+    click.echo('Database is up to date')
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress the static assets."""
+    manifest = assets.build_assets()
+    click.echo(f'Built {len(manifest)} assets')
+
+
+@app.cli.command('rotate-keys')
+@click.option('--checkpoint', default='rotate-keys.checkpoint',
+              help='File used to resume an interrupted rotation.')
+@click.option('--batch-size', type=int, help='Teams per batch.')
+@click.option('--workers', type=int, help='Encryption processes.')
+@click.option('--max-batches', type=int,
+              help='Stop after this many batches.')
+def rotate_keys(checkpoint, batch_size, workers, max_batches):
+    """Re-encrypt every team's tokens with the newest of TOKEN_KEYS."""
+    def progress(rotated, skipped, team_id):
+        click.echo(f'Rotated {rotated} teams, skipped {skipped}, '
+                   f'up to {team_id}')
+
+    rotated, skipped = rotation.rotate_tokens(
+        checkpoint, batch_size, workers, max_batches, progress)
+    click.echo(f'Rotated {rotated} teams in this run')
+    if skipped:
+        click.echo(f'Skipped {skipped} teams re-authorized during the run')
+
+
+@app.cli.command('sweep-tokens')
+@click.option('--batch-size', type=int, help='Teams per batch.')
+@click.option('--workers', type=int, help='Threads checking tokens.')
+@click.option('--rate', type=float, help='Most auth.test calls per second.')
+@click.option('--stale-after', type=int, default=0,
+              help='Only check teams not validated for this many seconds.')
+def sweep_tokens(batch_size, workers, rate, stale_after):
+    """Check every team's tokens and record which ones still work."""
+    def progress(counts, team_id):
+        click.echo(f'Checked {sum(counts.values())} teams, up to {team_id}')
+
+    counts = sweeper.sweep_tokens(
+        batch_size, workers, rate, stale_after, progress)
+
+    if not counts:
+        click.echo('No teams needed checking')
+
+    for status, count in sorted(counts.items()):
+        click.echo(f'{status}: {count}')
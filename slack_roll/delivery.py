@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+from time import sleep
+from queue import Queue, Full
+from threading import Thread, Lock
+
+
+class DeliveryQueue:
+    """Bounded queue of jobs delivered by background worker threads."""
+
+    def __init__(self, deliver, on_failure, is_retryable, **options):
+        """Set up the queue; workers are started on first use.
+
+        deliver(*job) performs the delivery and raises on failure,
+        is_retryable(err) decides whether a failed attempt is tried again,
+        and on_failure(err, *job) is called once a job has given up.
+        """
+        self.deliver = deliver
+        self.on_failure = on_failure
+        self.is_retryable = is_retryable
+        self.workers = options.get('workers', 4)
+        self.retries = options.get('retries', 3)
+        self.backoff = options.get('backoff', 0.5)
+        self._queue = Queue(maxsize=options.get('max_size', 100))
+        self._threads = []
+        self._lock = Lock()
+
+    def _start(self):
+        """Start the worker threads if they aren't running yet."""
+        with self._lock:
+            if self._threads:
+                return
+
+            for _ in range(self.workers):
+                worker = Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._threads.append(worker)
+
+    def _work(self):
+        """Deliver queued jobs forever."""
+        while True:
+            job = self._queue.get()
+
+            try:
+                self.run(*job)
+            finally:
+                self._queue.task_done()
+
+    def run(self, *job):
+        """Deliver a single job, retrying with exponential backoff."""
+        attempt = 0
+
+        while True:
+            try:
+                self.deliver(*job)
+                return
+
+            except Exception as err:  # pylint: disable=broad-except
+                # Give up on permanent errors or when out of retries
+                if attempt >= self.retries or not self.is_retryable(err):
+                    self.on_failure(err, *job)
+                    return
+
+            sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def submit(self, *job):
+        """Queue a job for delivery. Returns False if the queue is full."""
+        self._start()
+
+        try:
+            self._queue.put_nowait(job)
+        except Full:
+            return False
+
+        return True
+
+    def join(self):
+        """Block until every queued job has been delivered."""
+        self._queue.join()
+
+    def __len__(self):
+        """Return the number of jobs waiting to be delivered."""
+        return self._queue.qsize()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+from collections import Counter
+
+from .rng import get_numpy, get_rng
+
+
+def draw_faces(count, sides, rng=None):
+    """Roll count dice with the given sides in a single draw.
+
+    Returns the faces rolled and a list with the number of times each
+    face came up, where index 0 holds the count of 1s.
+    """
+    faces = (rng or get_rng()).roll(count, sides)
+
+    # Large pools may come back as a NumPy array, counted in one call
+    if not isinstance(faces, list):
+        numpy = get_numpy()
+        if numpy is not None and isinstance(faces, numpy.ndarray):
+            return faces, \
+                numpy.bincount(faces, minlength=sides + 1)[1:].tolist()
+
+    totals = Counter(faces)
+    return faces, [totals[face] for face in range(1, sides + 1)]
+
+
+def score_faces(counts, hit=None):
+    """Compute the sum, hits, misses and criticals from face counts."""
+    sides = len(counts)
+
+    roll_data = {
+        'sum': sum(face * total for face, total in enumerate(counts, 1)),
+        'hits': 0,
+        'hits_crit': 0,
+        'misses': 0,
+        'misses_crit': 0
+    }
+
+    # Handle hits/misses
+    if hit is not None:
+        roll_data['hits'] = sum(counts[hit - 1:])
+        roll_data['hits_crit'] = counts[sides - 1] if hit <= sides else 0
+        roll_data['misses'] = sum(counts) - roll_data['hits']
+        roll_data['misses_crit'] = counts[0] if hit > 1 else 0
+
+    # Return scores
+    return roll_data
+
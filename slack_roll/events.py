@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+import json
+import atexit
+from threading import Condition, Thread
+
+
+# Limits applied to event payloads before they are buffered
+MAX_DEPTH = 3
+MAX_ITEMS = 25
+MAX_STRING = 500
+
+
+def shrink(value, depth=0):
+    """Reduce an event payload to small, JSON-safe values.
+
+    Private keys (such as SQLAlchemy state), anything token related and
+    raw bytes are dropped; long strings and collections are truncated.
+    """
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            return '{...}'
+
+        shrunk = {}
+        for key, item in list(value.items())[:MAX_ITEMS]:
+            key = str(key)
+
+            # Skip private and sensitive values
+            if key.startswith('_') or 'token' in key:
+                continue
+            if isinstance(item, (bytes, bytearray)):
+                continue
+
+            shrunk[key] = shrink(item, depth + 1)
+
+        return shrunk
+
+    if isinstance(value, (list, tuple, set)):
+        if depth >= MAX_DEPTH:
+            return '[...]'
+        return [shrink(item, depth + 1) for item in list(value)[:MAX_ITEMS]]
+
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+
+    return str(value)[:MAX_STRING]
+
+
+def keen_sink(events):
+    """Send a batch of events to Keen in a single request."""
+    import keen  # pylint: disable=import-outside-toplevel
+    keen.add_events(events)
+
+
+class FileSink:  # pylint: disable=too-few-public-methods
+    """Append batches of events to a local JSON lines file."""
+
+    def __init__(self, path):
+        """Set the file to write events to."""
+        self.path = path
+
+    def __call__(self, events):
+        """Write one line per event, tagged with its collection name."""
+        with open(self.path, 'a', encoding='utf-8') as sink:
+            for name, collection in events.items():
+                for event in collection:
+                    sink.write(json.dumps({'collection': name, **event}))
+                    sink.write('\n')
+
+
+class EventReporter:
+    """Buffer events in memory and send them in batches from one thread."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, sink, max_size=1000, batch_size=100, interval=5.0,
+                 prepare=shrink):
+        """Set up an empty buffer; the flusher starts on first report.
+
+        Each event is passed through prepare, if set, before buffering.
+        """
+        self.sink = sink
+        self.prepare = prepare
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._buffer = []
+        self._ready = Condition()
+        self._thread = None
+        self._closed = False
+
+    def _start(self):
+        """Start the flusher thread. Requires the condition lock."""
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        # Send anything left over when the process exits
+        atexit.register(self.close)
+
+    def _run(self):
+        """Flush batches when they fill up or the interval passes."""
+        while True:
+            with self._ready:
+                self._ready.wait_for(
+                    lambda: self._closed or
+                    len(self._buffer) >= self.batch_size,
+                    timeout=self.interval
+                )
+                closed = self._closed
+
+            self.flush()
+
+            if closed:
+                return
+
+    def report(self, name, event):
+        """Add an event to the buffer, dropping it if the buffer is full."""
+        if self.prepare is not None:
+            event = self.prepare(event)
+
+        with self._ready:
+            if self._thread is None and not self._closed:
+                self._start()
+
+            if len(self._buffer) >= self.max_size:
+                self.dropped += 1
+                return
+
+            self._buffer.append((name, event))
+
+            # Wake the flusher once a full batch is waiting
+            if len(self._buffer) >= self.batch_size:
+                self._ready.notify()
+
+    def flush(self):
+        """Send everything currently buffered to the sink."""
+        with self._ready:
+            buffered, self._buffer = self._buffer, []
+
+        if not buffered:
+            return
+
+        # Group events by collection name
+        events = {}
+        for name, event in buffered:
+            events.setdefault(name, []).append(event)
+
+        try:
+            self.sink(events)
+            self.sent += len(buffered)
+        except Exception:  # pylint: disable=broad-except
+            self.failed += len(buffered)
+
+    def close(self):
+        """Stop the flusher thread and send any remaining events."""
+        with self._ready:
+            self._closed = True
+            thread = self._thread
+            self._ready.notify()
+
+        if thread is not None and thread.is_alive():
+            thread.join(self.interval)
+
+        self.flush()
+
+    def stats(self):
+        """Return counters for sent, dropped, failed and pending events."""
+        with self._ready:
+            return {
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'pending': len(self._buffer)
+            }
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import re
+from functools import lru_cache
+from collections import namedtuple
+
+from .dice import draw_faces, score_faces
+
+
+# Set expression limits
+MAX_SIDES = 100
+MAX_MODIFIER = 100
+MAX_HIT = 100
+MAX_TERMS = 10
+MAX_EXPLOSIONS = 100
+
+# Set expression tokens
+_sign = re.compile(r'[-+]')
+_number = re.compile(r'\d+')
+_dice = re.compile(r'(?P<count>\d+)?d(?P<sides>\d+)')
+_option = re.compile(r'(?P<option>kh|kl|dh|dl|r|!)(?P<value>\d+)?')
+_hit = re.compile(r'hit(?P<value>\d+)?')
+
+
+class RollSyntaxError(ValueError):
+    """Error raised for roll expressions that can't be compiled."""
+
+    def __init__(self, message, event='roll_invalid'):
+        """Store the message and the name of the event to report."""
+        super().__init__(message)
+        self.event = event
+
+
+class Constant(namedtuple('Constant', 'value')):
+    """A fixed modifier, such as the 3 in 1d6+3."""
+    __slots__ = ()
+
+    def __str__(self):
+        """Format the constant as it would be typed."""
+        return str(self.value)
+
+
+class Dice(namedtuple('Dice', 'count sides keep explode reroll')):
+    """A pool of identical dice with optional keep, explode and reroll."""
+    __slots__ = ()
+
+    def __str__(self):
+        """Format the dice as they would be typed."""
+        text = f'{self.count}d{self.sides}'
+
+        if self.reroll:
+            text += f'r{self.reroll}'
+        if self.explode:
+            text += '!'
+        if self.keep:
+            text += f'{self.keep[0]}{self.keep[1]}'
+
+        return text
+
+    @property
+    def plain(self):
+        """Check whether these dice are rolled without any options."""
+        return not (self.keep or self.explode or self.reroll)
+
+
+class Expression(namedtuple('Expression', 'terms hit')):
+    """A compiled roll: (sign, term) pairs and an optional hit threshold."""
+    __slots__ = ()
+
+    def __str__(self):
+        """Format the normalized expression."""
+        text = ''
+
+        for index, (sign, term) in enumerate(self.terms):
+            if sign < 0:
+                text += '-'
+            elif index:
+                text += '+'
+            text += str(term)
+
+        if self.hit is not None:
+            text += f' hit{self.hit}'
+
+        return text
+
+    @property
+    def dice(self):
+        """Return the dice terms of the expression."""
+        return [term for _, term in self.terms if isinstance(term, Dice)]
+
+    @property
+    def has_modifier(self):
+        """Check whether the expression adds or subtracts a constant."""
+        return any(isinstance(term, Constant) for _, term in self.terms)
+
+    @property
+    def simple(self):
+        """Return the dice if this is a single, plain pool of dice."""
+        dice = [
+            (sign, term) for sign, term in self.terms
+            if isinstance(term, Dice)
+        ]
+
+        if len(dice) == 1 and dice[0][0] > 0 and dice[0][1].plain:
+            return dice[0][1]
+
+        return None
+
+    def pack(self):
+        """Return the expression as compact, JSON-safe lists."""
+        terms = []
+
+        for sign, term in self.terms:
+            if isinstance(term, Constant):
+                terms.append([sign, term.value])
+                continue
+
+            keep = term.keep or ('', 0)
+            terms.append([
+                sign, term.count, term.sides, keep[0], keep[1],
+                int(term.explode), term.reroll or 0
+            ])
+
+        return [terms, self.hit]
+
+    def evaluate(self, max_listed=100):
+        """Roll the expression and return the roll data.
+
+        Dice terms with more than max_listed dice report a face-count
+        histogram instead of listing every result.
+        """
+        roll_data = {
+            'sum': 0,
+            'dice': [],
+            'modifier': 0,
+            'hits': 0,
+            'hits_crit': 0,
+            'misses': 0,
+            'misses_crit': 0
+        }
+
+        for sign, term in self.terms:
+            if isinstance(term, Constant):
+                roll_data['modifier'] += sign * term.value
+                continue
+
+            # Roll each pool of dice
+            term_data = roll_dice(term, self.hit, term.count <= max_listed)
+            term_data['sign'] = sign
+            roll_data['dice'].append(term_data)
+            roll_data['sum'] += sign * term_data['sum']
+
+            for key in ('hits', 'hits_crit', 'misses', 'misses_crit'):
+                roll_data[key] += term_data[key]
+
+        # Deal with modifier
+        roll_data['sum'] += roll_data['modifier']
+
+        # Return roll data
+        return roll_data
+
+
+def _add_counts(counts, new_counts):
+    """Add two lists of face counts together."""
+    return [total + new for total, new in zip(counts, new_counts)]
+
+
+def _as_list(faces):
+    """Convert drawn faces to a plain list."""
+    return faces if isinstance(faces, list) else faces.tolist()
+
+
+def keep_counts(counts, option, number):
+    """Return the face counts left after keeping or dropping dice."""
+    total = sum(counts)
+
+    # Dropping the lowest is keeping the highest, and vice versa
+    highest = option in ('kh', 'dl')
+    if option.startswith('d'):
+        number = total - number
+    number = max(0, min(number, total))
+
+    # Take faces from the top or bottom until enough dice are kept
+    kept = [0] * len(counts)
+    order = reversed(range(len(counts))) if highest else range(len(counts))
+
+    for face in order:
+        if not number:
+            break
+        kept[face] = min(counts[face], number)
+        number -= kept[face]
+
+    return kept
+
+
+def roll_dice(term, hit=None, keep_results=True):
+    """Roll a single dice term and return its roll data."""
+    faces, counts = draw_faces(term.count, term.sides)
+    faces = _as_list(faces) if keep_results else None
+
+    # Reroll low results once
+    if term.reroll:
+        rerolls = sum(counts[:term.reroll])
+
+        if rerolls:
+            new_faces, new_counts = draw_faces(rerolls, term.sides)
+            counts = [0] * term.reroll + counts[term.reroll:]
+            counts = _add_counts(counts, new_counts)
+
+            if faces is not None:
+                new_faces = iter(_as_list(new_faces))
+                faces = [
+                    next(new_faces) if face <= term.reroll else face
+                    for face in faces
+                ]
+
+    # Roll again for every maximum result
+    if term.explode:
+        pending = counts[-1]
+
+        for _ in range(MAX_EXPLOSIONS):
+            if not pending:
+                break
+
+            new_faces, new_counts = draw_faces(pending, term.sides)
+            counts = _add_counts(counts, new_counts)
+            pending = new_counts[-1]
+
+            if faces is not None:
+                faces.extend(_as_list(new_faces))
+
+    # Keep or drop the highest or lowest results
+    if term.keep:
+        counts = keep_counts(counts, *term.keep)
+
+    # Mark which of the listed dice were dropped
+    dropped = None
+    if faces is not None:
+        remaining = list(counts)
+        dropped = []
+
+        for face in faces:
+            dropped.append(not remaining[face - 1])
+            if remaining[face - 1]:
+                remaining[face - 1] -= 1
+
+    # Score the kept dice
+    term_data = score_faces(counts, hit)
+    term_data['term'] = term
+    term_data['faces'] = counts
+    term_data['result'] = faces
+    term_data['dropped'] = dropped
+
+    # Return roll data
+    return term_data
+
+
+def _at(text, pos):
+    """Describe a position in the expression for error messages."""
+    return f"at '{text[pos:]}'" if pos < len(text) else 'at the end'
+
+
+def _clamp(value, low, high):
+    """Limit a value to a range."""
+    return max(low, min(value, high))
+
+
+def _parse_options(text, pos, dice):
+    """Parse keep, drop, explode and reroll options following dice."""
+    while True:
+        match = _option.match(text, pos)
+        if match is None:
+            return dice, pos
+
+        option, value = match.group('option'), match.group('value')
+
+        if option == '!':
+            if value is not None or dice.explode:
+                raise RollSyntaxError(f"unexpected '!' {_at(text, pos)}")
+            dice = dice._replace(explode=True)
+
+        elif option == 'r':
+            if dice.reroll:
+                raise RollSyntaxError(f"only one reroll {_at(text, pos)}")
+            reroll = _clamp(int(value or 1), 1, dice.sides - 1)
+            dice = dice._replace(reroll=reroll)
+
+        else:
+            if dice.keep:
+                raise RollSyntaxError(
+                    f"only one keep or drop {_at(text, pos)}")
+            number = _clamp(int(value or 1), 1, dice.count)
+            dice = dice._replace(keep=(option, number))
+
+        pos = match.end()
+
+
+def _parse_term(text, pos, max_dice):
+    """Parse a single dice or constant term."""
+    match = _dice.match(text, pos)
+
+    # Constant modifiers
+    if match is None:
+        match = _number.match(text, pos)
+
+        if match is None:
+            raise RollSyntaxError(
+                f"expected dice or a number {_at(text, pos)}",
+                'roll_modifier_invalid' if pos else 'roll_invalid'
+            )
+
+        value = min(int(match.group()), MAX_MODIFIER)
+        return Constant(value), match.end()
+
+    # Dice with count and sides limits
+    dice = Dice(
+        count=_clamp(int(match.group('count') or 1), 1, max_dice),
+        sides=_clamp(int(match.group('sides')), 2, MAX_SIDES),
+        keep=None,
+        explode=False,
+        reroll=None
+    )
+
+    return _parse_options(text, match.end(), dice)
+
+
+@lru_cache(maxsize=1024)
+def _compile(text, max_dice):
+    """Compile normalized expression text into an Expression."""
+    terms = []
+    sign = 1
+    pos = 0
+
+    # Allow a leading sign
+    match = _sign.match(text, pos)
+    if match is not None:
+        sign = -1 if match.group() == '-' else 1
+        pos = match.end()
+
+    while True:
+        term, pos = _parse_term(text, pos, max_dice)
+        terms.append((sign, term))
+
+        if len(terms) > MAX_TERMS:
+            raise RollSyntaxError(f'more than {MAX_TERMS} terms')
+
+        match = _sign.match(text, pos)
+        if match is None:
+            break
+
+        sign = -1 if match.group() == '-' else 1
+        pos = match.end()
+
+    # Parse the hit threshold
+    hit = None
+    match = _hit.match(text, pos)
+    if match is not None:
+        hit = _clamp(int(match.group('value') or 5), 1, MAX_HIT)
+        pos = match.end()
+
+    # Check for leftover text
+    if pos < len(text):
+        raise RollSyntaxError(f'unexpected text {_at(text, pos)}')
+
+    expression = Expression(tuple(terms), hit)
+
+    # Check that there's something to roll
+    if not expression.dice:
+        raise RollSyntaxError('no dice to roll')
+
+    # Check that the hit threshold can be reached
+    if hit is not None and hit > max(dice.sides for dice in expression.dice):
+        raise RollSyntaxError(
+            f"Hit threshold '{hit}' is too big",
+            'roll_hit_invalid'
+        )
+
+    return expression
+
+
+def unpack(packed):
+    """Rebuild an Expression from Expression.pack without parsing."""
+    terms, hit = packed
+    unpacked = []
+
+    for term in terms:
+        if len(term) == 2:
+            unpacked.append((term[0], Constant(term[1])))
+            continue
+
+        sign, count, sides, keep, number, explode, reroll = term
+        unpacked.append((sign, Dice(
+            count=count,
+            sides=sides,
+            keep=(keep, number) if keep else None,
+            explode=bool(explode),
+            reroll=reroll or None
+        )))
+
+    return Expression(tuple(unpacked), hit)
+
+
+def normalize(text):
+    """Normalize expression text for compiling and caching."""
+    return re.sub(r'\s+', '', text.lower())
+
+
+def compile_roll(text, max_dice=100):
+    """Compile a roll expression, re-using recently compiled ones."""
+    try:
+        return _compile(normalize(text), max_dice)
+
+    except RollSyntaxError as err:
+        if err.event == 'roll_hit_invalid':
+            raise
+
+        # Point back to the roll as it was typed
+        raise RollSyntaxError(
+            f"'{text.strip()}' is not a valid roll format: {err}",
+            err.event
+        ) from None
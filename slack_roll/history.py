@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import app
+from .events import EventReporter
+from .storage import db, RollHistory
+
+
+def dump_faces(roll_data):
+    """Return the dice rolled for each term of a roll as plain data."""
+    terms = []
+
+    for term_data in roll_data['dice']:
+        term = {'dice': str(term_data['term']), 'sign': term_data['sign']}
+
+        # Large pools only keep their face counts
+        if term_data['result'] is not None:
+            term['result'] = term_data['result']
+            term['dropped'] = term_data['dropped']
+        else:
+            term['faces'] = term_data['faces']
+
+        terms.append(term)
+
+    return terms
+
+
+def write_rows(events):
+    """Insert a batch of buffered history rows in one statement."""
+    rows = events.get('roll_history', [])
+
+    # Serialize the faces here rather than on the request path
+    for row in rows:
+        row['faces'] = json.dumps(row['faces'], separators=(',', ':'))
+
+    with app.app_context():
+        try:
+            db.session.execute(RollHistory.__table__.insert(), rows)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            raise
+
+
+# Write-behind buffer of history rows
+history_writer = EventReporter(
+    write_rows,
+    max_size=app.config['HISTORY_BUFFER_SIZE'],
+    batch_size=app.config['HISTORY_BATCH_SIZE'],
+    interval=app.config['HISTORY_FLUSH_INTERVAL'],
+    prepare=None
+)
+
+
+def record_roll(args, expression, roll_data):
+    """Buffer a roll to be written to the channel's history."""
+    if not args.get('team_id') or not args.get('channel_id'):
+        return
+
+    history_writer.report('roll_history', {
+        'team_id': args['team_id'],
+        'channel_id': args['channel_id'],
+        'user_id': args.get('user_id'),
+        'user_name': args.get('user_name'),
+        'expression': str(expression)[:255],
+        'faces': dump_faces(roll_data),
+        'total': roll_data['sum'],
+        'created': datetime.now()
+    })
+
+
+def get_page(team_id, channel_id, limit, cursor=None):
+    """Return a page of a channel's rolls, newest first.
+
+    Pages are found with a keyset on (created, id) starting after the
+    cursor row, so deep pages cost the same as the first one. Returns
+    the rows and the cursor for the next page, if there is one.
+    """
+    columns = (
+        RollHistory.id,
+        RollHistory.user_name,
+        RollHistory.expression,
+        RollHistory.total,
+        RollHistory.created
+    )
+
+    with app.app_context():
+        query = db.session.query(*columns).filter(
+            RollHistory.team_id == team_id,
+            RollHistory.channel_id == channel_id
+        )
+
+        # Continue from the last row of the previous page
+        if cursor is not None:
+            start = db.session.query(*columns).filter(
+                RollHistory.id == cursor,
+                RollHistory.team_id == team_id,
+                RollHistory.channel_id == channel_id
+            ).first()
+
+            if start is None:
+                raise ValueError(f"'{cursor}' is not a valid history cursor")
+
+            query = query.filter(
+                tuple_(RollHistory.created, RollHistory.id) <
+                tuple_(start.created, start.id)
+            )
+
+        rows = query.order_by(
+            RollHistory.created.desc(),
+            RollHistory.id.desc()
+        ).limit(limit + 1).all()
+
+    # Fetching one extra row tells us whether there's another page
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+
+    return rows, None
+
+
+def parse_history(text):
+    """Return the page size and cursor from the text after 'history'."""
+    values = text.split()
+
+    if len(values) > 2 or not all(value.isdigit() for value in values):
+        raise ValueError('')
+
+    limit = int(values[0]) if values else app.config['HISTORY_PAGE_SIZE']
+    cursor = int(values[1]) if len(values) > 1 else None
+
+    max_limit = app.config['HISTORY_MAX_PAGE_SIZE']
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f'You can show between 1 and {max_limit} rolls')
+
+    return limit, cursor
+
+
+def get_history(text, command, team_id, channel_id):
+    """Return the history message for the text following 'history'."""
+    try:
+        limit, cursor = parse_history(text)
+
+        # Include rolls still waiting in this process's buffer
+        history_writer.flush()
+
+        rows, next_cursor = get_page(team_id, channel_id, limit, cursor)
+
+    except ValueError as err:
+        if str(err):
+            return str(err)
+        return f'Usage: `{command} history [number] [cursor]`'
+
+    if not rows:
+        return 'No rolls have been recorded in this channel yet'
+
+    # List one roll per line
+    lines = ['*Recent rolls in this channel:*']
+    lines.extend(
+        f"`{row.created:%Y-%m-%d %H:%M}`  {row.user_name} rolled "
+        f"{row.expression}:  *{row.total}*"
+        for row in rows
+    )
+
+    if next_cursor is not None:
+        lines.append(f'\nMore: `{command} history {limit} {next_cursor}`')
+
+    return '\n'.join(lines)
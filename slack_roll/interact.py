@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import argparse
+
+import requests
+from itsdangerous import URLSafeSerializer, BadSignature
+
+from slack_roll import app, report_event, slack
+from slack_roll.expression import unpack
+
+
+# Signs the roll carried by each Reroll button, created on first use
+_serializer = None
+
+# Action ID of the Reroll button
+REROLL_ACTION = 'reroll'
+
+# Longest text that fits in a section block
+MAX_SECTION_LENGTH = 3000
+
+
+def is_enabled():
+    """Check whether Reroll buttons can be offered and handled.
+
+    Clicks are only trusted when Slack signs them, and button values
+    need a secret key to be signed with.
+    """
+    return app.config['REROLL_BUTTON'] and \
+        bool(app.config['SLACK_SIGNING_SECRET']) and \
+        bool(app.config['SECRET_KEY'])
+
+
+def get_serializer():
+    """Return the button value serializer, creating it on first use."""
+    global _serializer  # pylint: disable=global-statement
+
+    if _serializer is None:
+        _serializer = URLSafeSerializer(
+            app.config['SECRET_KEY'], salt='reroll')
+
+    return _serializer
+
+
+def is_response_url(url):
+    """Check that a response_url points at Slack."""
+    return isinstance(url, str) and \
+        url.startswith(app.config['SLACK_RESPONSE_URL_PREFIX'])
+
+
+def dump_roll(expression):
+    """Return a signed, compact encoding of a compiled roll."""
+    return get_serializer().dumps(expression.pack())
+
+
+def load_roll(value):
+    """Return the roll signed by dump_roll, raising BadSignature if forged."""
+    return unpack(get_serializer().loads(value))
+
+
+def get_blocks(text, reroll):
+    """Return message blocks showing the roll with a Reroll button.
+
+    Returns None if there's nothing to reroll, or the text holds several
+    rolls posted together.
+    """
+    if not reroll or '\n' in text or len(text) > MAX_SECTION_LENGTH:
+        return None
+
+    return [
+        {
+            'type': 'section',
+            'text': {'type': 'mrkdwn', 'text': text}
+        },
+        {
+            'type': 'actions',
+            'elements': [{
+                'type': 'button',
+                'action_id': REROLL_ACTION,
+                'text': {'type': 'plain_text', 'text': 'Reroll'},
+                'value': reroll
+            }]
+        }
+    ]
+
+
+def get_message(text, reroll, **fields):
+    """Return a response_url message for a roll, with blocks if any."""
+    message = {**fields, 'text': text}
+
+    blocks = get_blocks(text, reroll)
+    if blocks:
+        message['blocks'] = blocks
+
+    return message
+
+
+def get_reroll(payload):
+    """Return the value of a Reroll button click in the payload, or None."""
+    if payload.get('type') != 'block_actions':
+        return None
+
+    for action in payload.get('actions', []):
+        if action.get('action_id') == REROLL_ACTION:
+            return action.get('value')
+
+    return None
+
+
+def handle_payload(payload):
+    """Roll again for a Reroll button click and post the new roll.
+
+    The roll comes straight from the signed button value, so there's no
+    parsing, and it's posted through the response_url, so no team lookup
+    or token check is needed either. Returns False if the payload isn't
+    a valid Reroll click.
+    """
+    # pylint: disable=import-outside-toplevel
+    from slack_roll.roll import do_roll
+
+    value = get_reroll(payload)
+    if value is None:
+        return False
+
+    try:
+        expression = load_roll(value)
+    except (BadSignature, TypeError, ValueError):
+        report_event('reroll_invalid', {'payload': payload})
+        return False
+
+    # Only ever post back to Slack
+    if not is_response_url(payload.get('response_url')):
+        report_event('reroll_invalid', {'payload': payload})
+        return False
+
+    user = payload.get('user', {})
+    args = {
+        'team_id': payload.get('team', {}).get('id'),
+        'channel_id': payload.get('channel', {}).get('id'),
+        'user_id': user.get('id'),
+        'user_name': user.get('username') or user.get('name'),
+        'response_url': payload.get('response_url')
+    }
+
+    roll = argparse.Namespace(expression=expression)
+    text = do_roll(roll, args['user_name'], args)
+
+    # Post a new message, so earlier rolls can't be written over
+    try:
+        slack.get_session().post(
+            args['response_url'],
+            json=get_message(
+                text,
+                value,
+                response_type='in_channel',
+                replace_original=False
+            ),
+            timeout=slack.get_timeout()
+        ).raise_for_status()
+
+    except requests.RequestException as err:
+        report_event('reroll_error', {
+            'error': str(err),
+            'team_id': args['team_id']
+        })
+
+    return True
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import os
+import random
+import cProfile
+from time import perf_counter, time
+from bisect import bisect_left
+from threading import Lock
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+
+# Default latency buckets, in seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _format_labels(labels):
+    """Format a label tuple for the Prometheus text format."""
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in labels)
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    """Thread-safe counter with optional labels."""
+
+    def __init__(self, name, description):
+        """Set up an empty counter."""
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter for a set of labels."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        """Return the counter in the Prometheus text format."""
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} counter'
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """Thread-safe latency histogram with optional labels."""
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        """Set up an empty histogram."""
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value, **labels):
+        """Record a single observation for a set of labels."""
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        """Return the histogram in the Prometheus text format."""
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram'
+        ]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    bucket = _format_labels(labels + (('le', bound),))
+                    lines.append(f'{self.name}_bucket{bucket} {cumulative}')
+                lines.append(
+                    f'{self.name}_sum{_format_labels(labels)} {total}')
+                lines.append(
+                    f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Gauge:  # pylint: disable=too-few-public-methods
+    """Value read from a callback each time metrics are rendered."""
+
+    def __init__(self, name, description, func, kind='gauge'):
+        """Set the callback, which returns a number or {labels: number}."""
+        self.name = name
+        self.description = description
+        self.func = func
+        self.kind = kind
+
+    def render(self):
+        """Return the gauge in the Prometheus text format."""
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.kind}'
+        ]
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(labels)} {value}')
+        return lines
+
+
+# Registered metrics, in render order
+registry = []
+
+
+def register(metric):
+    """Add a metric to the registry and return it."""
+    registry.append(metric)
+    return metric
+
+
+# Built-in metrics
+stage_seconds = register(Histogram(
+    'slack_roll_stage_seconds',
+    'Time spent in each stage of handling a request.'
+))
+stage_errors = register(Counter(
+    'slack_roll_stage_errors_total',
+    'Stages that ended with an exception.'
+))
+request_seconds = register(Histogram(
+    'slack_roll_request_seconds',
+    'Time spent handling each HTTP request.'
+))
+requests_total = register(Counter(
+    'slack_roll_requests_total',
+    'HTTP requests handled, by endpoint and status.'
+))
+
+
+@contextmanager
+def stage(name):
+    """Time a block of code as a named stage of the current request."""
+    start = perf_counter()
+
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        elapsed = perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+
+        # Keep per-request timings for the Server-Timing header
+        if has_request_context():
+            timings = g.setdefault('stage_timings', {})
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def render():
+    """Return every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def server_timing(timings):
+    """Format stage timings as a Server-Timing header value."""
+    return ', '.join(
+        f'{name};dur={elapsed * 1000:.2f}'
+        for name, elapsed in timings.items()
+    )
+
+
+def start_request(sample_rate):
+    """Start timing a request, profiling a sample of them."""
+    g.request_start = perf_counter()
+
+    if sample_rate and random.random() < sample_rate:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def finish_request(response, endpoint, profile_dir):
+    """Record request metrics and add the Server-Timing header."""
+    elapsed = perf_counter() - g.get('request_start', perf_counter())
+
+    # Dump the profile of sampled requests
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(
+            profile_dir, f'{endpoint}-{time():.6f}-{os.getpid()}.prof'))
+
+    # Record request metrics
+    request_seconds.observe(elapsed, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, status=response.status_code)
+
+    timings = dict(g.get('stage_timings', {}))
+    timings['total'] = elapsed
+    response.headers['Server-Timing'] = server_timing(timings)
+
+    return response
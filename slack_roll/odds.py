@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import math
+from functools import lru_cache
+from itertools import accumulate
+
+from .cache import TTLCache
+from .expression import Constant, RollSyntaxError, compile_roll
+from .rng import get_numpy
+
+
+# Percentiles to report
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Exact sum distributions of pools of dice, keyed by (count, sides)
+pool_cache = TTLCache(float('inf'), max_size=512)
+
+
+class OddsError(ValueError):
+    """Raised for rolls that odds can't be computed for."""
+
+
+def add_die(dist, sides):
+    """Convolve a sum distribution with one more uniform die.
+
+    Uses a sliding window over prefix sums, so each die costs time
+    linear in the length of the distribution.
+    """
+    numpy = get_numpy()
+    if numpy is not None:
+        prefix = numpy.concatenate(([0.0], numpy.cumsum(dist)))
+        padded = numpy.concatenate((prefix, numpy.full(sides - 1, prefix[-1])))
+        upper = padded[1:len(dist) + sides]
+        lower = numpy.concatenate((numpy.zeros(sides - 1), prefix))[
+            :len(dist) + sides - 1]
+        return (upper - lower) / sides
+
+    prefix = [0.0] + list(accumulate(dist))
+    total = prefix[-1]
+    length = len(dist) + sides - 1
+
+    return [
+        ((prefix[index + 1] if index + 1 < len(prefix) else total) -
+         prefix[max(0, index + 1 - sides)]) / sides
+        for index in range(length)
+    ]
+
+
+def pool_distribution(count, sides):
+    """Return the distribution of the sum of count dice, offset by count.
+
+    Every pool size on the way is memoized, so a query for a nearby
+    count only adds the dice it is missing.
+    """
+    dist = pool_cache.get((count, sides))
+    if dist is not None:
+        return dist
+
+    # Start from the largest smaller pool already computed
+    start = count - 1
+    while start > 0:
+        dist = pool_cache.get((start, sides))
+        if dist is not None:
+            break
+        start -= 1
+    else:
+        dist = [1.0]
+
+    # Add dice one at a time, keeping each intermediate pool
+    for size in range(start + 1, count + 1):
+        dist = add_die(dist, sides)
+        pool_cache.set((size, sides), dist)
+
+    return dist
+
+
+def sum_distribution(expression):
+    """Return (minimum sum, probabilities) for a compiled expression."""
+    dice = []
+    minimum = 0
+
+    for sign, term in expression.terms:
+        if isinstance(term, Constant):
+            minimum += sign * term.value
+            continue
+
+        if not term.plain:
+            raise OddsError(
+                "Odds aren't available for keep, drop, exploding "
+                "or rerolled dice")
+
+        dice.append((sign, term))
+
+    # Start from the biggest pool and add the other dice one at a time
+    dice.sort(key=lambda item: item[1].count * item[1].sides, reverse=True)
+    (sign, largest), rest = dice[0], dice[1:]
+
+    dist = pool_distribution(largest.count, largest.sides)
+    minimum += largest.count if sign > 0 else -largest.count * largest.sides
+    if sign < 0:
+        dist = dist[::-1]
+
+    for sign, term in rest:
+        for _ in range(term.count):
+            dist = add_die(dist, term.sides)
+        minimum += term.count if sign > 0 else -term.count * term.sides
+
+    return minimum, [float(value) for value in dist]
+
+
+def sum_moments(expression):
+    """Return the exact mean and standard deviation of the sum."""
+    mean = 0.0
+    variance = 0.0
+
+    for sign, term in expression.terms:
+        if isinstance(term, Constant):
+            mean += sign * term.value
+            continue
+
+        mean += sign * term.count * (term.sides + 1) / 2
+        variance += term.count * (term.sides ** 2 - 1) / 12
+
+    return mean, math.sqrt(variance)
+
+
+def hit_distribution(expression):
+    """Return the probabilities of each number of hits."""
+    dist = [1.0]
+
+    for _, term in expression.terms:
+        if isinstance(term, Constant):
+            continue
+
+        chance = max(0, term.sides - expression.hit + 1) / term.sides
+        binomial = [
+            math.comb(term.count, hits) *
+            chance ** hits * (1 - chance) ** (term.count - hits)
+            for hits in range(term.count + 1)
+        ]
+
+        # Combine with the hits from other dice
+        combined = [0.0] * (len(dist) + len(binomial) - 1)
+        for hits, prob in enumerate(dist):
+            for more, more_prob in enumerate(binomial):
+                combined[hits + more] += prob * more_prob
+        dist = combined
+
+    return dist
+
+
+def critical_chances(expression):
+    """Return the chances of at least one critical hit and miss."""
+    no_crit_hit = 1.0
+    no_crit_miss = 1.0
+
+    for _, term in expression.terms:
+        if isinstance(term, Constant):
+            continue
+
+        if term.sides >= expression.hit:
+            no_crit_hit *= (1 - 1 / term.sides) ** term.count
+        if expression.hit > 1:
+            no_crit_miss *= (1 - 1 / term.sides) ** term.count
+
+    return 1 - no_crit_hit, 1 - no_crit_miss
+
+
+def percentile(minimum, dist, percent):
+    """Return the smallest sum with at least percent% of rolls at or below."""
+    target = percent / 100
+    total = 0.0
+
+    for offset, prob in enumerate(dist):
+        total += prob
+        if total >= target - 1e-12:
+            return minimum + offset
+
+    return minimum + len(dist) - 1
+
+
+def chance_at_least(minimum, dist, value):
+    """Return P(sum >= value)."""
+    offset = max(0, value - minimum)
+    return min(1.0, max(0.0, sum(dist[offset:])))
+
+
+def _percent(chance):
+    """Format a probability as a percentage."""
+    return f'{chance * 100:.2f}%'
+
+
+def parse_odds(text):
+    """Split odds text into the roll and an optional target sum."""
+    roll, _, target = text.partition('>=')
+    roll = roll.strip()
+
+    if not roll:
+        raise OddsError('')
+
+    if target.strip():
+        try:
+            return roll, int(target.strip())
+        except ValueError:
+            raise OddsError(
+                f"'{target.strip()}' is not a valid target") from None
+
+    return roll, None
+
+
+@lru_cache(maxsize=256)
+def format_odds(roll, target, max_dice):
+    """Compute and format the odds for a roll."""
+    expression = compile_roll(roll, max_dice)
+
+    if sum(dice.count for dice in expression.dice) > max_dice:
+        raise OddsError(f'Odds are limited to {max_dice} dice')
+
+    minimum, dist = sum_distribution(expression)
+    mean, deviation = sum_moments(expression)
+
+    # Default to the chance of beating the average
+    if target is None:
+        target = math.ceil(mean)
+
+    percentiles = '  '.join(
+        f'{percent}% *{percentile(minimum, dist, percent)}*'
+        for percent in PERCENTILES
+    )
+
+    lines = [
+        f'*Odds for {expression}*',
+        f'Sum: mean *{mean:.2f}*, std dev *{deviation:.2f}*, '
+        f'range {minimum}-{minimum + len(dist) - 1}',
+        f'Percentiles: {percentiles}',
+        f'P(sum ≥ {target}): '
+        f'*{_percent(chance_at_least(minimum, dist, target))}*'
+    ]
+
+    # Add hit odds
+    if expression.hit is not None:
+        hits = hit_distribution(expression)
+        expected = sum(count * prob for count, prob in enumerate(hits))
+        half = math.ceil((len(hits) - 1) / 2)
+        crit_hit, crit_miss = critical_chances(expression)
+
+        lines.append(
+            f'Hits: expected *{expected:.2f}*, '
+            f'P(≥ 1 hit) *{_percent(sum(hits[1:]))}*, '
+            f'P(≥ {half} hits) *{_percent(sum(hits[half:]))}*'
+        )
+        lines.append(
+            f'Criticals: P(any critical hit) *{_percent(crit_hit)}*, '
+            f'P(any critical miss) *{_percent(crit_miss)}*'
+        )
+
+    return '\n'.join(lines)
+
+
+def get_odds(text, command, max_dice):
+    """Return the odds message for the text following 'odds'."""
+    try:
+        roll, target = parse_odds(text)
+        return format_odds(roll, target, max_dice)
+
+    except OddsError as err:
+        if str(err):
+            return str(err)
+
+    except RollSyntaxError as err:
+        return str(err)
+
+    # Show usage for empty rolls
+    return f'Usage: `{command} odds 6d10 hit7 >=40`'
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+from time import monotonic
+from threading import BoundedSemaphore, Lock
+
+
+class CircuitBreaker:
+    """Fail fast after repeated failures, then let a trial call through.
+
+    The breaker opens after threshold failures in a row. While open every
+    call is refused until reset_timeout has passed, when a single trial
+    call is allowed; if it succeeds the breaker closes again, otherwise
+    it stays open for another reset_timeout.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        """Start closed, with no failures recorded."""
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        """Return 'closed', 'open' or 'half_open'."""
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if monotonic() >= self._opened_at + self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """Check whether a call may go ahead."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            # Let one trial call through, and keep refusing the rest
+            now = monotonic()
+            if now >= self._opened_at + self.reset_timeout:
+                self._opened_at = now
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """Close the breaker after a successful call."""
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """Count a failed call, opening the breaker if there are too many."""
+        with self._lock:
+            self.failures += 1
+
+            # A failed trial call keeps the breaker open
+            if self._opened_at is not None:
+                self._opened_at = monotonic()
+            elif self.failures >= self.threshold:
+                self._opened_at = monotonic()
+                self.trips += 1
+
+    def stats(self):
+        """Return counters for failures, trips and rejected calls."""
+        with self._lock:
+            return {
+                'failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected
+            }
+
+
+class ConcurrencyLimiter:
+    """Cap the number of requests in progress, shedding any excess."""
+
+    def __init__(self, limit, max_wait=0.0):
+        """Allow limit requests at once, each waiting up to max_wait."""
+        self.limit = limit
+        self.max_wait = max_wait
+        self.active = 0
+        self.shed = 0
+        self._slots = BoundedSemaphore(limit)
+        self._lock = Lock()
+
+    def acquire(self, wait=None):
+        """Take a slot, returning False if none freed up in time."""
+        wait = self.max_wait if wait is None else wait
+
+        if wait > 0:
+            acquired = self._slots.acquire(timeout=wait)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+
+        if not acquired:
+            with self._lock:
+                self.shed += 1
+            return False
+
+        with self._lock:
+            self.active += 1
+        return True
+
+    def release(self):
+        """Give back a slot taken by acquire."""
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def stats(self):
+        """Return the requests in progress and the number shed."""
+        with self._lock:
+            return {'active': self.active, 'shed': self.shed}
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import os
+import random
+from functools import lru_cache
+from threading import Lock, local
+
+from . import app
+
+
+@lru_cache(maxsize=None)
+def get_numpy():
+    """Return the numpy module, or None if it isn't installed.
+
+    NumPy is slow to import, so it is only loaded by the first large pool
+    or odds query rather than with the app.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover
+        return None
+
+    return numpy
+
+
+class FastRandom:
+    """Independent, OS-seeded PRNG streams for each thread.
+
+    Small pools use the stdlib generator, which has less per-call
+    overhead; large pools use NumPy when it is installed.
+    """
+
+    # Pool size at which NumPy becomes faster
+    numpy_threshold = 64
+
+    def __init__(self):
+        """Set up empty per-thread streams."""
+        self._streams = local()
+
+    def _stream(self):
+        """Return this thread's generators, creating them if needed.
+
+        The NumPy generator is only created once a large pool is rolled.
+        """
+        streams = self._streams
+
+        if not hasattr(streams, 'rng'):
+            streams.rng = random.Random(os.urandom(16))
+            streams.numpy = None
+
+        return streams
+
+    def roll(self, count, sides):
+        """Return count faces between 1 and sides."""
+        streams = self._stream()
+        numpy = get_numpy() if count >= self.numpy_threshold else None
+
+        if numpy is not None:
+            if streams.numpy is None:
+                seed = int.from_bytes(os.urandom(16), 'big')
+                streams.numpy = numpy.random.default_rng(seed)
+
+            return streams.numpy.integers(1, sides + 1, size=count)
+
+        return streams.rng.choices(range(1, sides + 1), k=count)
+
+
+class SeededRandom:
+    """A single deterministic stream, for tests and replaying rolls."""
+
+    def __init__(self, seed=0):
+        """Start the stream from a seed."""
+        self._lock = Lock()
+        self.seed(seed)
+
+    def seed(self, seed):
+        """Restart the stream from a seed."""
+        with self._lock:
+            self._rng = random.Random(seed)
+
+    def roll(self, count, sides):
+        """Return count faces between 1 and sides."""
+        with self._lock:
+            return self._rng.choices(range(1, sides + 1), k=count)
+
+
+class SecureRandom:
+    """CSPRNG that reads os.urandom in large blocks.
+
+    Faces are drawn by rejection sampling single bytes, so every face of
+    dice with up to 255 sides is exactly equally likely. Each thread keeps
+    its own buffer, so there is one syscall per block instead of per die.
+    """
+
+    def __init__(self, block_size=65536):
+        """Set up empty per-thread buffers."""
+        self.block_size = block_size
+        self._buffers = local()
+        self._tables = {}
+
+    def _read(self, size):
+        """Return size random bytes from this thread's buffer."""
+        buffers = self._buffers
+        data = getattr(buffers, 'data', b'')
+        offset = getattr(buffers, 'offset', 0)
+
+        # Refill with a new block when the buffer runs low
+        if len(data) - offset < size:
+            data = data[offset:] + os.urandom(max(self.block_size, size))
+            offset = 0
+
+        buffers.data = data
+        buffers.offset = offset + size
+
+        return data[offset:offset + size]
+
+    def _table(self, sides):
+        """Return a byte translation table and the bytes to reject."""
+        table = self._tables.get(sides)
+
+        if table is None:
+            # Reject the top bytes that would favour the low faces
+            limit = 256 - 256 % sides
+            table = self._tables[sides] = (
+                bytes(byte % sides + 1 if byte < limit else 0
+                      for byte in range(256)),
+                bytes(range(limit, 256))
+            )
+
+        return table
+
+    def roll(self, count, sides):
+        """Return count unbiased faces between 1 and sides."""
+        if not 1 < sides < 256:
+            raise ValueError('SecureRandom supports 2-255 sides')
+
+        translation, rejected = self._table(sides)
+        accept = (256 - len(rejected)) / 256
+        faces = b''
+
+        while len(faces) < count:
+            needed = count - len(faces)
+            data = self._read(int(needed / accept * 1.05) + 8)
+
+            # Map accepted bytes to faces and drop the rest in one pass
+            faces += data.translate(translation, rejected)
+
+        return list(faces[:count])
+
+
+# RNG backends by name
+BACKENDS = {
+    'fast': FastRandom,
+    'seeded': lambda: SeededRandom(app.config['RNG_SEED']),
+    'secure': lambda: SecureRandom(app.config['RNG_BUFFER_SIZE'])
+}
+
+# Backend used by the roll engine, created on first use
+_backend = None
+
+
+def get_rng():
+    """Return the configured RNG backend."""
+    global _backend  # pylint: disable=global-statement
+
+    if _backend is None:
+        _backend = BACKENDS[app.config['RNG_BACKEND']]()
+
+    return _backend
+
+
+def set_rng(backend):
+    """Replace the RNG backend, such as with a seeded one for replays."""
+    global _backend  # pylint: disable=global-statement
+    _backend = backend
+
+
+def reset_rng():
+    """Discard OS-seeded streams, such as after forking a worker."""
+    global _backend  # pylint: disable=global-statement
+
+    # Seeded streams are meant to repeat, so they are kept
+    if isinstance(_backend, (FastRandom, SecureRandom)):
+        _backend = None
+
+
+# Don't share random state or buffered entropy with forked workers
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_rng)
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
-# pylint: disable=global-variable-not-assigned,global-statement
 """
 Copyright (c) 2015-2021 Erin Morelli.
 
@@ -16,40 +15,83 @@ The above copyright notice and this permission notice shall be
 included in all copies or substantial portions of the Software.
 """
 
-import re
-import random
+import json
 import argparse
-from slacker import Auth, Chat, Error
-
-from slack_roll.storage import Team
-from slack_roll import project_info, allowed_commands, report_event
-
+from datetime import datetime, timedelta
 
-# Set globals
-errors = []
-command = None
+import requests
+from slacker import Auth, Chat, Error
+from sqlalchemy.exc import SQLAlchemyError
+
+from slack_roll import slack
+from slack_roll import history
+from slack_roll import stats
+from slack_roll import interact
+from slack_roll.metrics import stage
+from slack_roll.odds import get_odds
+from slack_roll.cache import TTLCache
+from slack_roll.delivery import DeliveryQueue
+from slack_roll.scheduler import PostScheduler
+from slack_roll.resilience import ConcurrencyLimiter
+from slack_roll import storage
+from slack_roll.expression import compile_roll, RollSyntaxError
+from slack_roll import app, project_info, allowed_commands, report_event
+
+
+# Cache of token validation results, keyed by (team_id, is_bot)
+token_cache = TTLCache(app.config['TOKEN_CACHE_TTL'])
 
 # Set not authenticated error message
 auth_error = f"{project_info['name']} is not authorized to post in this team:" \
              f" *<{project_info['base_url']}|Click here to authorize>*"
 
+# Set delivery queue full error message
+busy_error = f"{project_info['name']} is very busy right now, " \
+             f"please try again in a moment."
+
+# Set Slack unavailable error message
+unavailable_error = f"{project_info['name']} can't reach Slack right now, " \
+                    f"please try again in a moment."
+
+# Slash commands being handled at once
+roll_limiter = ConcurrencyLimiter(
+    app.config['MAX_CONCURRENT_ROLLS'],
+    app.config['ADMISSION_WAIT']
+)
+
+# Slack errors that will not go away by trying again
+permanent_errors = [
+    'channel_not_found',
+    'not_in_channel',
+    'is_archived',
+    'msg_too_long',
+    'invalid_auth',
+    'account_inactive',
+    'token_revoked',
+    'not_authed'
+]
+
+# Slack errors meaning a team's tokens no longer work
+auth_errors = ['invalid_auth', 'account_inactive', 'token_revoked']
+
+
+class RollMessage(Exception):
+    """Raised by the parser to reply with a message instead of a roll."""
+
 
 class RollParser(argparse.ArgumentParser):
     """Custom ArgumentParser object for special error and help messages."""
 
     def error(self, message):
-        """Store all error messages in global errors list."""
-        global errors
-        errors.append(message)
+        """Stop parsing and reply with the error message."""
+        raise RollMessage(message)
 
-    def print_help(self, dice_roll=None):  # pylint: disable=arguments-differ
+    # pylint: disable=arguments-differ
+    def print_help(self, dice_roll=None, command=allowed_commands[0]):
         """Generate help and list messages."""
-        global errors
-        global command
-
         if dice_roll == 'help':
             help_msg = "*{app_name}* can roll anywhere from "
-            help_msg += "*1-100 dice* with *2-100 sides* each.\n"
+            help_msg += "*1-{max_dice} dice* with *2-100 sides* each.\n"
             help_msg += "Here are some examples:\n\n"
             help_msg += "`{command}`\n\tRolls a single 6-sided die\n\n"
             help_msg += "`{command} d20`\n\tRolls a single 20-sided die\n\n"
@@ -58,147 +100,80 @@ class RollParser(argparse.ArgumentParser):
             help_msg += "Rolls a single 6-sided die with a +3 modifier\n\n"
             help_msg += "`{command} 10d6 hit5`\n\t"
             help_msg += "Counts hits for rolls >= 5 and misses for < 5\n\n"
+            help_msg += "`{command} 2d6+1d8+3`\n\t"
+            help_msg += "Adds up several kinds of dice and modifiers\n\n"
+            help_msg += "`{command} 4d6kh3`\n\t"
+            help_msg += "Keeps the highest 3 (also `kl`, `dh` and `dl`)\n\n"
+            help_msg += "`{command} 3d6!`\n\t"
+            help_msg += "Rolls an extra die for every 6\n\n"
+            help_msg += "`{command} 4d6r1`\n\tRerolls any 1s once\n\n"
+            help_msg += "`{command} odds 6d10 hit7 >=40`\n\t"
+            help_msg += "Shows the exact odds for a roll\n\n"
+            help_msg += "`{command} history 10`\n\t"
+            help_msg += "Shows the last 10 rolls in this channel\n\n"
+            help_msg += "`{command} stats`\n\t"
+            help_msg += "Shows roll stats for you and this channel\n\n"
             help_msg += "`{command} help`\n\tShows this message\n"
 
-            errors.append(help_msg.format(
+            raise RollMessage(help_msg.format(
                 app_name=project_info['name'],
+                max_dice=app.config['MAX_DICE'],
                 command=command
             ))
 
-        elif dice_roll == 'version':
-            errors.append(f"{project_info['name']} v{project_info['version']}")
+        if dice_roll == 'version':
+            raise RollMessage(
+                f"{project_info['name']} v{project_info['version']}")
+
+        if dice_roll.split(' ', 1)[0] == 'odds':
+            raise RollMessage(get_odds(
+                dice_roll[len('odds'):],
+                command,
+                app.config['ODDS_MAX_DICE']
+            ))
 
 
 class RollAction(argparse.Action):  # pylint: disable=too-few-public-methods
     """Custom Action object for validating and parsing roll arguments."""
 
-    @staticmethod
-    def _get_dice(result):
-        """Parse the die count from roll. Default = 1."""
-        if not result.group('count'):
-            return 1
-
-        # Convert to an integer
-        count = int(result.group('count'))
-
-        # Set 100 count max
-        if count > 100:
-            count = 100
-
-        # Set 1 count min
-        if count < 1:
-            count = 1
-
-        # Return the number of dice
-        return count
-
-    @staticmethod
-    def _get_sides(result):
-        """Parse the number of sides from the roll. Default = 6."""
-        if not result.group('sides'):
-            return 6
-
-        # Convert to an integer
-        sides = int(result.group('sides'))
-
-        # Set 100 side max
-        if sides > 100:
-            sides = 100
-
-        # Set 2 side min
-        if sides < 2:
-            sides = 2
-
-        # Return number of sides
-        return sides
-
-    @staticmethod
-    def _get_modifiers(result):
-        """Parse the modifier data from the roll. Default = None, None."""
-        if not result.group('mod'):
-            return None, None
-
-        # Set modifier data
-        modifier = result.group('mod')
-        modifier_count = int(result.group('mod_count'))
-
-        # Set 100 modifier max
-        if modifier_count > 100:
-            modifier_count = 100
-
-        # Return modifier type and count
-        return modifier, modifier_count
-
-    @staticmethod
-    def _get_hits(result):
-        """Parse the hit data from the roll. Default = None."""
-        if not result.group('hit'):
-            return None
-
-        # Set default hit to 5 as per shadowrun mechanics
-        hit = 5
-
-        # See if we have a hit threshold
-        if result.group('hit_count') is not None:
-            hit = int(result.group('hit_count'))
-
-            # Set max hit to 100
-            if hit > 100:
-                hit = 100
-
-        # Return hit value
-        return hit
-
     def __call__(self, parser, namespace, values, option_string=None):
         """Validate flip arguments and stores them to namespace."""
         dice_roll = values.lower()
 
         # Check for help
-        if dice_roll in ['help', 'version']:
-            parser.print_help(dice_roll)
+        if dice_roll in ['help', 'version'] or \
+                dice_roll.split(' ', 1)[0] == 'odds':
+            parser.print_help(dice_roll, namespace.command)
             return
 
-        # Parse the roll
-        result = re.match(
-            r'(?P<count>\d+)?d(?P<sides>\d+)' +
-            r'(?:(?P<mod>[-+])(?P<mod_count>\d+))?' +
-            r'(?:\s(?P<hit>hit)(?P<hit_count>\d+)?)?',
-            dice_roll,
-            re.I
-        )
-
-        # Check that roll is valid
-        if not result:
-            report_event('roll_invalid', {'roll': dice_roll})
-            parser.error(f"'{dice_roll}' is not a valid roll format")
-
-        # Get the number of dice
-        count = self._get_dice(result)
+        # Check for channel history
+        if dice_roll.split(' ', 1)[0] == 'history' and \
+                getattr(namespace, 'channel_id', None):
+            raise RollMessage(history.get_history(
+                dice_roll[len('history'):],
+                namespace.command,
+                namespace.team_id,
+                namespace.channel_id
+            ))
 
-        # Get the number of sides
-        sides = self._get_sides(result)
+        # Check for channel stats
+        if dice_roll == 'stats' and getattr(namespace, 'channel_id', None):
+            raise RollMessage(stats.get_stats(
+                namespace.team_id,
+                namespace.channel_id,
+                namespace.user_id
+            ))
 
-        # Get the modifiers
+        # Compile the roll expression
         try:
-            modifier, modifier_count = self._get_modifiers(result)
-        except TypeError:
-            report_event('roll_modifier_invalid', {'roll': dice_roll})
-            parser.error(f"'{dice_roll}' is not a valid roll format")
-            return
-
-        # Get the hit
-        hit = self._get_hits(result)
-        if hit and hit > sides:
-            report_event('roll_hit_invalid', {'roll': dice_roll})
-            parser.error(f"Hit threshold '{hit}' is too big")
+            expression = compile_roll(dice_roll, app.config['MAX_DICE'])
+        except RollSyntaxError as err:
+            report_event(err.event, {'roll': dice_roll})
+            parser.error(str(err))
             return
 
         # Set values
-        setattr(namespace, 'count', count)
-        setattr(namespace, 'sides', sides)
-        setattr(namespace, 'modifier', modifier)
-        setattr(namespace, 'modifier_count', modifier_count)
-        setattr(namespace, 'hit', hit)
+        setattr(namespace, 'expression', expression)
 
 
 def get_parser():
@@ -208,18 +183,44 @@ def get_parser():
     return parser
 
 
+# Shared parser, which keeps no per-request state
+roll_parser = get_parser()
+
+
+def parse_roll(args):
+    """Parse the requested roll, or raise a RollMessage to reply with."""
+    # If there's no input, use the default roll
+    dice_roll = 'd6' if not args['text'] else args['text']
+
+    # Keep request details on the namespace rather than the parser
+    namespace = argparse.Namespace(
+        command=args['command'],
+        team_id=args.get('team_id'),
+        channel_id=args.get('channel_id'),
+        user_id=args.get('user_id') or args.get('user_name')
+    )
+
+    try:
+        return roll_parser.parse_args(['--', dice_roll], namespace)
+
+    except RollMessage as msg:
+        report_event('parser_errors', {'errors': [str(msg)]})
+        raise
+
+
 def get_team(args):
     """Return authenticated team token data."""
-    return Team.query.get(args['team_id'])
+    return storage.get_team(args['team_id'])
 
 
 def is_valid_token(token):
     """Check that the team has a valid token."""
-    auth = Auth(token)
+    auth = slack.get_api(Auth, token)
 
     try:
         # Make request
-        result = auth.test()
+        with stage('auth_test'):
+            result = auth.test()
 
     except Error as err:
         # Check for auth errors
@@ -235,21 +236,120 @@ def is_valid_token(token):
     return True
 
 
-def format_roll_response(roll, user, roll_data):
+def is_recently_validated(team):
+    """Check whether the token sweeper recently found a team's tokens ok."""
+    max_age = app.config['TOKEN_STATUS_MAX_AGE']
+
+    return bool(max_age) and \
+        team.token_status == 'ok' and \
+        team.last_validated_at is not None and \
+        datetime.now() - team.last_validated_at < timedelta(seconds=max_age)
+
+
+def is_valid_team_token(team, is_bot=False):
+    """Check a team token, re-using recent results for the same team."""
+    # Trust the sweeper, and only check live when its status is stale or bad
+    if is_recently_validated(team):
+        return True
+
+    return token_cache.get_or_set(
+        (team.id, is_bot),
+        lambda: is_valid_token(team.get_token(is_bot)),
+        lambda valid: app.config[
+            'TOKEN_CACHE_TTL' if valid else 'TOKEN_CACHE_FAILURE_TTL'
+        ]
+    )
+
+
+def forget_team(team_id):
+    """Drop any cached team data and token validation results for a team."""
+    storage.team_cache.delete(team_id)
+    token_cache.delete_matching(lambda key: key[0] == team_id)
+
+
+def is_auth_failure(err):
+    """Check whether a failed post means the team's tokens stopped working."""
+    return isinstance(err, Error) and str(err) in auth_errors
+
+
+def report_auth_failure(err, args):
+    """Forget a team whose tokens stopped working and ask to re-authorize.
+
+    The cached team, its token checks and the sweeper's last result are
+    all dropped, so the next roll checks the team's tokens again.
+    """
+    team_id = args.get('team_id')
+    report_event('auth_error', {
+        'error': str(err),
+        'args': args,
+        'team_id': team_id
+    })
+
+    forget_team(team_id)
+    try:
+        storage.clear_token_status(team_id)
+    except SQLAlchemyError:
+        report_event('token_status_error', {'team_id': team_id})
+
+    return auth_error
+
+
+def format_faces(term_data):
+    """Format the individual results, or face counts for large pools."""
+    if term_data['result'] is not None:
+        return ',  '.join(
+            f'~{result}~' if dropped else str(result)
+            for result, dropped in zip(
+                term_data['result'],
+                term_data['dropped']
+            )
+        )
+
+    # Summarize how many times each face came up
+    return ',  '.join(
+        f'{face}s: {total}'
+        for face, total in enumerate(term_data['faces'], 1)
+        if total
+    )
+
+
+def format_roll_response(expression, user, roll_data):
     """Format bot response message."""
-    formatted = ',  '.join(str(result) for result in roll_data['result'])
+    groups = []
+
+    # Format each group of dice
+    for index, term_data in enumerate(roll_data['dice']):
+        if term_data['sign'] < 0:
+            groups.append('-')
+        elif index:
+            groups.append('+')
+        groups.append(f'( {format_faces(term_data)} )')
 
-    # Set singular/plural word
-    die_word = 'die' if roll.count == 1 else 'dice'
+    formatted = ' '.join(groups)
 
     # Set response
-    response = f'_{user} rolled {roll.count} {roll.sides}-sided {die_word}:_'
+    dice = expression.simple
+    if dice is not None:
+        # Set singular/plural word
+        die_word = 'die' if dice.count == 1 else 'dice'
+        response = f'_{user} rolled {dice.count} {dice.sides}-sided ' \
+                   f'{die_word}:_'
+    else:
+        response = f'_{user} rolled {expression}:_'
+
+    # Default to no modifier
+    modifier = ''
+
+    # Add modifier
+    if expression.has_modifier:
+        sign = '-' if roll_data['modifier'] < 0 else '+'
+        modifier = f"  {sign} {abs(roll_data['modifier'])}"
 
     # Default to no hit results
     hits = ''
 
     # Add hit results
-    if roll.hit is not None:
+    if expression.hit is not None:
         miss_crit = ''
         hit_crit = ''
 
@@ -270,140 +370,361 @@ def format_roll_response(roll, user, roll_data):
 
     # Return formatted response
     return f"{response}  *{roll_data['sum']}*  " \
-           f"( {formatted} ){roll_data['modifier']}{hits}"
-
-
-def roll_die(roll, roll_data):
-    """Perform a die roll and handle hits and misses"""
-    die_roll = random.randint(1, roll.sides)
-    roll_data['sum'] += die_roll
-    roll_data['result'].append(die_roll)
-
-    # Handle hits/misses
-    if roll.hit is not None:
-        # Add 1 for each regular hit/miss, 2 for critical
-        if die_roll >= roll.hit:
-            # Hits
-            if die_roll == roll.sides:
-                roll_data['hits_crit'] += 1
-            roll_data['hits'] += 1
-        else:
-            # Misses
-            if die_roll == 1:
-                roll_data['misses_crit'] += 1
-            roll_data['misses'] += 1
-
-    # Return updated roll data
-    return roll_data
-
-
-def do_roll(roll, user):
-    """Perform requested roll action."""
-    roll_data = {
-        'sum': 0,
-        'result': [],
-        'modifier': '',
-        'hits': 0,
-        'hits_crit': 0,
-        'misses': 0,
-        'misses_crit': 0
-    }
-
-    # Roll dice
-    for _ in range(0, roll.count):
-        roll_data = roll_die(roll, roll_data)
-
-    # Deal with modifier
-    if roll.modifier is not None:
-        roll_data['modifier'] = f'  {roll.modifier} {roll.modifier_count}'
-
-        if roll.modifier == '-':
-            roll_data['sum'] -= roll.modifier_count
-
-        elif roll.modifier == '+':
-            roll_data['sum'] += roll.modifier_count
+           f"{formatted}{modifier}{hits}"
+
+
+def roll_expression(dice_roll):
+    """Parse and roll an expression, returning unformatted roll data."""
+    text = dice_roll.lower()
+
+    # Help, version and odds aren't rolls
+    if text in ['help', 'version'] or text.split(' ', 1)[0] == 'odds':
+        raise RollMessage(f"'{dice_roll}' is not a valid roll format")
+
+    namespace = argparse.Namespace(command=allowed_commands[0])
+    result = roll_parser.parse_args(['--', dice_roll], namespace)
+
+    return result.expression, get_roll_data(result)
+
+
+def get_roll_data(roll):
+    """Roll a parsed roll and return its roll data."""
+    return roll.expression.evaluate(app.config['MAX_LISTED_DICE'])
+
+
+def do_roll(roll, user, args=None):
+    """Perform requested roll action.
+
+    When the command args are given the roll is added to the channel's
+    history and stats.
+    """
+    roll_data = get_roll_data(roll)
+
+    if args is not None:
+        history.record_roll(args, roll.expression, roll_data)
+        stats.record_roll(args, roll.expression, roll_data)
 
     # Format message
-    return format_roll_response(roll, user, roll_data)
+    return format_roll_response(roll.expression, user, roll_data)
+
+
+def uses_response_url(args):
+    """Check whether a roll should be posted through its response_url.
+
+    This needs a signing secret, since the request signature is all that
+    vouches for a request when the team's tokens aren't checked, and a
+    response_url that points at Slack.
+    """
+    return app.config['POST_MODE'] == 'response_url' and \
+        bool(app.config['SLACK_SIGNING_SECRET']) and \
+        interact.is_response_url(args.get('response_url')) and \
+        args.get('channel_id') not in app.config['BOT_CHANNELS']
+
+
+def check_response_url(args):
+    """Check that the command's response_url points at Slack.
+
+    Anything else is reported and must not be posted to, since an
+    unsigned request can set it to any host.
+    """
+    if interact.is_response_url(args.get('response_url')):
+        return True
+
+    report_event('response_url_rejected', {
+        'response_url': args.get('response_url'),
+        'team_id': args.get('team_id')
+    })
+    return False
+
+
+def post_response_url(roll, args):
+    """Post the roll to the channel through the command's response_url."""
+    if not check_response_url(args):
+        return
+
+    slack.get_session().post(
+        args['response_url'],
+        json=interact.get_message(
+            roll,
+            args.get('reroll'),
+            response_type='in_channel'
+        ),
+        timeout=slack.get_timeout()
+    ).raise_for_status()
+
+
+def post_roll(team, roll, args):
+    """Post the roll to Slack, raising any errors.
+
+    Without a team the roll is posted through the response_url instead
+    of as the bot.
+    """
+    if team is None:
+        post_response_url(roll, args)
+        return
+
+    chat = slack.get_api(Chat, team.get_token(True))
+    blocks = interact.get_blocks(roll, args.get('reroll'))
+
+    chat.post_message(
+        args['channel_id'],
+        roll,
+        username='Roll Bot',
+        icon_emoji=':game_die:',
+        blocks=json.dumps(blocks) if blocks else None
+    )
+
+
+def get_send_error(err):
+    """Format a user-facing message for an error posting a roll."""
+    # Check specifically for channel errors
+    if str(err) == 'channel_not_found':
+        err_msg = f'The {project_info["name"]} bot is not ' \
+                  f'authorized to post in this channel. ' \
+                  f'Please invite it to join this channel and try again.'
+        return err_msg
+
+    # Report any other errors
+    return f"{project_info['name']} encountered an error: {str(err)}"
+
+
+def is_unavailable(err):
+    """Check whether an error means Slack is down or too slow to answer."""
+    if isinstance(err, requests.HTTPError):
+        return err.response is not None and err.response.status_code >= 500
+
+    return isinstance(err, (requests.ConnectionError, requests.Timeout))
+
+
+def report_unavailable(err, args):
+    """Report that Slack couldn't be reached and return the reply."""
+    report_event('slack_unavailable', {
+        'error': str(err),
+        'team_id': args.get('team_id')
+    })
+    return unavailable_error
+
+
+def get_retry_after(err):
+    """Return the seconds Slack asked us to wait, if we were rate limited."""
+    if isinstance(err, requests.HTTPError) and \
+            err.response is not None and err.response.status_code == 429:
+        try:
+            return float(err.response.headers.get('Retry-After', 1))
+        except ValueError:
+            return 1.0
+
+    if isinstance(err, Error) and str(err) == 'ratelimited':
+        return 1.0
+
+    return None
 
 
 def send_roll(team, roll, args):
     """Post the roll to Slack."""
-    chat = Chat(team.get_token(True))
+    # Queue behind earlier rolls still waiting to be posted to the channel,
+    # so rolls aren't posted out of order after a rate limit
+    if team is not None and \
+            post_scheduler.is_pending(team, args['channel_id']):
+        if post_scheduler.submit(team, roll, args):
+            return None
+
+        report_event('delivery_queue_full', {'team_id': args.get('team_id')})
+        return busy_error
 
     try:
         # Attempt to post message
-        chat.post_message(
-            args['channel_id'],
-            roll,
-            username='Roll Bot',
-            icon_emoji=':game_die:'
-        )
+        post_roll(team, roll, args)
+
+    except (Error, requests.RequestException) as err:
+        # Queue rate limited rolls to be posted once Slack allows it
+        wait = get_retry_after(err)
+        if wait is not None and team is not None and post_scheduler.submit(
+                team, roll, args, pause=wait):
+            return None
+
+        # Turn the roll away when it can't be queued for later
+        if wait is not None:
+            report_event('delivery_queue_full', {
+                'team_id': args.get('team_id')
+            })
+            return busy_error
+
+        # Ask the team to authorize again once its tokens stop working
+        if is_auth_failure(err):
+            return report_auth_failure(err, args)
+
+        # Fail fast when Slack is down instead of showing the raw error
+        if is_unavailable(err):
+            return report_unavailable(err, args)
+
+        if team is not None and not isinstance(err, Error):
+            raise
 
-    except Error as err:
         report_event(str(err), {
-            'team': team.__dict__,
+            'team_id': args.get('team_id'),
             'roll': roll,
             'args': args
         })
-
-        # Check specifically for channel errors
-        if str(err) == 'channel_not_found':
-            err_msg = f'The {project_info["name"]} bot is not ' \
-                      f'authorized to post in this channel. ' \
-                      f'Please invite it to join this channel and try again.'
-            return err_msg
-
-        # Report any other errors
-        return f"{project_info['name']} encountered an error: {str(err)}"
+        return get_send_error(err)
 
     # Return no errors
     return None
 
 
+def send_response(args, text):
+    """Send a private reply to the user through the command's response_url."""
+    if not check_response_url(args):
+        return
+
+    try:
+        slack.get_session().post(
+            args['response_url'],
+            json={'response_type': 'ephemeral', 'text': text},
+            timeout=slack.get_timeout()
+        ).raise_for_status()
+
+    except requests.RequestException as err:
+        report_event('response_url_error', {
+            'error': str(err),
+            'team_id': args.get('team_id')
+        })
+
+
+def is_retryable(err):
+    """Check whether a failed roll post is worth trying again."""
+    if isinstance(err, Error):
+        return str(err) not in permanent_errors
+
+    # Retry network errors and Slack server errors
+    if isinstance(err, requests.HTTPError):
+        return err.response is None or err.response.status_code >= 429
+
+    return isinstance(err, requests.RequestException)
+
+
+def report_delivery_failure(err, team, roll, args):
+    """Let the user know that a queued roll could not be posted."""
+    if is_auth_failure(err):
+        send_response(args, report_auth_failure(err, args))
+        return
+
+    report_event('delivery_failed', {
+        'error': str(err),
+        'team_id': args.get('team_id'),
+        'roll': roll,
+        'args': args
+    })
+    send_response(args, get_send_error(err))
+
+
+# Background delivery of roll posts
+delivery_queue = DeliveryQueue(
+    post_roll,
+    report_delivery_failure,
+    is_retryable,
+    workers=app.config['DELIVERY_WORKERS'],
+    max_size=app.config['DELIVERY_QUEUE_SIZE'],
+    retries=app.config['DELIVERY_RETRIES'],
+    backoff=app.config['DELIVERY_BACKOFF']
+)
+
+
+# Rate limited background delivery of roll posts
+post_scheduler = PostScheduler(
+    post_roll,
+    report_delivery_failure,
+    is_retryable,
+    get_retry_after,
+    workers=app.config['SCHEDULER_WORKERS'],
+    max_size=app.config['SCHEDULER_QUEUE_SIZE'],
+    retries=app.config['DELIVERY_RETRIES'],
+    backoff=app.config['DELIVERY_BACKOFF'],
+    coalesce=app.config['SCHEDULER_COALESCE'],
+    max_length=app.config['SCHEDULER_MAX_LENGTH'],
+    team_limit=(
+        app.config['SCHEDULER_TEAM_RATE'],
+        app.config['SCHEDULER_TEAM_BURST']
+    ),
+    channel_limit=(
+        app.config['SCHEDULER_CHANNEL_RATE'],
+        app.config['SCHEDULER_CHANNEL_BURST']
+    )
+)
+
+
+def deliver_roll(team, roll, args):
+    """Post the roll to Slack using the configured delivery mode."""
+    mode = app.config['DELIVERY_MODE']
+    if mode not in ('queue', 'schedule'):
+        return send_roll(team, roll, args)
+
+    # Acknowledge now and post from the background; response_url posts
+    # don't count against the chat.postMessage limits
+    queue = post_scheduler if mode == 'schedule' and team is not None \
+        else delivery_queue
+    if queue.submit(team, roll, args):
+        return None
+
+    report_event('delivery_queue_full', {'team_id': args.get('team_id')})
+
+    # Reject the roll instead of blocking on Slack
+    if app.config['DELIVERY_OVERFLOW'] == 'reject':
+        return busy_error
+
+    # Otherwise fall back to posting inline
+    return send_roll(team, roll, args)
+
+
 def make_roll(args):
     """Run dice roll functions."""
-    global errors
-    errors = []
-
     # Make sure this is a valid slash command
     if args['command'] not in allowed_commands:
         report_event('command_not_allowed', args)
         return f'"{args["command"]}" is not an allowed command'
 
-    # Set global command value to access later
-    global command
-    command = args['command']
-
-    # Check to see if team has authenticated with the app
-    team = get_team(args)
+    # Reply through the response_url without using the team's tokens
+    team = None
 
-    # If the user, team token, and bot token are not valid, let them know
-    if (
-            not team or
-            not is_valid_token(team.get_token()) or
-            not is_valid_token(team.get_token(True))
-    ):
-        report_event('auth_error', {'args': args, 'team': team.__dict__})
-        return auth_error
+    if not uses_response_url(args):
+        # Check to see if team has authenticated with the app
+        with stage('team_lookup'):
+            team = get_team(args)
 
-    # If there's no input, use the default roll
-    dice_roll = 'd6' if not args['text'] else args['text']
+        # If the user, team token, and bot token are not valid, let them know
+        try:
+            with stage('token_check'):
+                valid = team and \
+                    is_valid_team_token(team) and \
+                    is_valid_team_token(team, True)
+        except requests.RequestException as err:
+            return report_unavailable(err, args)
+
+        if not valid:
+            report_event('auth_error', {
+                'args': args,
+                'team_id': args['team_id']
+            })
+            return auth_error
 
     # Parse args
-    parser = get_parser()
-    result = parser.parse_args([dice_roll])
-
-    # Report any errors from parser
-    if errors:
-        report_event('parser_errors', {'errors': errors})
-        return errors[0]
+    try:
+        with stage('parse'):
+            result = parse_roll(args)
+    except RollMessage as msg:
+        return str(msg)
 
     # Get requested flip
-    roll = do_roll(result, args['user_name'])
+    with stage('roll'):
+        roll = do_roll(result, args['user_name'], args)
+
+    # Let the channel roll again without typing the command
+    if interact.is_enabled():
+        args['reroll'] = interact.dump_roll(result.expression)
 
     # Post flip as user
-    err = send_roll(team, roll, args)
+    with stage('send'):
+        err = deliver_roll(team, roll, args)
 
     # If there were problems posting, report it
     if err is not None:
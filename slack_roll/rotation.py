@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import bindparam, update
+
+from . import app
+from .storage import db, iter_team_batches, Team
+
+
+# Columns holding encrypted tokens
+TOKEN_COLUMNS = ('encrypted_token', 'encrypted_bot_token')
+
+# Cipher used by each worker process
+_worker_cipher = None
+
+
+def read_checkpoint(path):
+    """Return the last team id rotated by a previous run, if any."""
+    try:
+        with open(path, encoding='utf-8') as checkpoint:
+            return checkpoint.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, team_id):
+    """Save the last rotated team id, replacing the old one atomically."""
+    temp_path = f'{path}.tmp'
+
+    with open(temp_path, 'w', encoding='utf-8') as checkpoint:
+        checkpoint.write(team_id)
+
+    os.replace(temp_path, path)
+
+
+def init_worker(keys):
+    """Set up the cipher in a worker process."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography.fernet import Fernet, MultiFernet
+
+    global _worker_cipher  # pylint: disable=global-statement
+    _worker_cipher = MultiFernet([Fernet(key.encode('utf8')) for key in keys])
+
+
+def rotate_rows(rows):
+    """Re-encrypt the tokens of (id, token, bot token) rows.
+
+    The tokens that were read are kept as old_<column>, so the update
+    can skip any team whose tokens changed in the meantime.
+    """
+    return [
+        {
+            'team_id': team_id,
+            **{
+                column: _worker_cipher.rotate(token)
+                if token is not None else None
+                for column, token in zip(TOKEN_COLUMNS, tokens)
+            },
+            **{
+                f'old_{column}': token
+                for column, token in zip(TOKEN_COLUMNS, tokens)
+            }
+        }
+        for team_id, *tokens in rows
+    ]
+
+
+def rotate_tokens(checkpoint=None, batch_size=None, workers=None,
+                  max_batches=None, progress=None):
+    """Re-encrypt every team's tokens with the newest token key.
+
+    Batches are split across a pool of worker processes, since Fernet
+    holds the GIL for most of its work, and written back
+    with one bulk UPDATE each, committed separately so no lock is held
+    for long. With a checkpoint file, the last rotated id is saved after
+    every batch and a later run continues from there. A team that was
+    re-authorized while its batch was being encrypted is left alone, since
+    its new tokens are already under the newest key. Returns the number
+    of teams rotated and the number skipped.
+    """
+    batch_size = batch_size or app.config['ROTATION_BATCH_SIZE']
+    workers = workers or app.config['ROTATION_WORKERS']
+
+    table = Team.__table__
+    statement = update(table) \
+        .where(table.c.id == bindparam('team_id')) \
+        .where(*[
+            table.c[column].is_not_distinct_from(bindparam(f'old_{column}'))
+            for column in TOKEN_COLUMNS
+        ]) \
+        .values({column: bindparam(column) for column in TOKEN_COLUMNS})
+
+    after = read_checkpoint(checkpoint) if checkpoint else None
+    rotated = 0
+    skipped = 0
+
+    pool = ProcessPoolExecutor(
+        workers,
+        initializer=init_worker,
+        initargs=(app.config['TOKEN_KEYS'],)
+    )
+
+    with app.app_context(), pool:
+        for count, rows in enumerate(
+                iter_team_batches(TOKEN_COLUMNS, batch_size, after), 1):
+            # Split the batch evenly between the workers
+            size = -(-len(rows) // workers)
+            chunks = [
+                [tuple(row) for row in rows[i:i + size]]
+                for i in range(0, len(rows), size)
+            ]
+
+            updates = [
+                update_row
+                for updated in pool.map(rotate_rows, chunks)
+                for update_row in updated
+            ]
+
+            result = db.session.execute(statement, updates)
+            db.session.commit()
+
+            # Rows that no longer hold the tokens read were not updated
+            rotated += result.rowcount
+            skipped += len(rows) - result.rowcount
+            if checkpoint:
+                write_checkpoint(checkpoint, rows[-1].id)
+            if progress is not None:
+                progress(rotated, skipped, rows[-1].id)
+
+            if max_batches and count >= max_batches:
+                return rotated, skipped
+
+    # Start from the beginning next time
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    return rotated, skipped
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+from collections import deque
+from time import monotonic
+from threading import Condition, Thread
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """Allow rate events per second on average, in bursts of up to burst."""
+
+    def __init__(self, rate, burst):
+        """Start with a full bucket."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def refill(self, now):
+        """Add the tokens earned since the last refill."""
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Return how long until a token is available."""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class PostScheduler:  # pylint: disable=too-many-instance-attributes
+    """Queue of Slack posts sent within per-team and per-channel limits.
+
+    Each channel has its own queue and is posted to by one worker at a
+    time, so rolls stay in order. A post waits for a token from both its
+    team's and its channel's bucket, and a rate-limited response pauses
+    the whole team for as long as Slack asks. Rolls that back up in a
+    channel can be sent together as a single message.
+    """
+
+    def __init__(self, post, on_failure, is_retryable, retry_after,
+                 **options):
+        """Set up the scheduler; the dispatcher starts on first use.
+
+        post(team, text, args) sends a message and raises on failure,
+        retry_after(err) returns the seconds to wait if err means the
+        post was rate limited, is_retryable(err) decides whether other
+        errors are tried again, and on_failure(err, *job) is called for
+        each job that gives up.
+        """
+        self.post = post
+        self.on_failure = on_failure
+        self.is_retryable = is_retryable
+        self.retry_after = retry_after
+        self.max_size = options.get('max_size', 1000)
+        self.retries = options.get('retries', 3)
+        self.backoff = options.get('backoff', 0.5)
+        self.coalesce = options.get('coalesce', True)
+        self.max_length = options.get('max_length', 3000)
+        self.team_limit = options.get('team_limit', (5.0, 20))
+        self.channel_limit = options.get('channel_limit', (1.0, 3))
+        self.workers = options.get('workers', 4)
+        self.counts = dict.fromkeys(
+            ('sent', 'coalesced', 'rate_limited', 'retried', 'failed'), 0)
+        self._queues = {}
+        self._buckets = {}
+        self._paused = {}
+        self._attempts = {}
+        self._in_flight = set()
+        self._size = 0
+        self._changed = Condition()
+        self._pool = None
+
+    def _bucket(self, key, limit):
+        """Return the token bucket for a team or channel key."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit)
+        return bucket
+
+    def _start(self):
+        """Start the dispatcher and workers. Requires the condition lock."""
+        self._pool = ThreadPoolExecutor(self.workers)
+
+        dispatcher = Thread(target=self._dispatch)
+        dispatcher.daemon = True
+        dispatcher.start()
+
+    def _take(self, key, now):
+        """Return the jobs to send for a channel, or how long to wait.
+
+        Requires the condition lock.
+        """
+        team_id = key[0]
+        team = self._bucket(team_id, self.team_limit)
+        channel = self._bucket(key, self.channel_limit)
+
+        wait = max(
+            self._paused.get(team_id, 0) - now,
+            self._paused.get(key, 0) - now,
+            team.delay(now),
+            channel.delay(now)
+        )
+        if wait > 0:
+            return None, wait
+
+        team.tokens -= 1
+        channel.tokens -= 1
+
+        # Send one roll, or as many waiting rolls as fit in one message
+        queue = self._queues[key]
+        jobs = [queue.popleft()]
+        length = len(jobs[0][1])
+
+        while self.coalesce and queue and \
+                length + len(queue[0][1]) + 1 <= self.max_length:
+            length += len(queue[0][1]) + 1
+            jobs.append(queue.popleft())
+
+        return jobs, 0
+
+    def _dispatch(self):
+        """Hand channels to the workers as their limits allow."""
+        swept = monotonic()
+
+        while True:
+            ready = []
+
+            with self._changed:
+                now = monotonic()
+                wait = None
+
+                # Forget idle channels and teams once a minute
+                if now - swept > 60:
+                    self._sweep(now)
+                    swept = now
+
+                for key, queue in self._queues.items():
+                    if not queue or key in self._in_flight:
+                        continue
+
+                    jobs, delay = self._take(key, now)
+                    if jobs is None:
+                        wait = delay if wait is None else min(wait, delay)
+                        continue
+
+                    self._in_flight.add(key)
+                    ready.append((key, jobs))
+
+                if not ready:
+                    self._changed.wait(wait)
+                    continue
+
+            for key, jobs in ready:
+                self._pool.submit(self._send, key, jobs)
+
+    def _send(self, key, jobs):
+        """Post a batch of jobs for one channel and handle the result."""
+        team, _, args = jobs[0]
+        failed = None
+
+        try:
+            self.post(team, '\n'.join(job[1] for job in jobs), args)
+        except Exception as err:  # pylint: disable=broad-except
+            failed = err
+
+        with self._changed:
+            self._in_flight.discard(key)
+            gave_up = self._finish(key, jobs, failed)
+            self._changed.notify_all()
+
+        # Report failures outside the lock
+        if gave_up:
+            for job in jobs:
+                self.on_failure(failed, *job)
+
+    def _finish(self, key, jobs, err):
+        """Update counters and queues after a post. Requires the lock.
+
+        Returns True if the jobs failed and won't be tried again.
+        """
+        now = monotonic()
+
+        if err is None:
+            self._size -= len(jobs)
+            self._attempts.pop(key, None)
+            self.counts['sent'] += 1
+            self.counts['coalesced'] += len(jobs) - 1
+            self._forget(key)
+            return False
+
+        wait = self.retry_after(err)
+        attempts = self._attempts.get(key, 0)
+
+        if wait is not None:
+            # Pause the team and keep the rolls queued
+            self.counts['rate_limited'] += 1
+            self._paused[key[0]] = max(
+                self._paused.get(key[0], 0), now + wait)
+
+        elif attempts < self.retries and self.is_retryable(err):
+            # Back off this channel before trying again
+            self.counts['retried'] += 1
+            self._attempts[key] = attempts + 1
+            self._paused[key] = now + self.backoff * 2 ** attempts
+
+        else:
+            self._size -= len(jobs)
+            self._attempts.pop(key, None)
+            self.counts['failed'] += len(jobs)
+            self._forget(key)
+            return True
+
+        self._queues[key].extendleft(reversed(jobs))
+        return False
+
+    def _forget(self, key):
+        """Drop a channel's queue once empty. Requires the lock."""
+        if not self._queues.get(key):
+            self._queues.pop(key, None)
+
+    def _sweep(self, now):
+        """Drop idle buckets and past pauses. Requires the lock."""
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst and key not in self._queues:
+                del self._buckets[key]
+
+        for key, until in list(self._paused.items()):
+            if until <= now:
+                del self._paused[key]
+
+    def submit(self, *job, pause=None):
+        """Queue a (team, text, args) job. Returns False if full.
+
+        pause is the number of seconds Slack asked to wait, if the job
+        has already been rate limited.
+        """
+        team, _, args = job
+        key = (team.id, args['channel_id'])
+
+        with self._changed:
+            if self._size >= self.max_size:
+                return False
+
+            if pause is not None:
+                self.counts['rate_limited'] += 1
+                self._paused[team.id] = max(
+                    self._paused.get(team.id, 0), monotonic() + pause)
+
+            if self._pool is None:
+                self._start()
+
+            self._queues.setdefault(key, deque()).append(job)
+            self._size += 1
+            self._changed.notify_all()
+
+        return True
+
+    def is_pending(self, team, channel_id):
+        """Check whether a channel has rolls queued or being posted."""
+        with self._changed:
+            return (team.id, channel_id) in self._queues
+
+    def join(self, timeout=None):
+        """Wait until every queued post has been sent or given up."""
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: not self._size, timeout=timeout)
+
+    def stats(self):
+        """Return post counters and the number of queued rolls."""
+        with self._changed:
+            return {**self.counts, 'queued': self._size}
+
+    def __len__(self):
+        """Return the number of rolls waiting to be posted."""
+        return self._size
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import os
+from time import monotonic
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import g, has_request_context
+
+from . import app
+from .resilience import CircuitBreaker
+
+
+# Base URL that slacker sends every API call to
+SLACK_API_URL = 'https://slack.com/api/'
+
+# Process-wide session, created on first use
+_session = None
+_session_lock = Lock()
+
+# Shared by every call to Slack from this process
+breaker = CircuitBreaker(
+    app.config['SLACK_BREAKER_THRESHOLD'],
+    app.config['SLACK_BREAKER_RESET']
+)
+
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised when a request has no time left for another Slack call."""
+
+
+class CircuitOpen(requests.ConnectionError):
+    """Raised instead of calling Slack while the circuit breaker is open."""
+
+
+class SlackSession(requests.Session):
+    """Keep-alive session that can point Slack API calls at another host."""
+
+    def __init__(self, api_url=SLACK_API_URL, pool_size=10):
+        """Set up a connection pool for the Slack API and response URLs."""
+        super().__init__()
+        self.api_url = api_url
+
+        # Mount a pool big enough for every worker thread
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        """Send a request, rewriting Slack API URLs if configured."""
+        if self.api_url != SLACK_API_URL and url.startswith(SLACK_API_URL):
+            url = self.api_url + url[len(SLACK_API_URL):]
+
+        # Fail fast while Slack is known to be down
+        if not breaker.allow():
+            raise CircuitOpen('Slack is not responding')
+
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.record_failure()
+            raise
+
+        # Rate limits and API errors still mean Slack is up
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        return response
+
+
+def set_deadline(budget):
+    """Give Slack calls made by the current request budget seconds."""
+    g.slack_deadline = monotonic() + budget
+
+
+def get_time_left():
+    """Return the seconds left before the request deadline, or None."""
+    if not has_request_context() or 'slack_deadline' not in g:
+        return None
+    return g.slack_deadline - monotonic()
+
+
+def get_timeout():
+    """Return the (connect, read) timeout for Slack calls.
+
+    Inside a request with a deadline the timeouts are cut down so that
+    connecting and reading together fit in the time left, and
+    DeadlineExceeded is raised if it has already passed.
+    """
+    connect = app.config['SLACK_CONNECT_TIMEOUT']
+    read = app.config['SLACK_READ_TIMEOUT']
+
+    time_left = get_time_left()
+    if time_left is None:
+        return connect, read
+
+    if time_left <= 0:
+        raise DeadlineExceeded('No time left to call Slack')
+
+    connect = min(connect, time_left / 2)
+    return connect, min(read, time_left - connect)
+
+
+def get_session():
+    """Return the shared Slack session, creating it if needed."""
+    global _session  # pylint: disable=global-statement
+
+    with _session_lock:
+        if _session is None:
+            _session = SlackSession(
+                api_url=app.config['SLACK_API_URL'],
+                pool_size=app.config['SLACK_POOL_SIZE']
+            )
+
+    return _session
+
+
+def reset_session():
+    """Discard the shared session, such as after forking a worker."""
+    global _session  # pylint: disable=global-statement
+    _session = None
+
+
+def get_api(api_class, token=None):
+    """Create a slacker API object that uses the shared session."""
+    return api_class(token, timeout=get_timeout(), session=get_session())
+
+
+# Don't share pooled sockets with forked worker processes
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_session)
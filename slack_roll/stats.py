@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import atexit
+import math
+from threading import Event, Lock, Thread
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import app
+from .odds import sum_moments
+from .storage import db, RollStats
+
+
+# Fields copied between running stats and their database rows
+FIELDS = (
+    'rolls',
+    'scored',
+    'total_mean',
+    'total_m2',
+    'expected_mean',
+    'luck_mean',
+    'luck_m2',
+    'crit_dice',
+    'hits_crit',
+    'misses_crit'
+)
+
+
+def combine(count, mean, m2, other_count, other_mean, other_m2):
+    """Combine two sets of mean and squared deviations (Chan et al.)."""
+    total = count + other_count
+    if not other_count:
+        return mean, m2
+
+    delta = other_mean - mean
+    mean += delta * other_count / total
+    m2 += other_m2 + delta ** 2 * count * other_count / total
+
+    return mean, m2
+
+
+class RunningStats:  # pylint: disable=too-many-instance-attributes
+    """Roll aggregates that can be updated one roll at a time.
+
+    Totals and luck use Welford's algorithm, so the mean and variance
+    are kept exactly without storing individual rolls. Only plain rolls
+    are scored, since their expected sum is known exactly. Luck is the
+    number of standard deviations a total lands above its expected sum.
+    """
+
+    def __init__(self, user_name=None):
+        """Start with no rolls."""
+        self.user_name = user_name
+        for field in FIELDS:
+            setattr(self, field, 0)
+
+    @classmethod
+    def from_row(cls, row):
+        """Load running stats from a RollStats row."""
+        stats = cls(row.user_name)
+        for field in FIELDS:
+            setattr(stats, field, getattr(row, field) or 0)
+        return stats
+
+    def to_row(self, row):
+        """Copy running stats onto a RollStats row."""
+        if self.user_name:
+            row.user_name = self.user_name
+        for field in FIELDS:
+            setattr(row, field, getattr(self, field))
+
+    def add(self, total, expected=None, crits=None):
+        """Count one roll.
+
+        expected is the (mean, standard deviation) of the sum, if known,
+        and crits is the (dice, critical hits, critical misses) of rolls
+        made with a hit target.
+        """
+        self.rolls += 1
+
+        if expected is not None:
+            mean, deviation = expected
+            luck = (total - mean) / deviation if deviation else 0.0
+            self.scored += 1
+
+            # Welford's update for the totals and luck
+            delta = total - self.total_mean
+            self.total_mean += delta / self.scored
+            self.total_m2 += delta * (total - self.total_mean)
+
+            self.expected_mean += (mean - self.expected_mean) / self.scored
+
+            delta = luck - self.luck_mean
+            self.luck_mean += delta / self.scored
+            self.luck_m2 += delta * (luck - self.luck_mean)
+
+        if crits is not None:
+            self.crit_dice += crits[0]
+            self.hits_crit += crits[1]
+            self.misses_crit += crits[2]
+
+    def merge(self, other):
+        """Add another set of running stats into this one."""
+        self.total_mean, self.total_m2 = combine(
+            self.scored, self.total_mean, self.total_m2,
+            other.scored, other.total_mean, other.total_m2
+        )
+        self.luck_mean, self.luck_m2 = combine(
+            self.scored, self.luck_mean, self.luck_m2,
+            other.scored, other.luck_mean, other.luck_m2
+        )
+        self.expected_mean, _ = combine(
+            self.scored, self.expected_mean, 0,
+            other.scored, other.expected_mean, 0
+        )
+
+        for field in ('rolls', 'scored', 'crit_dice', 'hits_crit',
+                      'misses_crit'):
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+        self.user_name = other.user_name or self.user_name
+
+    @property
+    def total_deviation(self):
+        """Return the standard deviation of scored totals."""
+        if self.scored < 2:
+            return 0.0
+        return math.sqrt(self.total_m2 / (self.scored - 1))
+
+    @property
+    def crit_rates(self):
+        """Return the critical hit and miss rates per die."""
+        if not self.crit_dice:
+            return None
+        return (self.hits_crit / self.crit_dice,
+                self.misses_crit / self.crit_dice)
+
+
+class StatsAggregator:
+    """Keep running stats in memory and merge them into the database.
+
+    Rolls only touch the in-memory deltas; a background thread merges
+    them into their RollStats rows every interval seconds.
+    """
+
+    def __init__(self, interval=10.0):
+        """Set up empty deltas; the flusher starts on first roll."""
+        self.interval = interval
+        self.failed = 0
+        self._pending = {}
+        self._lock = Lock()
+        self._closed = Event()
+        self._thread = None
+
+    def _start(self):
+        """Start the flusher thread. Requires the lock."""
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        # Save anything left over when the process exits
+        atexit.register(self.close)
+
+    def _run(self):
+        """Flush the deltas every interval until closed."""
+        while not self._closed.wait(self.interval):
+            self.flush()
+
+    def add(self, keys, user_name, *sample):
+        """Count one roll against each of the given stats keys."""
+        with self._lock:
+            if self._thread is None and not self._closed.is_set():
+                self._start()
+
+            for key in keys:
+                stats = self._pending.get(key)
+                if stats is None:
+                    stats = self._pending[key] = RunningStats()
+
+                # Only per-user rows carry a name
+                if key[2]:
+                    stats.user_name = user_name
+
+                stats.add(*sample)
+
+    def flush(self):
+        """Merge the pending deltas into their database rows."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return
+
+        with app.app_context():
+            try:
+                for key, delta in pending.items():
+                    row = db.session.get(RollStats, key, with_for_update=True)
+
+                    if row is None:
+                        row = RollStats(
+                            team_id=key[0],
+                            channel_id=key[1],
+                            user_id=key[2]
+                        )
+                        db.session.add(row)
+                        stats = RunningStats()
+                    else:
+                        stats = RunningStats.from_row(row)
+
+                    stats.merge(delta)
+                    stats.to_row(row)
+
+                db.session.commit()
+
+            except SQLAlchemyError:
+                db.session.rollback()
+                self.failed += 1
+
+                # Put the deltas back to try again next time
+                with self._lock:
+                    for key, delta in pending.items():
+                        if key in self._pending:
+                            delta.merge(self._pending[key])
+                        self._pending[key] = delta
+
+    def close(self):
+        """Stop the flusher thread and save any remaining deltas."""
+        self._closed.set()
+        self.flush()
+
+    def __len__(self):
+        """Return the number of stats rows waiting to be saved."""
+        return len(self._pending)
+
+
+# Running stats waiting to be saved
+stats_aggregator = StatsAggregator(app.config['STATS_FLUSH_INTERVAL'])
+
+
+def record_roll(args, expression, roll_data):
+    """Count a roll in the channel's and user's running stats."""
+    team_id = args.get('team_id')
+    channel_id = args.get('channel_id')
+    user_id = args.get('user_id') or args.get('user_name')
+
+    if not team_id or not channel_id or not user_id:
+        return
+
+    # Score plain rolls against their exact expected sum
+    expected = None
+    if all(dice.plain for dice in expression.dice):
+        expected = sum_moments(expression)
+
+    # Count critical results for rolls with a hit target
+    crits = None
+    if expression.hit is not None:
+        crits = (
+            sum(sum(term['faces']) for term in roll_data['dice']),
+            roll_data['hits_crit'],
+            roll_data['misses_crit']
+        )
+
+    stats_aggregator.add(
+        ((team_id, channel_id, ''), (team_id, channel_id, user_id)),
+        args.get('user_name'),
+        roll_data['sum'],
+        expected,
+        crits
+    )
+
+
+def load_stats(team_id, channel_id, user_id):
+    """Return the channel's, the user's and the luckiest user's stats."""
+    with app.app_context():
+        channel = db.session.get(RollStats, (team_id, channel_id, ''))
+        user = db.session.get(RollStats, (team_id, channel_id, user_id))
+
+        # Only users with enough scored rolls can be the luckiest
+        luckiest = RollStats.query.filter(
+            RollStats.team_id == team_id,
+            RollStats.channel_id == channel_id,
+            RollStats.user_id != '',
+            RollStats.scored >= app.config['STATS_MIN_ROLLS']
+        ).order_by(RollStats.luck_mean.desc()).first()
+
+        return [
+            RunningStats.from_row(row) if row is not None else None
+            for row in (channel, user, luckiest)
+        ]
+
+
+def format_stats(stats):
+    """Format the counts, averages and critical rates of running stats."""
+    text = f'*{stats.rolls}* roll{"" if stats.rolls == 1 else "s"}'
+
+    if stats.scored:
+        text += f', averaging *{stats.total_mean:.2f}* against an ' \
+                f'expected *{stats.expected_mean:.2f}* ' \
+                f'(luck {stats.luck_mean:+.2f} std devs)'
+
+    rates = stats.crit_rates
+    if rates is not None:
+        text += f', critical hits on *{rates[0] * 100:.1f}%* and ' \
+                f'critical misses on *{rates[1] * 100:.1f}%* of dice'
+
+    return text
+
+
+def get_stats(team_id, channel_id, user_id):
+    """Return the stats message for a channel and user."""
+    # Include rolls still waiting in this process's deltas
+    stats_aggregator.flush()
+
+    channel, user, luckiest = load_stats(team_id, channel_id, user_id)
+
+    if channel is None:
+        return 'No rolls have been recorded in this channel yet'
+
+    lines = [f'*This channel:* {format_stats(channel)}']
+
+    if user is not None:
+        lines.append(f'*You:* {format_stats(user)}')
+
+    if luckiest is not None:
+        lines.append(
+            f'*Luckiest roller:* {luckiest.user_name} '
+            f'({luckiest.luck_mean:+.2f} std devs over '
+            f'{luckiest.scored} rolls)'
+        )
+
+    return '\n'.join(lines)
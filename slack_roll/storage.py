@@ -19,27 +19,57 @@ included in all copies or substantial portions of the Software.
 import os
 from datetime import datetime
 
-from cryptography.fernet import Fernet
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import bindparam, inspect, select, text, update
 
 from . import app
+from .cache import TTLCache
+from .metrics import stage
 
 
 # Create database
 db = SQLAlchemy(app)
 
+# Cache of team records with decrypted tokens, keyed by team_id
+team_cache = TTLCache(
+    app.config['TEAM_CACHE_TTL'],
+    max_size=app.config['TEAM_CACHE_SIZE']
+)
+
+# Token cipher, created on first use
+_cipher = None
+
+
+def get_cipher():
+    """Return the token cipher, creating it on first use.
+
+    Tokens are encrypted with the first of the TOKEN_KEYS and can be
+    decrypted with any of them, so old keys keep working while rows are
+    rotated to a new one.
+    """
+    global _cipher  # pylint: disable=global-statement
+
+    if _cipher is None:
+        # pylint: disable=import-outside-toplevel
+        from cryptography.fernet import Fernet, MultiFernet
+        _cipher = MultiFernet([
+            Fernet(key.encode('utf8')) for key in app.config['TOKEN_KEYS']
+        ])
+
+    return _cipher
+
 
 class Team(db.Model):
     """Table for storing api tokens."""
     __tablename__ = 'roll_teams'
-    __cipher = Fernet(os.environ.get('TOKEN_KEY', '').encode('utf8'))
 
     id = db.Column(db.String(16), primary_key=True)
     encrypted_token = db.Column(db.BLOB)
     bot_id = db.Column(db.String(16))
     encrypted_bot_token = db.Column(db.BLOB)
     added = db.Column(db.DateTime, default=datetime.now)
+    last_validated_at = db.Column(db.DateTime)
+    token_status = db.Column(db.String(32))
 
     def __init__(self, team_id, token, bot_id, bot_token):
         """Initialize new Team in db."""
@@ -59,11 +89,15 @@ class Team(db.Model):
             token = token.encode('utf-8')
         setattr(self,
                 self.__token_column(is_bot),
-                self.__cipher.encrypt(token))
+                get_cipher().encrypt(token))
+
+        # The new token hasn't been checked yet
+        self.token_status = None
+        self.last_validated_at = None
 
     def get_token(self, is_bot=False):
         """Retrieve decrypted token."""
-        return self.__cipher\
+        return get_cipher()\
             .decrypt(getattr(self, self.__token_column(is_bot)))\
             .decode('utf-8')
 
@@ -72,10 +106,215 @@ class Team(db.Model):
         return f'<Team id={self.id} bot_id={self.bot_id}>'
 
 
-try:
-    # Attempt to initialize database
+class RollHistory(db.Model):
+    """Table for storing the rolls made in each channel."""
+    __tablename__ = 'roll_history'
+    __table_args__ = (
+        db.Index(
+            'ix_roll_history_channel',
+            'team_id', 'channel_id', 'created', 'id'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = db.Column(db.String(16), nullable=False)
+    channel_id = db.Column(db.String(32), nullable=False)
+    user_id = db.Column(db.String(32))
+    user_name = db.Column(db.String(255))
+    expression = db.Column(db.String(255))
+    faces = db.Column(db.Text)
+    total = db.Column(db.Integer)
+    created = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        """Friendly representation of RollHistory for debugging."""
+        return f'<RollHistory id={self.id} team_id={self.team_id} ' \
+               f'channel_id={self.channel_id}>'
+
+
+class RollStats(db.Model):
+    """Table for storing running roll aggregates.
+
+    There is one row per user in each channel, plus one row for the
+    whole channel with an empty user_id.
+    """
+    __tablename__ = 'roll_stats'
+
+    team_id = db.Column(db.String(16), primary_key=True)
+    channel_id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.String(32), primary_key=True)
+    user_name = db.Column(db.String(255))
+    rolls = db.Column(db.Integer, default=0, nullable=False)
+    scored = db.Column(db.Integer, default=0, nullable=False)
+    total_mean = db.Column(db.Float, default=0.0, nullable=False)
+    total_m2 = db.Column(db.Float, default=0.0, nullable=False)
+    expected_mean = db.Column(db.Float, default=0.0, nullable=False)
+    luck_mean = db.Column(db.Float, default=0.0, nullable=False)
+    luck_m2 = db.Column(db.Float, default=0.0, nullable=False)
+    crit_dice = db.Column(db.Integer, default=0, nullable=False)
+    hits_crit = db.Column(db.Integer, default=0, nullable=False)
+    misses_crit = db.Column(db.Integer, default=0, nullable=False)
+    updated = db.Column(db.DateTime, default=datetime.now,
+                        onupdate=datetime.now)
+
+    def __repr__(self):
+        """Friendly representation of RollStats for debugging."""
+        return f'<RollStats team_id={self.team_id} ' \
+               f'channel_id={self.channel_id} user_id={self.user_id}>'
+
+
+class CachedTeam:
+    """Detached snapshot of a Team with its tokens already decrypted."""
+
+    def __init__(self, team):
+        """Copy the fields used by the roll path from a Team or a row."""
+        self.id = team.id
+        self.bot_id = team.bot_id
+        self.token_status = team.token_status
+        self.last_validated_at = team.last_validated_at
+
+        with stage('token_decrypt'):
+            cipher = get_cipher()
+            self.__tokens = (
+                cipher.decrypt(team.encrypted_token).decode('utf-8'),
+                cipher.decrypt(team.encrypted_bot_token).decode('utf-8')
+            )
+
+    def get_token(self, is_bot=False):
+        """Retrieve decrypted token."""
+        return self.__tokens[is_bot]
+
+    def __repr__(self):
+        """Friendly representation of CachedTeam for debugging."""
+        return f'<CachedTeam id={self.id} bot_id={self.bot_id}>'
+
+
+# Columns the roll path needs from a team, selected without the ORM
+_team_table = Team.__table__
+team_query = select(
+    _team_table.c.id,
+    _team_table.c.bot_id,
+    _team_table.c.encrypted_token,
+    _team_table.c.encrypted_bot_token,
+    _team_table.c.token_status,
+    _team_table.c.last_validated_at
+).where(_team_table.c.id == bindparam('team_id'))
+
+
+def load_team(team_id):
+    """Read a team straight from the database, or None if it's missing.
+
+    This runs the prebuilt team_query on a pooled connection, skipping
+    the session and identity map. The statement is the same object on
+    every call, so SQLAlchemy compiles it once and reuses it.
+    """
+    with stage('team_query'):
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                team_query, {'team_id': team_id}).first()
+
+    return CachedTeam(row) if row is not None else None
+
+
+def get_team(team_id):
+    """Return a cached snapshot of a team, or None if it doesn't exist."""
+    # Don't cache missing teams, they may be about to authorize
+    return team_cache.get_or_set(
+        team_id,
+        lambda: load_team(team_id),
+        lambda team: app.config['TEAM_CACHE_TTL'] if team else 0
+    )
+
+
+def clear_token_status(team_id):
+    """Forget the token sweeper's last result for a team."""
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(
+            update(_team_table)
+            .where(_team_table.c.id == team_id)
+            .values(token_status=None, last_validated_at=None)
+        )
+
+
+def iter_team_batches(columns, batch_size, after=None, where=None):
+    """Yield batches of team rows in id order, starting after an id.
+
+    Each row holds the team id and the named columns. Each batch is a
+    separate keyset query, so only one batch of rows is held in memory
+    at a time.
+    """
+    table = Team.__table__
+    query = select(table.c.id, *[table.c[column] for column in columns])
+    if where is not None:
+        query = query.where(where)
+
+    while True:
+        batch_query = query.order_by(table.c.id).limit(batch_size)
+        if after is not None:
+            batch_query = batch_query.where(table.c.id > after)
+
+        rows = db.session.execute(batch_query).all()
+        if not rows:
+            return
+
+        # End the read transaction before the rows are processed
+        db.session.commit()
+
+        yield rows
+        after = rows[-1].id
+
+
+def add_missing_columns():
+    """Add columns that were added to the models after a table was made.
+
+    New columns are all nullable without server defaults, which every
+    database can add with a plain ALTER TABLE. Returns the names of the
+    columns added.
+    """
+    added = []
+
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {
+                column['name'] for column in inspector.get_columns(table.name)
+            }
+
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} '
+                    f'ADD COLUMN {column.name} {column_type}'
+                ))
+                added.append(f'{table.name}.{column.name}')
+
+    return added
+
+
+def create_tables():
+    """Create any missing tables and columns.
+
+    Returns the names of the columns added to existing tables.
+    """
     with app.app_context():
         db.create_all()
-except SQLAlchemyError:
-    # Otherwise, refresh the session
-    db.session.rollback()
+        return add_missing_columns()
+
+
+def dispose_engines():
+    """Drop pooled connections inherited from the parent process."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+# Don't share pooled connections with forked worker processes
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=dispose_engines)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+from datetime import datetime, timedelta
+from functools import partial
+from threading import Lock
+from time import monotonic, sleep
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from slacker import Auth, Error
+from sqlalchemy import bindparam, or_, update
+
+from . import app, report_event, slack
+from .roll import get_retry_after
+from .scheduler import TokenBucket
+from .storage import db, get_cipher, iter_team_batches, Team
+
+
+# Status of a team whose tokens both passed auth.test
+TOKEN_OK = 'ok'
+
+# Status of a check that couldn't reach Slack; these aren't saved
+TOKEN_UNREACHABLE = 'unreachable'
+
+# Status of a team with no token stored
+TOKEN_MISSING = 'missing'
+
+# Status of a team whose tokens can't be decrypted with any token key
+TOKEN_UNDECRYPTABLE = 'undecryptable'
+
+# Columns holding encrypted tokens, user token first
+TOKEN_COLUMNS = ('encrypted_token', 'encrypted_bot_token')
+
+# Times to try a token again after being rate limited
+MAX_RETRIES = 3
+
+
+class RateLimiter:
+    """Thread-safe pacing of calls, which can be paused when Slack asks."""
+
+    def __init__(self, rate):
+        """Allow rate calls per second, in bursts of up to a second's worth."""
+        self._bucket = TokenBucket(rate, max(1, int(rate)))
+        self._paused_until = 0.0
+        self._lock = Lock()
+
+    def wait(self):
+        """Block until a call is allowed."""
+        while True:
+            with self._lock:
+                now = monotonic()
+                delay = max(
+                    self._paused_until - now, self._bucket.delay(now))
+
+                if delay <= 0:
+                    self._bucket.tokens -= 1
+                    return
+
+            sleep(delay)
+
+    def pause(self, seconds):
+        """Hold back every call for a number of seconds."""
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, monotonic() + seconds)
+
+
+def check_token(token, limiter):
+    """Return 'ok', the Slack error for a bad token, or 'unreachable'."""
+    for _ in range(MAX_RETRIES + 1):
+        limiter.wait()
+
+        try:
+            result = slack.get_api(Auth, token).test()
+
+        except (Error, requests.RequestException) as err:
+            # Slow everyone down for as long as Slack asks
+            wait = get_retry_after(err)
+            if wait is not None:
+                limiter.pause(wait)
+                continue
+
+            return str(err) if isinstance(err, Error) else TOKEN_UNREACHABLE
+
+        return TOKEN_OK if result.successful else 'invalid'
+
+    return TOKEN_UNREACHABLE
+
+
+def check_team(row, limiter):
+    """Check both of a team's tokens and return its new status."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography.fernet import InvalidToken
+
+    team_id, *tokens = row
+    status = TOKEN_OK
+
+    for encrypted in tokens:
+        if encrypted is None:
+            status = TOKEN_MISSING
+            break
+
+        try:
+            token = get_cipher().decrypt(encrypted).decode('utf-8')
+        except InvalidToken:
+            status = TOKEN_UNDECRYPTABLE
+            break
+
+        status = check_token(token, limiter)
+        if status != TOKEN_OK:
+            break
+
+    # Keep the tokens that were checked, to skip teams that changed since
+    return {
+        'team_id': team_id,
+        'token_status': status,
+        'last_validated_at': datetime.now(),
+        **{
+            f'old_{column}': encrypted
+            for column, encrypted in zip(TOKEN_COLUMNS, tokens)
+        }
+    }
+
+
+def sweep_tokens(batch_size=None, workers=None, rate=None, stale_after=0,
+                 progress=None):
+    """Check every team's tokens and record the results on the team.
+
+    Teams are read in batches and checked by a bounded pool of threads,
+    with auth.test calls paced to rate per second and paused whenever
+    Slack rate limits us. Only teams not validated in the last
+    stale_after seconds are checked. Checks that couldn't reach Slack
+    leave the team's status as it was, as does a team re-authorized while
+    its check was running. Returns a count of each status.
+    """
+    batch_size = batch_size or app.config['SWEEP_BATCH_SIZE']
+    workers = workers or app.config['SWEEP_WORKERS']
+    limiter = RateLimiter(rate or app.config['SWEEP_RATE'])
+
+    table = Team.__table__
+    statement = update(table) \
+        .where(table.c.id == bindparam('team_id')) \
+        .where(*[
+            table.c[column].is_not_distinct_from(bindparam(f'old_{column}'))
+            for column in TOKEN_COLUMNS
+        ]) \
+        .values(
+            token_status=bindparam('token_status'),
+            last_validated_at=bindparam('last_validated_at')
+        )
+
+    # Skip teams that were validated recently
+    where = None
+    if stale_after:
+        cutoff = datetime.now() - timedelta(seconds=stale_after)
+        where = or_(
+            table.c.last_validated_at.is_(None),
+            table.c.last_validated_at < cutoff
+        )
+
+    counts = Counter()
+
+    with app.app_context(), ThreadPoolExecutor(workers) as pool:
+        for rows in iter_team_batches(TOKEN_COLUMNS, batch_size, where=where):
+            results = list(pool.map(partial(check_team, limiter=limiter),
+                                    [tuple(row) for row in rows]))
+
+            updates = [
+                result for result in results
+                if result['token_status'] != TOKEN_UNREACHABLE
+            ]
+            if updates:
+                result = db.session.execute(statement, updates)
+                db.session.commit()
+
+                # Rows whose tokens changed during the check keep their status
+                if result.rowcount < len(updates):
+                    report_event('token_sweep_skipped', {
+                        'count': len(updates) - result.rowcount
+                    })
+
+            # Report teams that can no longer use the app
+            for result in updates:
+                if result['token_status'] != TOKEN_OK:
+                    report_event('token_invalid', {
+                        'team_id': result['team_id'],
+                        'status': result['token_status']
+                    })
+
+            counts.update(result['token_status'] for result in results)
+            if progress is not None:
+                progress(counts, rows[-1].id)
+
+    return counts
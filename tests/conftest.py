@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+# Shared setup for the test suite: the app is pointed at a temporary
+# SQLite database and a fake Slack API server before it is imported,
+# since it reads its settings at import time.
+#
+# Usage: pytest
+
+import os
+import tempfile
+
+import pytest
+from cryptography.fernet import Fernet
+
+from benchmarks.fake_slack import FakeSlack
+
+
+# One fake Slack server for the whole run
+fake_slack = FakeSlack().start()
+
+# Settings the app reads when it's imported
+workdir = tempfile.mkdtemp()
+os.environ.update({
+    'SLACK_API_URL': fake_slack.api_url,
+    'SLACK_RESPONSE_URL_PREFIX': fake_slack.url,
+    'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'roll.db')}",
+    'TOKEN_KEY': Fernet.generate_key().decode(),
+    'SECURE_KEY_STR': 'test',
+    'SLACK_CLIENT_ID': 'test',
+    'SLACK_CLIENT_SECRET': 'test',
+    'EVENT_SINK': 'file',
+    'EVENT_LOG_PATH': os.path.join(workdir, 'events.jsonl')
+})
+
+# pylint: disable=wrong-import-position
+from slack_roll import roll, slack, storage
+from slack_roll.storage import create_tables, db, Team
+from slack_roll.app import app as flask_app
+
+
+create_tables()
+
+
+@pytest.fixture
+def app():
+    """Return the Flask app, with every in-process cache emptied."""
+    roll.token_cache.clear()
+    storage.team_cache.clear()
+    slack.breaker.record_success()
+
+    return flask_app
+
+
+@pytest.fixture
+def fake():
+    """Return the fake Slack server, with no calls or overrides."""
+    fake_slack.latency = 0.0
+    fake_slack.overrides.clear()
+    fake_slack.calls.clear()
+    fake_slack.connections = 0
+
+    yield fake_slack
+
+    fake_slack.latency = 0.0
+    fake_slack.overrides.clear()
+
+
+@pytest.fixture
+def team_ids(app):
+    """Replace the stored teams with a few freshly authorized ones."""
+    ids = [f'T{index:08d}' for index in range(3)]
+
+    with app.app_context():
+        Team.query.delete()
+        for team_id in ids:
+            db.session.add(Team(team_id, 'xoxp-fake', 'B0', 'xoxb-fake'))
+        db.session.commit()
+
+    return ids
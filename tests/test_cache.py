@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+from time import sleep
+from threading import Barrier, Event, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from slack_roll import roll, storage
+from slack_roll.cache import TTLCache
+
+
+def call_together(func, count=20):
+    """Call func from count threads released at the same moment."""
+    barrier = Barrier(count)
+
+    def call(_):
+        # Start every call at once so they overlap
+        barrier.wait()
+        return func()
+
+    with ThreadPoolExecutor(count) as pool:
+        return list(pool.map(call, range(count)))
+
+
+def test_get_or_set_computes_once_for_concurrent_callers():
+    """Callers waiting on the same missing key share a single call."""
+    cache = TTLCache(60)
+    calls = []
+    lock = Lock()
+
+    def compute():
+        with lock:
+            calls.append(None)
+        sleep(0.05)
+        return 'value'
+
+    results = call_together(lambda: cache.get_or_set('key', compute))
+
+    assert results == ['value'] * 20
+    assert len(calls) == 1
+    assert cache.stats() == {'size': 1, 'hits': 0, 'misses': 20}
+
+
+def test_get_or_set_uses_ttl_from_value():
+    """A callable ttl decides how long each computed value is kept."""
+    cache = TTLCache(60)
+    calls = []
+
+    def compute():
+        calls.append(None)
+        return len(calls)
+
+    # Only keep values after the first
+    def ttl(value):
+        return 60 if value > 1 else 0
+
+    assert cache.get_or_set('key', compute, ttl) == 1
+    assert cache.get_or_set('key', compute, ttl) == 2
+    assert cache.get_or_set('key', compute, ttl) == 2
+    assert len(calls) == 2
+
+
+def test_get_or_set_releases_waiters_on_error():
+    """A failed computation doesn't leave the key stuck as pending."""
+    cache = TTLCache(60)
+
+    def fail():
+        raise RuntimeError('lookup failed')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_set('key', fail)
+
+    # The failed call left nothing pending or cached behind
+    assert cache.get_or_set('key', lambda: 'value') == 'value'
+
+
+def compute_in_background(cache, key, value):
+    """Start computing a value for key, returning the release event."""
+    started = Event()
+    release = Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        return value
+
+    thread = Thread(target=cache.get_or_set, args=(key, compute))
+    thread.start()
+    started.wait(5)
+
+    return release, thread
+
+
+def test_invalidated_computation_is_not_cached():
+    """A value whose key is deleted while it's computed isn't stored."""
+    for invalidate in (
+            lambda cache: cache.delete('key'),
+            lambda cache: cache.delete_matching(lambda key: key == 'key'),
+            lambda cache: cache.clear()
+    ):
+        cache = TTLCache(60)
+        release, thread = compute_in_background(cache, 'key', 'stale')
+
+        invalidate(cache)
+        release.set()
+        thread.join(5)
+
+        assert cache.get('key') is None
+        assert cache.get_or_set('key', lambda: 'fresh') == 'fresh'
+
+
+def test_waiters_recompute_after_invalidation():
+    """Callers waiting on an invalidated computation don't get its value."""
+    cache = TTLCache(60)
+    release, thread = compute_in_background(cache, 'key', 'stale')
+    results = []
+
+    waiter = Thread(target=lambda: results.append(
+        cache.get_or_set('key', lambda: 'fresh')))
+    waiter.start()
+    sleep(0.05)
+
+    cache.delete('key')
+    waiter.join(5)
+    release.set()
+    thread.join(5)
+
+    assert results == ['fresh']
+    assert cache.get('key') == 'fresh'
+
+
+def test_set_drops_values_from_before_invalidation():
+    """A value computed before an invalidation is not stored by set."""
+    cache = TTLCache(60)
+    generation = cache.generation
+
+    cache.delete('other')
+    cache.set('key', 'stale', generation=generation)
+    assert cache.get('key') is None
+
+    cache.set('key', 'fresh', generation=cache.generation)
+    assert cache.get('key') == 'fresh'
+
+
+def test_forgotten_team_check_is_not_cached(app, fake, team_ids):
+    """Forgetting a team drops the result of a token check in flight."""
+    fake.latency = 0.2
+    fake.overrides['auth.test'] = lambda params: (
+        200, {}, {'ok': False, 'error': 'invalid_auth'})
+
+    with app.app_context():
+        team = storage.get_team(team_ids[0])
+
+    check = Thread(target=roll.is_valid_team_token, args=(team,))
+    check.start()
+    sleep(0.1)
+
+    # The team authorizes again while the old token is being checked
+    roll.forget_team(team_ids[0])
+    check.join(5)
+
+    assert roll.token_cache.get((team_ids[0], False)) is None
+
+
+def test_concurrent_token_checks_share_one_auth_test(app, fake, team_ids):
+    """Simultaneous rolls for one team make a single auth.test call."""
+    fake.latency = 0.05
+
+    with app.app_context():
+        team = storage.get_team(team_ids[0])
+
+    results = call_together(lambda: roll.is_valid_team_token(team))
+
+    assert all(results)
+    assert [method for method, _ in fake.calls] == ['auth.test']
+
+
+def test_concurrent_team_lookups_share_one_query(app, team_ids,
+                                                 monkeypatch):
+    """Simultaneous rolls for one team read it from the database once."""
+    loads = []
+    load_team = storage.load_team
+
+    def counting_load(team_id):
+        loads.append(team_id)
+        sleep(0.05)
+        with app.app_context():
+            return load_team(team_id)
+
+    monkeypatch.setattr(storage, 'load_team', counting_load)
+    teams = call_together(lambda: storage.get_team(team_ids[0]))
+
+    assert {team.id for team in teams} == {team_ids[0]}
+    assert loads == [team_ids[0]]
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from slack_roll import allowed_commands, roll
+
+from benchmarks.concurrency import INVALID_ROLLS, MESSAGES, VALID_ROLLS
+
+
+def get_message(text, command):
+    """Return the message a roll is answered with, or None for a roll."""
+    try:
+        roll.parse_roll({'text': text, 'command': command})
+    except roll.RollMessage as msg:
+        return str(msg)
+    return None
+
+
+def run_request(request):
+    """Parse and roll one request, returning what it was answered with."""
+    request_id, text, command = request
+
+    try:
+        result = roll.parse_roll({'text': text, 'command': command})
+    except roll.RollMessage as msg:
+        return str(msg)
+
+    return str(result.expression), roll.do_roll(result, f'user{request_id}')
+
+
+def test_messages_name_their_command():
+    """Help and errors are written for the command that was used."""
+    assert '/rolldice' in get_message('help', '/rolldice')
+    assert get_message('bogus', '/roll').startswith("'bogus'")
+    assert get_message('2d6', '/roll') is None
+
+
+def test_concurrent_requests_get_their_own_responses():
+    """Thousands of mixed rolls across threads each get the right reply."""
+    rng = random.Random(7)
+    texts = list(VALID_ROLLS) + INVALID_ROLLS + MESSAGES
+
+    # Work out the correct messages one at a time first
+    expected = {
+        (text, command): get_message(text, command)
+        for text in INVALID_ROLLS + MESSAGES
+        for command in allowed_commands
+    }
+
+    requests = [
+        (request_id, rng.choice(texts), rng.choice(allowed_commands))
+        for request_id in range(3000)
+    ]
+
+    with ThreadPoolExecutor(32) as pool:
+        responses = list(pool.map(run_request, requests))
+
+    for (request_id, text, command), response in zip(requests, responses):
+        if text in VALID_ROLLS:
+            expression, message = response
+            assert expression == VALID_ROLLS[text]
+            assert message.startswith(f'_user{request_id} rolled ')
+        else:
+            assert response == expected[(text, command)]
+
+
+def test_concurrent_slash_commands_get_their_own_responses(app, fake,
+                                                           team_ids):
+    """Rolls through make_roll are each answered or posted correctly."""
+    rng = random.Random(7)
+    texts = list(VALID_ROLLS) + INVALID_ROLLS + MESSAGES
+
+    expected = {
+        (text, command): get_message(text, command)
+        for text in INVALID_ROLLS + MESSAGES
+        for command in allowed_commands
+    }
+
+    requests = [
+        (request_id, rng.choice(texts), rng.choice(allowed_commands))
+        for request_id in range(300)
+    ]
+
+    def post(request):
+        request_id, text, command = request
+        return app.test_client().post('/', data={
+            'command': command,
+            'team_id': team_ids[request_id % len(team_ids)],
+            'channel_id': f'C{request_id}',
+            'user_name': f'user{request_id}',
+            'text': text
+        })
+
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(post, requests))
+
+    # Each roll is posted once, to its own channel
+    posted = {
+        params['channel']: params['text']
+        for method, params in fake.calls if method == 'chat.postMessage'
+    }
+
+    for (request_id, text, command), response in zip(requests, responses):
+        if text in VALID_ROLLS:
+            assert response.status_code == 204
+            assert posted.pop(f'C{request_id}').startswith(
+                f'_user{request_id} rolled ')
+        else:
+            assert response.get_data(as_text=True) == \
+                expected[(text, command)]
+
+    assert not posted
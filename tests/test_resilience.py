@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+from time import perf_counter, sleep
+
+import pytest
+
+from slack_roll import roll, slack
+from slack_roll.resilience import CircuitBreaker, ConcurrencyLimiter
+
+
+def post_roll(client, team_id, text='2d6'):
+    """Send a slash command, returning the response and its latency."""
+    start = perf_counter()
+    response = client.post('/', data={
+        'command': '/roll',
+        'team_id': team_id,
+        'channel_id': 'C1',
+        'user_name': 'alice',
+        'text': text
+    })
+    return response, perf_counter() - start
+
+
+def test_breaker_opens_after_threshold():
+    """Failures in a row open the breaker, and it refuses calls."""
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.stats() == {'failures': 3, 'trips': 1, 'rejected': 1}
+
+
+def test_breaker_lets_one_trial_through():
+    """Once reset_timeout passes a single trial call decides the state."""
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    sleep(0.06)
+
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed trial keeps it open for another reset_timeout
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    sleep(0.06)
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_limiter_sheds_excess():
+    """Requests over the limit are turned away once max_wait passes."""
+    limiter = ConcurrencyLimiter(2, max_wait=0.05)
+
+    assert limiter.acquire()
+    assert limiter.acquire()
+
+    start = perf_counter()
+    assert not limiter.acquire()
+    assert perf_counter() - start >= 0.05
+    assert not limiter.acquire(wait=0)
+
+    limiter.release()
+    assert limiter.acquire(wait=0)
+    assert limiter.stats() == {'active': 2, 'shed': 2}
+
+
+def test_timeouts_fit_the_deadline(app):
+    """Connecting and reading together never outlast the deadline."""
+    with app.test_request_context():
+        assert slack.get_timeout() == (
+            app.config['SLACK_CONNECT_TIMEOUT'],
+            app.config['SLACK_READ_TIMEOUT']
+        )
+
+        slack.set_deadline(1.0)
+        connect, read = slack.get_timeout()
+        assert connect + read <= 1.0
+
+        slack.set_deadline(-1)
+        with pytest.raises(slack.DeadlineExceeded):
+            slack.get_timeout()
+
+
+def test_hanging_slack_fails_fast_and_recovers(app, fake, team_ids,
+                                               monkeypatch):
+    """Rolls beat the deadline, then the breaker opens and later closes."""
+    monkeypatch.setitem(app.config, 'SLACK_DEADLINE', 0.3)
+    monkeypatch.setattr(slack.breaker, 'threshold', 2)
+    monkeypatch.setattr(slack.breaker, 'reset_timeout', 0.5)
+    client = app.test_client()
+
+    # Check the team's tokens while Slack still works
+    response, _ = post_roll(client, team_ids[0])
+    assert response.status_code == 204
+
+    fake.latency = 2.0
+
+    # Each call gives up at the deadline until the breaker opens
+    for _ in range(2):
+        response, elapsed = post_roll(client, team_ids[0])
+        assert response.get_data(as_text=True) == roll.unavailable_error
+        assert elapsed < 1.0
+
+    assert slack.breaker.state == 'open'
+    calls = len(fake.calls)
+
+    # Now rolls fail without calling Slack, and help still works
+    response, elapsed = post_roll(client, team_ids[0])
+    assert response.get_data(as_text=True) == roll.unavailable_error
+    assert elapsed < 0.1
+    assert len(fake.calls) == calls
+
+    response, elapsed = post_roll(client, team_ids[0], 'help')
+    assert response.status_code == 200
+    assert 'roll' in response.get_data(as_text=True)
+    assert elapsed < 0.1
+
+    # Slack comes back, and the trial call closes the breaker
+    fake.latency = 0.0
+    sleep(0.5)
+
+    response, _ = post_roll(client, team_ids[0])
+    assert response.status_code == 204
+    assert slack.breaker.state == 'closed'
+
+
+def test_rolls_over_the_limit_are_shed(app, fake, team_ids, monkeypatch):
+    """A roll arriving while every slot is busy gets the busy message."""
+    limiter = ConcurrencyLimiter(1)
+    monkeypatch.setattr(roll, 'roll_limiter', limiter)
+    client = app.test_client()
+
+    limiter.acquire()
+    response, elapsed = post_roll(client, team_ids[0])
+
+    assert response.get_data(as_text=True) == roll.busy_error
+    assert elapsed < 0.1
+    assert not fake.calls
+
+    limiter.release()
+    response, _ = post_roll(client, team_ids[0])
+    assert response.status_code == 204
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import asyncio
+
+import pytest
+
+from slack_roll import roll, slack
+
+
+# A host outside SLACK_RESPONSE_URL_PREFIX that must never be posted to
+OTHER_URL = 'http://127.0.0.1:9/internal'
+
+
+def make_args(fake, response_url):
+    """Build slash command args with the given response_url."""
+    return {
+        'command': '/roll',
+        'team_id': 'T00000000',
+        'channel_id': 'C1',
+        'user_name': 'alice',
+        'text': '2d6',
+        'response_url': response_url if response_url != 'slack'
+        else f'{fake.url}response'
+    }
+
+
+def test_replies_only_go_to_slack(app, fake):
+    """Private replies are sent to Slack's response_url and nowhere else."""
+    roll.send_response(make_args(fake, 'slack'), 'hello')
+    assert [method for method, _ in fake.calls] == ['response']
+
+    roll.send_response(make_args(fake, OTHER_URL), 'hello')
+    roll.send_response({'team_id': 'T00000000'}, 'hello')
+    assert len(fake.calls) == 1
+    assert slack.breaker.failures == 0
+
+
+def test_async_replies_only_go_to_slack(app, fake):
+    """The ASGI app checks the response_url the same way."""
+    asgi = pytest.importorskip('slack_roll.asgi')
+
+    async def reply():
+        try:
+            await asgi.send_response(make_args(fake, 'slack'), 'hello')
+            await asgi.send_response(make_args(fake, OTHER_URL), 'hello')
+        finally:
+            await asgi.slack.close()
+
+    asyncio.run(reply())
+    assert [method for method, _ in fake.calls] == ['response']
+
+
+def test_rolls_only_post_to_slack_response_urls(app, fake, monkeypatch):
+    """Only a Slack response_url is used instead of the team's tokens."""
+    monkeypatch.setitem(app.config, 'POST_MODE', 'response_url')
+    monkeypatch.setitem(app.config, 'SLACK_SIGNING_SECRET', 'secret')
+
+    assert roll.uses_response_url(make_args(fake, 'slack'))
+    assert not roll.uses_response_url(make_args(fake, OTHER_URL))
+    assert not roll.uses_response_url(make_args(fake, None))
+
+
+def test_failed_queued_roll_does_not_reply_elsewhere(app, fake, team_ids,
+                                                     monkeypatch):
+    """A queued roll that fails doesn't report back to a foreign host."""
+    monkeypatch.setitem(app.config, 'DELIVERY_MODE', 'queue')
+    fake.overrides['chat.postMessage'] = lambda params: (
+        200, {}, {'ok': False, 'error': 'channel_not_found'})
+
+    response = app.test_client().post('/', data={
+        **make_args(fake, OTHER_URL),
+        'team_id': team_ids[0]
+    })
+
+    assert response.status_code == 204
+    roll.delivery_queue.join()
+    assert 'response' not in [method for method, _ in fake.calls]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import math
+from collections import Counter
+
+import pytest
+
+from slack_roll import rng
+from slack_roll.expression import compile_roll
+
+
+# Dice to test, including sizes that need rejection sampling
+SIDES = (2, 6, 7, 20, 100)
+
+# z-score for a one in a million false failure rate
+Z_CRITICAL = 4.75
+
+
+def chi_square(faces, sides):
+    """Return the chi-square statistic and critical value for a die."""
+    counts = Counter(int(face) for face in faces)
+    assert set(counts) <= set(range(1, sides + 1))
+
+    expected = len(faces) / sides
+    statistic = sum(
+        (counts[face] - expected) ** 2 / expected
+        for face in range(1, sides + 1)
+    )
+
+    # Wilson-Hilferty approximation of the critical value
+    freedom = sides - 1
+    critical = freedom * (
+        1 - 2 / (9 * freedom) +
+        Z_CRITICAL * math.sqrt(2 / (9 * freedom))
+    ) ** 3
+
+    return statistic, critical
+
+
+@pytest.mark.parametrize('sides', SIDES)
+@pytest.mark.parametrize('backend', [
+    rng.FastRandom(),
+    rng.SeededRandom(1234),
+    rng.SecureRandom()
+], ids=['fast', 'seeded', 'secure'])
+def test_faces_are_uniform(backend, sides):
+    """Every face comes up equally often, in large and small pools."""
+    # Collect many small rolls, which skip NumPy
+    faces = []
+    for _ in range(2000):
+        faces.extend(backend.roll(10, sides))
+
+    statistic, critical = chi_square(faces, sides)
+    assert statistic <= critical
+
+    statistic, critical = chi_square(backend.roll(200000, sides), sides)
+    assert statistic <= critical
+
+
+@pytest.mark.parametrize('sides', range(2, 256))
+def test_secure_rejection_is_unbiased(sides):
+    """Accepted bytes map onto every face the same number of times."""
+    translation, rejected = rng.SecureRandom()._table(sides)
+    accepted = bytes(range(256)).translate(translation, rejected)
+
+    counts = Counter(accepted)
+    assert set(counts) == set(range(1, sides + 1))
+    assert len(set(counts.values())) == 1
+
+
+def test_secure_rejects_unsupported_sides():
+    """Dice outside 2-255 sides can't be drawn from single bytes."""
+    backend = rng.SecureRandom()
+
+    for sides in (1, 256):
+        with pytest.raises(ValueError):
+            backend.roll(1, sides)
+
+
+def test_seeded_streams_repeat():
+    """The same seed gives the same rolls, and reseeding restarts it."""
+    first = rng.SeededRandom(42)
+    second = rng.SeededRandom(42)
+    rolls = first.roll(50, 20)
+
+    assert rolls == second.roll(50, 20)
+
+    first.seed(42)
+    assert rolls == first.roll(50, 20)
+
+
+def test_seeded_backend_replays_rolls():
+    """With a seeded backend set, the roll engine repeats its rolls."""
+    original = rng.get_rng()
+    seeded = rng.SeededRandom(7)
+    expression = compile_roll('4d6kh3+2d8 hit5')
+
+    rng.set_rng(seeded)
+    try:
+        first = expression.evaluate(100)
+        seeded.seed(7)
+        assert expression.evaluate(100) == first
+    finally:
+        rng.set_rng(original)
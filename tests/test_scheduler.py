@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+import re
+import asyncio
+from time import monotonic
+from types import SimpleNamespace
+from threading import Event, Lock
+
+import pytest
+
+from slack_roll import roll, storage
+from slack_roll.scheduler import PostScheduler
+
+
+class RateLimitedChannel:  # pylint: disable=too-few-public-methods
+    """Answer chat.postMessage with 429s above a per-channel rate."""
+
+    def __init__(self, rate):
+        """Allow rate posts per second in each channel."""
+        self.rate = rate
+        self.last = {}
+        self.posted = {}
+        self.rejected = 0
+        self._lock = Lock()
+
+    def __call__(self, params):
+        """Accept or rate limit a post."""
+        channel = params['channel']
+        now = monotonic()
+
+        with self._lock:
+            if now - self.last.get(channel, 0) < 1 / self.rate:
+                self.rejected += 1
+                return 429, {'Retry-After': '0.2'}, {
+                    'ok': False, 'error': 'ratelimited'}
+
+            self.last[channel] = now
+            self.posted.setdefault(channel, []).append(params['text'])
+
+        return 200, {}, {'ok': True}
+
+
+class RateLimited(Exception):
+    """Stands in for a 429 from Slack."""
+
+
+def make_scheduler(post, failures, **options):
+    """Create a scheduler that treats RateLimited as a 0.1s rate limit."""
+    return PostScheduler(
+        post,
+        lambda err, *job: failures.append((err, job)),
+        lambda err: not isinstance(err, ValueError),
+        lambda err: 0.1 if isinstance(err, RateLimited) else None,
+        **{'backoff': 0.01, 'team_limit': (100, 100),
+           'channel_limit': (100, 100), **options}
+    )
+
+
+def make_job(text, team_id='T1', channel_id='C1'):
+    """Build a (team, text, args) job."""
+    return SimpleNamespace(id=team_id), text, {'channel_id': channel_id}
+
+
+def test_rate_limited_posts_wait_and_are_sent_once():
+    """A 429 pauses the team for Retry-After, then the post goes out."""
+    posted = []
+    failures = []
+    times = []
+
+    def post(_, text, __):
+        times.append(monotonic())
+        if len(times) == 1:
+            raise RateLimited()
+        posted.append(text)
+
+    scheduler = make_scheduler(post, failures, coalesce=False)
+    for index in range(3):
+        assert scheduler.submit(*make_job(f'roll {index}'))
+
+    assert scheduler.join(5)
+    assert posted == ['roll 0', 'roll 1', 'roll 2']
+    assert times[1] - times[0] >= 0.1
+    assert not failures
+    assert scheduler.stats()['rate_limited'] == 1
+
+
+def test_already_rate_limited_job_waits():
+    """A job submitted with a pause isn't sent before the pause ends."""
+    times = []
+    scheduler = make_scheduler(
+        lambda *_: times.append(monotonic()), [])
+
+    start = monotonic()
+    scheduler.submit(*make_job('roll'), pause=0.2)
+
+    assert scheduler.join(5)
+    assert times[0] - start >= 0.2
+
+
+def test_backed_up_rolls_are_coalesced():
+    """Rolls waiting on a channel's limit are sent as one message."""
+    posted = []
+    scheduler = make_scheduler(
+        lambda _, text, __: posted.append(text), [],
+        channel_limit=(5, 1))
+
+    for index in range(5):
+        scheduler.submit(*make_job(f'roll {index}'))
+
+    assert scheduler.join(5)
+    assert '\n'.join(posted) == '\n'.join(f'roll {i}' for i in range(5))
+    assert len(posted) < 5
+    assert scheduler.stats()['coalesced'] == 5 - len(posted)
+
+
+def test_permanent_errors_give_up():
+    """Errors that aren't worth retrying are reported once per roll."""
+    failures = []
+
+    def post(*_):
+        raise ValueError('channel_not_found')
+
+    scheduler = make_scheduler(post, failures, coalesce=False)
+    scheduler.submit(*make_job('roll 0'))
+    scheduler.submit(*make_job('roll 1'))
+
+    assert scheduler.join(5)
+    assert [job[1] for _, job in failures] == ['roll 0', 'roll 1']
+    assert scheduler.stats()['failed'] == 2
+
+
+def test_full_queue_rejects_jobs():
+    """Jobs over max_size are turned away instead of queued."""
+    scheduler = make_scheduler(
+        lambda *_: None, [], max_size=2, team_limit=(0.001, 0))
+
+    assert scheduler.submit(*make_job('roll 0'))
+    assert scheduler.submit(*make_job('roll 1'))
+    assert not scheduler.submit(*make_job('roll 2'))
+
+
+def test_channels_are_pending_until_posted():
+    """A channel is pending while its rolls are queued or being posted."""
+    release = Event()
+    scheduler = make_scheduler(lambda *_: release.wait(5), [])
+    team, text, args = make_job('roll')
+
+    assert not scheduler.is_pending(team, 'C1')
+    scheduler.submit(team, text, args)
+    assert scheduler.is_pending(team, 'C1')
+    assert not scheduler.is_pending(team, 'C2')
+
+    release.set()
+    assert scheduler.join(5)
+    assert not scheduler.is_pending(team, 'C1')
+
+
+def test_rolls_survive_slack_rate_limits(app, fake, team_ids, monkeypatch):
+    """Every roll is posted once and in order despite 429s from Slack."""
+    monkeypatch.setitem(app.config, 'DELIVERY_MODE', 'schedule')
+    limiter = RateLimitedChannel(10)
+    fake.overrides['chat.postMessage'] = limiter
+    client = app.test_client()
+    sent = {}
+
+    for index in range(40):
+        channel = f'C{index % 2}'
+        sent.setdefault(channel, []).append(index)
+
+        response = client.post('/', data={
+            'command': '/roll',
+            'team_id': team_ids[0],
+            'channel_id': channel,
+            'user_name': f'user{index}',
+            'text': '2d6'
+        })
+        assert response.status_code == 204
+
+    assert roll.post_scheduler.join(15)
+    assert limiter.rejected
+
+    for channel, expected in sent.items():
+        numbers = [
+            int(number)
+            for text in limiter.posted[channel]
+            for number in re.findall(r'_user(\d+) rolled', text)
+        ]
+        assert numbers == expected
+
+
+def test_inline_rate_limit_is_queued(app, fake, team_ids):
+    """A roll that gets a 429 inline is posted later by the scheduler."""
+    responses = [
+        (429, {'Retry-After': '0.1'}, {'ok': False, 'error': 'ratelimited'})
+    ]
+    fake.overrides['chat.postMessage'] = lambda params: \
+        responses.pop() if responses else (200, {}, {'ok': True})
+
+    response = app.test_client().post('/', data={
+        'command': '/roll',
+        'team_id': team_ids[0],
+        'channel_id': 'C1',
+        'user_name': 'alice',
+        'text': '2d6'
+    })
+
+    assert response.status_code == 204
+    assert roll.post_scheduler.join(5)
+    assert [method for method, _ in fake.calls].count('chat.postMessage') == 2
+
+
+def test_rolls_after_inline_rate_limit_stay_in_order(app, fake, team_ids):
+    """Rolls sent while a channel has queued rolls are queued behind them."""
+    responses = [
+        (429, {'Retry-After': '0.2'}, {'ok': False, 'error': 'ratelimited'})
+    ]
+    posted = []
+
+    def post_message(params):
+        if responses:
+            return responses.pop()
+        posted.append(params['text'])
+        return 200, {}, {'ok': True}
+
+    fake.overrides['chat.postMessage'] = post_message
+    client = app.test_client()
+
+    for index in range(4):
+        response = client.post('/', data={
+            'command': '/roll',
+            'team_id': team_ids[0],
+            'channel_id': 'C1',
+            'user_name': f'user{index}',
+            'text': '2d6'
+        })
+        assert response.status_code == 204
+
+    assert roll.post_scheduler.join(5)
+    numbers = [
+        int(number)
+        for text in posted
+        for number in re.findall(r'_user(\d+) rolled', text)
+    ]
+    assert numbers == [0, 1, 2, 3]
+
+
+def test_inline_rate_limit_with_full_queue_is_busy(app, fake, team_ids,
+                                                   monkeypatch):
+    """A 429 that can't be queued gets the busy message, not an error."""
+    fake.overrides['chat.postMessage'] = lambda params: (
+        429, {'Retry-After': '1'}, {'ok': False, 'error': 'ratelimited'})
+    monkeypatch.setattr(roll.post_scheduler, 'submit', lambda *_, **__: False)
+
+    response = app.test_client().post('/', data={
+        'command': '/roll',
+        'team_id': team_ids[0],
+        'channel_id': 'C1',
+        'user_name': 'alice',
+        'text': '2d6'
+    })
+
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == roll.busy_error
+
+
+def test_async_delivery_stops_retrying_rate_limits(app, fake, team_ids,
+                                                   monkeypatch):
+    """Background posts from the ASGI app give up after the retries."""
+    asgi = pytest.importorskip('slack_roll.asgi')
+
+    monkeypatch.setitem(app.config, 'DELIVERY_RETRIES', 2)
+    fake.overrides['chat.postMessage'] = lambda params: (
+        429, {'Retry-After': '0'}, {'ok': False, 'error': 'ratelimited'})
+
+    with app.app_context():
+        team = storage.get_team(team_ids[0])
+    args = {
+        'team_id': team_ids[0],
+        'channel_id': 'C1',
+        'response_url': f'{fake.url}response'
+    }
+
+    asyncio.run(asyncio.wait_for(asgi.deliver_roll(team, 'roll', args), 5))
+
+    assert [method for method, _ in fake.calls] == \
+        ['chat.postMessage'] * 3 + ['response']
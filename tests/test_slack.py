@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from slacker import Auth, Chat
+
+from slack_roll import slack
+
+
+@pytest.fixture
+def session(app):
+    """Start each test with a new shared session and no open sockets."""
+    slack.reset_session()
+    yield slack.get_session()
+    slack.reset_session()
+
+
+def call_slack(index):
+    """Alternate between the two API calls a roll makes."""
+    if index % 2:
+        slack.get_api(Auth, 'xoxp-fake').test()
+    else:
+        slack.get_api(Chat, 'xoxb-fake').post_message('C1', 'hi')
+
+
+def test_calls_reuse_one_connection(fake, session):
+    """Back to back calls share a single keep-alive connection."""
+    for index in range(20):
+        call_slack(index)
+
+    assert len(fake.calls) == 20
+    assert fake.connections == 1
+
+
+def test_threads_share_the_pool(app, fake, session):
+    """Calls from many threads open at most one connection per thread."""
+    threads = min(8, app.config['SLACK_POOL_SIZE'])
+
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(call_slack, range(400)))
+
+    assert len(fake.calls) == 400
+    assert fake.connections <= threads
+
+
+def test_roll_reuses_connection(app, fake, session, team_ids):
+    """A slash command's token checks and post share a connection."""
+    client = app.test_client()
+
+    for _ in range(3):
+        response = client.post('/', data={
+            'command': '/roll',
+            'team_id': team_ids[0],
+            'channel_id': 'C1',
+            'user_id': 'U1',
+            'user_name': 'alice',
+            'text': '2d6'
+        })
+        assert response.status_code == 204
+
+    assert [method for method, _ in fake.calls] == \
+        ['auth.test', 'auth.test'] + ['chat.postMessage'] * 3
+    assert fake.connections == 1
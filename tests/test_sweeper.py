@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Copyright (c) 2015-2021 Erin Morelli.
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+"""
+
+
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from slack_roll import roll, storage, sweeper
+from slack_roll.storage import db, Team
+
+
+def revoke(token):
+    """Answer auth.test for one token with token_revoked."""
+    def answer(params):
+        if params.get('token') == token:
+            return 200, {}, {'ok': False, 'error': 'token_revoked'}
+        return 200, {}, {'ok': True}
+    return answer
+
+
+def set_team(app, team_id, **values):
+    """Change columns on a stored team."""
+    with app.app_context():
+        db.session.execute(
+            Team.__table__.update()
+            .where(Team.__table__.c.id == team_id)
+            .values(**values)
+        )
+        db.session.commit()
+
+
+def get_statuses(app):
+    """Return each team's stored token status."""
+    with app.app_context():
+        return {
+            team.id: team.token_status
+            for team in db.session.execute(Team.__table__.select())
+        }
+
+
+def roll_args(team_id):
+    """Build slash command form data for a team."""
+    return {
+        'command': '/roll',
+        'team_id': team_id,
+        'channel_id': 'C1',
+        'user_name': 'alice',
+        'text': '2d6'
+    }
+
+
+def test_sweep_records_each_status(app, fake, team_ids):
+    """Good, revoked, missing and unreadable tokens are told apart."""
+    fake.overrides['auth.test'] = revoke('xoxb-revoked')
+    set_team(app, team_ids[0],
+             encrypted_bot_token=storage.get_cipher().encrypt(b'xoxb-revoked'))
+    set_team(app, team_ids[1], encrypted_bot_token=None)
+
+    counts = sweeper.sweep_tokens(batch_size=2, workers=2, rate=1000)
+
+    assert counts == {'token_revoked': 1, 'missing': 1, 'ok': 1}
+    assert get_statuses(app) == {
+        team_ids[0]: 'token_revoked',
+        team_ids[1]: 'missing',
+        team_ids[2]: 'ok'
+    }
+
+    set_team(app, team_ids[2], encrypted_token=b'not a fernet token')
+    sweeper.sweep_tokens(rate=1000)
+    assert get_statuses(app)[team_ids[2]] == 'undecryptable'
+
+
+def test_sweep_skips_recently_validated(app, fake, team_ids):
+    """Only teams not validated within stale_after are checked."""
+    set_team(app, team_ids[0], token_status='ok',
+             last_validated_at=datetime.now())
+
+    counts = sweeper.sweep_tokens(rate=1000, stale_after=3600)
+
+    assert sum(counts.values()) == 2
+    assert len(fake.calls) == 4
+
+
+def test_sweep_waits_out_rate_limits(app, fake, team_ids):
+    """A 429 pauses the sweep, and the token is checked again."""
+    responses = [(429, {'Retry-After': '0.2'}, {'ok': False})]
+    fake.overrides['auth.test'] = lambda params: \
+        responses.pop() if responses else (200, {}, {'ok': True})
+
+    start = perf_counter()
+    counts = sweeper.sweep_tokens(workers=1, rate=1000)
+
+    assert counts == {'ok': len(team_ids)}
+    assert perf_counter() - start >= 0.2
+    assert len(fake.calls) == 2 * len(team_ids) + 1
+
+
+def test_unreachable_slack_keeps_status(app, fake, team_ids):
+    """A check that can't reach Slack leaves the last status alone."""
+    set_team(app, team_ids[0], token_status='ok')
+    fake.overrides['auth.test'] = lambda params: (503, {}, {'ok': False})
+
+    counts = sweeper.sweep_tokens(rate=1000)
+
+    assert counts == {'unreachable': len(team_ids)}
+    assert get_statuses(app)[team_ids[0]] == 'ok'
+
+
+def test_rate_limiter_paces_calls():
+    """Calls are spread out to the configured rate after a burst."""
+    limiter = sweeper.RateLimiter(50)
+
+    start = perf_counter()
+    for _ in range(70):
+        limiter.wait()
+
+    assert perf_counter() - start >= 0.35
+
+
+def test_reauthorized_team_keeps_new_status(app, fake, team_ids,
+                                            monkeypatch):
+    """A team re-authorized during its check isn't overwritten."""
+    fake.overrides['auth.test'] = revoke('xoxp-fake')
+    check_team = sweeper.check_team
+
+    def reauthorize_during_check(row, limiter):
+        result = check_team(row, limiter)
+        if row[0] == team_ids[1]:
+            with app.app_context():
+                team = db.session.get(Team, team_ids[1])
+                team.set_token('xoxp-new')
+                db.session.commit()
+        return result
+
+    monkeypatch.setattr(sweeper, 'check_team', reauthorize_during_check)
+    sweeper.sweep_tokens(workers=1, rate=1000)
+
+    statuses = get_statuses(app)
+    assert statuses[team_ids[0]] == 'token_revoked'
+    assert statuses[team_ids[1]] is None
+
+
+def test_rolls_trust_a_recent_sweep(app, fake, team_ids):
+    """A healthy, recent status skips the live token check."""
+    set_team(app, team_ids[0], token_status='ok',
+             last_validated_at=datetime.now())
+    set_team(app, team_ids[1], token_status='ok',
+             last_validated_at=datetime.now() - timedelta(days=1))
+    client = app.test_client()
+
+    assert client.post('/', data=roll_args(team_ids[0])).status_code == 204
+    assert [method for method, _ in fake.calls] == ['chat.postMessage']
+
+    fake.calls.clear()
+    assert client.post('/', data=roll_args(team_ids[1])).status_code == 204
+    assert [method for method, _ in fake.calls] == \
+        ['auth.test', 'auth.test', 'chat.postMessage']
+
+
+def test_revoked_post_forgets_team(app, fake, team_ids):
+    """A post refused for a revoked token asks the team to authorize."""
+    set_team(app, team_ids[0], token_status='ok',
+             last_validated_at=datetime.now())
+    fake.overrides['chat.postMessage'] = lambda params: (
+        200, {}, {'ok': False, 'error': 'token_revoked'})
+    client = app.test_client()
+
+    response = client.post('/', data=roll_args(team_ids[0]))
+
+    assert response.get_data(as_text=True) == roll.auth_error
+    assert storage.team_cache.get(team_ids[0]) is None
+    assert get_statuses(app)[team_ids[0]] is None